@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Compares the compiled fact validator with :func:`monk.validate` on
+a synthetic day file of 200 facts.
+"""
+# python
+import datetime
+import timeit
+
+# 3rd-party
+import monk
+
+# app
+from timetra.diary.models import Fact
+from timetra.diary.validation import compile_validator
+
+
+def make_day(cnt=200):
+    start = datetime.datetime(2014, 1, 1)
+    step = datetime.timedelta(minutes=1440 // cnt)
+    facts = []
+    for i in range(cnt):
+        since = start + step * i
+        facts.append(Fact(activity='activity{}'.format(i % 10),
+                          category='category{}'.format(i % 3),
+                          since=since, until=since + step,
+                          tags=['tag{}'.format(i % 5)],
+                          description='Fact #{}'.format(i)))
+    return facts
+
+
+if __name__ == '__main__':
+    facts = make_day()
+    validate = compile_validator(Fact.structure)
+
+    def with_monk():
+        for fact in facts:
+            monk.validate(Fact.structure, fact)
+
+    def compiled():
+        for fact in facts:
+            validate(fact, 'bench.yaml')
+
+    number = 20
+    monk_time = min(timeit.repeat(with_monk, number=number, repeat=3))
+    compiled_time = min(timeit.repeat(compiled, number=number, repeat=3))
+
+    print('monk:     {:.2f} ms per day'.format(monk_time / number * 1000))
+    print('compiled: {:.2f} ms per day'.format(compiled_time / number * 1000))
+    print('speed-up: {:.0f}x'.format(monk_time / compiled_time))
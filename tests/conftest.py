@@ -0,0 +1,18 @@
+# coding: utf-8
+
+# python
+import os
+
+# 3rd-party
+import pytest
+
+
+@pytest.fixture
+def in_memory_files(tmpdir, monkeypatch):
+    """
+    Makes any path look like the same existing and unchanged file, so that
+    the files of a test can be kept in memory under made-up paths.
+    """
+    path = str(tmpdir.join('in-memory').ensure())
+    stat = os.stat
+    monkeypatch.setattr(os, 'stat', lambda *args, **kwargs: stat(path))
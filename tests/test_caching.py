@@ -0,0 +1,391 @@
+# coding: utf-8
+
+# python
+from datetime import datetime
+import os
+
+# 3rd-party
+import pytest
+
+# this app
+from timetra.diary import caching
+from timetra.diary.models import Fact
+
+
+def _write_day_file(path, facts):
+    path.write('\n'.join(
+        '- activity: {}\n  since: {}\n  until: {}\n  description: null'
+        .format(activity, since, until)
+        for activity, since, until in facts))
+
+
+def _populate(tmpdir, cnt):
+    data_dir = tmpdir.mkdir('data')
+    paths = []
+    for day in range(1, cnt+1):
+        path = data_dir.join('{:0>2}.yaml'.format(day))
+        since = datetime(2014,1,day, 10,0)
+        _write_day_file(path, [('walk', since, since.replace(hour=11))])
+        paths.append(str(path))
+    return paths
+
+
+class TestWarm:
+
+    def test_warm(self, tmpdir):
+        paths = _populate(tmpdir, 5)
+        cache = caching.Cache(str(tmpdir.mkdir('cache')))
+
+        cache.get_cached_yaml_file(paths[0], model=Fact)
+
+        assert cache.warm(paths, model=Fact, workers=2, batch_size=2) == 4
+        assert cache.warm(paths, model=Fact, workers=2) == 0
+
+        facts = cache.get_cached_yaml_file(paths[3], model=Fact)
+        assert [x.since for x in facts] == [datetime(2014,1,4, 10,0)]
+
+
+class TestBatch:
+
+    @pytest.mark.parametrize('store', sorted(caching.STORES))
+    def test_batch(self, tmpdir, store, monkeypatch):
+        paths = _populate(tmpdir, 5)
+        cache = caching.Cache(str(tmpdir.mkdir('cache')), store=store)
+        monkeypatch.setattr(caching, 'BATCH_SIZE', 3)
+
+        transactions = []
+        orig_transaction = cache.store.transaction
+        def transaction():
+            transactions.append(len(cache.store.get_entries()))
+            return orig_transaction()
+        monkeypatch.setattr(cache.store, 'transaction', transaction)
+
+        with cache.batch():
+            with cache.batch():
+                for path in paths[:4]:
+                    cache.get_cached_yaml_file(path, model=Fact)
+            assert len(cache.store.get_entries()) == 3
+            # pending entries are used
+            facts = cache.get_cached_yaml_file(paths[3], model=Fact)
+            assert [x.since.day for x in facts] == [4]
+        assert transactions == [0, 3]
+        assert len(cache.store.get_entries()) == 4
+
+        cache.get_cached_yaml_file(paths[4], model=Fact)
+        assert len(transactions) == 2
+        assert len(cache.store.get_entries()) == 5
+
+
+class TestStores:
+
+    @pytest.mark.parametrize('store', sorted(caching.STORES))
+    def test_roundtrip(self, tmpdir, store):
+        paths = _populate(tmpdir, 2)
+        cache_dir = str(tmpdir.mkdir('cache'))
+        cache = caching.Cache(cache_dir, store=store)
+
+        facts = cache.get_cached_yaml_file(paths[0], model=Fact)
+        assert [x.activity for x in facts] == ['walk']
+
+        cache.set_meta('foo', {'bar': 1})
+        cache.store.close()
+
+        cache = caching.Cache(cache_dir, store=store)
+        assert cache.get_meta('foo') == {'bar': 1}
+        assert cache.get_meta('quux', 123) == 123
+        assert list(cache.store.get(paths[0])[2]) == list(facts)
+        assert cache.store.get(paths[1]) is None
+
+    def test_sqlite_transaction(self, tmpdir):
+        store = caching.SQLiteStore(str(tmpdir))
+        with pytest.raises(ZeroDivisionError):
+            with store.transaction():
+                store.set_meta('a', 1)
+                with store.transaction():
+                    store.set_meta('b', 2)
+                1 / 0
+        assert store.get_meta('a') is None
+        assert store.get_meta('b') is None
+
+        with store.transaction():
+            store.set_meta('a', 1)
+        assert store.get_meta('a') == 1
+
+    def test_sqlite_concurrent_readers(self, tmpdir):
+        writer = caching.SQLiteStore(str(tmpdir))
+        reader = caching.SQLiteStore(str(tmpdir))
+        writer.set_meta('a', 1)
+        with writer.transaction():
+            writer.set_meta('a', 2)
+            # readers are not blocked and see the last committed state
+            assert reader.get_meta('a') == 1
+        assert reader.get_meta('a') == 2
+
+
+class TestStamps:
+
+    def test_same_mtime(self, tmpdir):
+        paths = _populate(tmpdir, 1)
+        cache = caching.Cache(str(tmpdir.mkdir('cache')))
+        cache.get_cached_yaml_file(paths[0], model=Fact)
+
+        # rewritten within the same timestamp tick
+        mtime_ns = os.stat(paths[0]).st_mtime_ns
+        since = datetime(2014,1,1, 12,0)
+        _write_day_file(tmpdir.join('data', '01.yaml'),
+                        [('sleep', since, since.replace(hour=13))])
+        os.utime(paths[0], ns=(mtime_ns, mtime_ns))
+
+        facts = cache.get_cached_yaml_file(paths[0], model=Fact)
+        assert [x.activity for x in facts] == ['sleep']
+
+    def test_hash_content(self, tmpdir):
+        paths = _populate(tmpdir, 1)
+        path = tmpdir.join('data', '01.yaml')
+        stat = os.stat(paths[0])
+
+        assert caching.get_file_stamp(paths[0]).digest is None
+        stamp = caching.get_file_stamp(paths[0], hash_content=True)
+        assert stamp.digest is not None
+
+        # same size, same inode, same mtime; only the content differs
+        path.write(path.read().replace('walk', 'work'))
+        os.utime(paths[0], ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+        assert caching.get_file_stamp(paths[0])[:3] == stamp[:3]
+        assert caching.get_file_stamp(paths[0], hash_content=True) != stamp
+
+    def test_journal_stamp(self, tmpdir):
+        paths = _populate(tmpdir, 1)
+        stamp = caching.get_file_stamp(paths[0], journal_suffix='.journal')
+        assert stamp == caching.get_file_stamp(paths[0])
+
+        journal = tmpdir.join('data', '01.yaml.journal')
+        journal.write('[]')
+        with_journal = caching.get_file_stamp(paths[0],
+                                              journal_suffix='.journal')
+        assert with_journal[:3] == stamp[:3]
+        assert with_journal != stamp
+
+        journal.write('[] ')
+        assert caching.get_file_stamp(paths[0], journal_suffix='.journal') \
+            not in (stamp, with_journal)
+
+        journal.remove()
+        assert caching.get_file_stamp(paths[0],
+                                      journal_suffix='.journal') == stamp
+
+
+class TestSizeLimit:
+
+    @pytest.mark.parametrize('store', sorted(caching.STORES))
+    def test_compact(self, tmpdir, store):
+        paths = _populate(tmpdir, 20)
+        # glob patterns in the path are taken literally
+        cache = caching.Cache(str(tmpdir.mkdir('cache[*]')), store=store)
+        for path in paths:
+            cache.get_cached_yaml_file(path, model=Fact)
+        for path in paths[5:]:
+            os.remove(path)
+
+        cnt, reclaimed = cache.compact()
+        assert cnt == 15
+        assert reclaimed >= 0
+        assert sorted(x[0] for x in cache.store.get_entries()) == paths[:5]
+        assert cache.store.get(paths[0])[2][0].activity == 'walk'
+
+    @pytest.mark.parametrize('store', sorted(caching.STORES))
+    def test_reset(self, tmpdir, store):
+        paths = _populate(tmpdir, 3)
+        cache_dir = tmpdir.mkdir('cache[*]')
+        cache = caching.Cache(str(cache_dir), store=store)
+        for path in paths:
+            cache.get_cached_yaml_file(path, model=Fact)
+        assert cache_dir.listdir()
+        cache.reset()
+        assert cache_dir.listdir() == []
+
+    def test_evict_least_recently_used(self, tmpdir, monkeypatch):
+        paths = _populate(tmpdir, 5)
+        cache = caching.Cache(str(tmpdir.mkdir('cache')))
+        for i, path in enumerate(paths):
+            monkeypatch.setattr(caching.time, 'time', lambda: 10000 * i)
+            cache.get_cached_yaml_file(path, model=Fact)
+
+        # the first file is read again much later
+        monkeypatch.setattr(caching.time, 'time', lambda: 100000)
+        cache.get_cached_yaml_file(paths[0], model=Fact)
+
+        size = sum(x[1] for x in cache.store.get_entries())
+        cache.max_size = size * 3 // 5
+        assert cache.evict() == 2
+        cached = sorted(x[0] for x in cache.store.get_entries())
+        assert cached == [paths[0], paths[3], paths[4]]
+
+    @pytest.mark.parametrize('store', sorted(caching.STORES))
+    def test_derived_data_counts(self, tmpdir, store):
+        paths = _populate(tmpdir, 5)
+        cache = caching.Cache(str(tmpdir.mkdir('cache')), store=store)
+        for path in paths:
+            cache.get_cached_yaml_file(path, model=Fact)
+        size = sum(x[1] for x in cache.store.get_entries())
+        cache.max_size = size
+
+        cache.put_summary('foo', paths[0], 'x' * (size // 3))
+        assert cache.evict() == 2
+
+        sidecar = tmpdir.join('cache', 'sidecar.db')
+        sidecar.write('x' * size)
+        cache.add_sidecar(str(sidecar), None)
+        assert cache.evict() == 3
+        assert cache.get_disk_usage() > size
+
+    def test_compact_sidecars(self, tmpdir):
+        cache = caching.Cache(str(tmpdir.mkdir('cache')))
+
+        class Sidecar:
+            collected = vacuumed = 0
+            def collect_garbage(self):
+                self.collected += 1
+                return 3
+            def vacuum(self):
+                self.vacuumed += 1
+
+        sidecar = Sidecar()
+        path = tmpdir.join('cache', 'sidecar.db')
+        cache.add_sidecar(str(path), lambda: sidecar)
+        cache.add_sidecar(str(tmpdir.join('cache', 'missing.db')), None)
+        assert cache.compact()[0] == 0
+        assert sidecar.collected == 0
+
+        path.write('')
+        assert cache.compact()[0] == 3
+        assert (sidecar.collected, sidecar.vacuumed) == (1, 1)
+
+
+class _Counts(caching.CachedSummaries):
+
+    def summarize(self, path, facts):
+        return len(list(facts))
+
+    def _load_state(self, state):
+        self.total = state or 0
+
+    def _dump_state(self):
+        return self.total
+
+    def _on_added(self, path, summary):
+        self.total += summary
+
+    def _on_removed(self, path, summary):
+        self.total -= summary
+
+
+class TestCachedSummaries:
+
+    @pytest.mark.parametrize('store', sorted(caching.STORES))
+    def test_incremental(self, tmpdir, store):
+        paths = _populate(tmpdir, 5)
+        cache = caching.Cache(str(tmpdir.mkdir('cache')), store=store)
+        load = lambda path: cache.get_cached_yaml_file(path, model=Fact)
+        counts = _Counts(cache, 'counts')
+        counts.sync(paths, load=load)
+        assert counts.total == 5
+
+        written = []
+        orig_put_summary = cache.put_summary
+        def put_summary(key, path, value):
+            written.append(path)
+            orig_put_summary(key, path, value)
+        cache.put_summary = put_summary
+
+        # only the changed file's summary is rewritten
+        since = datetime(2014,1,2, 12,0)
+        _write_day_file(tmpdir.join('data', '02.yaml'),
+                        [('walk', since, since.replace(hour=13)),
+                         ('sleep', since.replace(hour=14),
+                          since.replace(hour=15))])
+        counts.sync(paths, load=load)
+        assert written == [paths[1]]
+        assert counts.total == 6
+
+        counts.sync(paths[1:], load=load)
+        assert counts.total == 5
+
+        counts = _Counts(cache, 'counts')
+        assert counts.total == 5
+        assert sorted(counts._files) == paths[1:]
+
+    @pytest.mark.parametrize('store', sorted(caching.STORES))
+    def test_collect_garbage(self, tmpdir, store):
+        paths = _populate(tmpdir, 3)
+        cache = caching.Cache(str(tmpdir.mkdir('cache')), store=store)
+        load = lambda path: cache.get_cached_yaml_file(path, model=Fact)
+        _Counts(cache, 'counts').sync(paths, load=load)
+
+        os.remove(paths[0])
+        assert cache.collect_garbage() == 2
+        assert sorted(cache.get_summaries('counts')) == paths[1:]
+
+        # the state is rebuilt from the remaining summaries
+        assert _Counts(cache, 'counts').total == 2
+
+    def test_tree_stamp(self, tmpdir):
+        paths = _populate(tmpdir, 3)
+        cache = caching.Cache(str(tmpdir.mkdir('cache')))
+        load = lambda path: cache.get_cached_yaml_file(path, model=Fact)
+        counts = _Counts(cache, 'counts')
+        counts.sync(paths, load=load, tree_stamp=1)
+
+        # not even listed while the tree stamp is the same
+        counts = _Counts(cache, 'counts')
+        counts.sync(iter(()), load=load, tree_stamp=1)
+        assert counts.total == 3
+
+        # a file edited in place is only noticed by `refresh()`
+        since = datetime(2014,1,2, 12,0)
+        _write_day_file(tmpdir.join('data', '02.yaml'),
+                        [('walk', since, since.replace(hour=13)),
+                         ('sleep', since.replace(hour=14),
+                          since.replace(hour=15))])
+        os.remove(paths[2])
+        assert counts.refresh(paths, load=load)
+        assert counts.total == 3
+        assert not counts.refresh(paths[:2], load=load)
+        assert _Counts(cache, 'counts').total == 3
+
+        counts.sync(paths[:2], load=load, tree_stamp=2)
+        assert sorted(counts._files) == paths[:2]
+
+    def test_version(self, tmpdir):
+        paths = _populate(tmpdir, 2)
+        cache = caching.Cache(str(tmpdir.mkdir('cache')))
+        load = lambda path: cache.get_cached_yaml_file(path, model=Fact)
+        _Counts(cache, 'counts').sync(paths, load=load)
+
+        class NewCounts(_Counts):
+            VERSION = 2
+
+        counts = NewCounts(cache, 'counts')
+        assert counts._files == {}
+        assert cache.get_summaries('counts') == {}
+
+
+class TestModelVersion:
+
+    def test_stable(self):
+        assert caching.get_model_version(Fact) == \
+            caching.get_model_version(Fact)
+
+    def test_outdated_entries(self, tmpdir, monkeypatch):
+        paths = _populate(tmpdir, 3)
+        cache = caching.Cache(str(tmpdir.mkdir('cache')))
+        assert cache.warm(paths, model=Fact, workers=1) == 3
+
+        # e.g. after an upgrade only one entry was rebuilt so far
+        monkeypatch.setattr(caching, '_model_versions', {Fact: 'new'})
+        cache.get_cached_yaml_file(paths[0], model=Fact)
+        assert cache.store.get_header(paths[0])[1] == 'new'
+        assert cache.store.get_header(paths[1])[1] != 'new'
+
+        assert cache.warm(paths, model=Fact, workers=1) == 2
@@ -0,0 +1,65 @@
+# coding: utf-8
+
+# python
+from datetime import datetime, timedelta
+
+# 3rd-party
+import urwid
+
+# this app
+from timetra.diary.curses import DayView
+from timetra.diary.models import Fact
+from timetra.diary.storage import Storage, YamlBackend
+
+
+class _Storage(Storage):
+    # the name the view expects
+    def get_latest_fact(self):
+        return self.get_latest()
+
+
+def _make_fact(since, category):
+    return Fact(activity='work', category=category, since=since,
+                until=since + timedelta(minutes=30), description=None,
+                tags=[])
+
+
+def _get_stats(view):
+    return [x.original_widget.get_text()[0].strip() for x in view.stats.body]
+
+
+class TestDayView:
+
+    def _make_view(self, tmpdir, facts):
+        backend = YamlBackend(str(tmpdir.mkdir('data')),
+                              str(tmpdir.mkdir('cache')))
+        storage = _Storage(backend)
+        storage.add_many(facts)
+        # only the panes that are refreshed; the prompt is not needed
+        view = DayView.__new__(DayView)
+        view.storage = storage
+        view.factlog = urwid.ListBox(urwid.SimpleListWalker([]))
+        view.stats = urwid.ListBox(urwid.SimpleListWalker([]))
+        view.frame = urwid.Frame(urwid.SolidFill())
+        view.refresh_data()
+        return view
+
+    def test_stats_today(self, tmpdir):
+        today = datetime.today().replace(hour=0, minute=0, second=0,
+                                         microsecond=0)
+        view = self._make_view(tmpdir, [
+            _make_fact(today - timedelta(days=3), 'errands'),
+            _make_fact(today, 'work'),
+        ])
+        assert [x.split()[0] for x in _get_stats(view)] == ['work']
+
+    def test_stats_fall_back_to_latest_day(self, tmpdir):
+        # nothing today: the day of the latest fact is shown
+        day = datetime.today().replace(hour=10, minute=0) - timedelta(days=3)
+        view = self._make_view(tmpdir, [
+            _make_fact(day - timedelta(days=1), 'errands'),
+            _make_fact(day, 'work'),
+            _make_fact(day + timedelta(hours=1), 'education'),
+        ])
+        assert sorted(x.split()[0] for x in _get_stats(view)) == \
+            ['education', 'work']
@@ -0,0 +1,67 @@
+# coding: utf-8
+
+# python
+from datetime import datetime, timedelta
+import random
+
+# this app
+from timetra.diary import caching
+from timetra.diary.intervals import IntervalIndex
+
+
+def test_matches_linear_scan(tmpdir, in_memory_files):
+    rnd = random.Random(0)
+    origin = datetime(2014,1,1)
+    files = {}
+    for day in range(30):
+        facts = []
+        for i in range(rnd.randint(0, 5)):
+            since = origin + timedelta(days=day, minutes=rnd.randint(0, 1440))
+            until = since + timedelta(minutes=rnd.choice([5, 60, 600, 5000]))
+            facts.append({'since': since, 'until': until})
+        files['day{:0>2}'.format(day)] = facts
+
+    cache = caching.Cache(str(tmpdir))
+    index = IntervalIndex(cache, 'test')
+
+    index.sync(sorted(files), load=files.get)
+
+    for i in range(200):
+        since = origin + timedelta(minutes=rnd.randint(-600, 33 * 1440))
+        until = since + timedelta(minutes=rnd.randint(1, 3000))
+        expected = sorted(
+            (fact['since'], fact['until'], path, position)
+            for path, facts in files.items()
+            for position, fact in enumerate(facts)
+            if fact['since'] < until and since < fact['until'])
+        assert index.find(since, until) == [x[2:] for x in expected]
+
+    # the index is restored from the cache
+    restored = IntervalIndex(cache, 'test')
+    assert restored.find(origin, origin + timedelta(days=40)) == \
+        index.find(origin, origin + timedelta(days=40))
+
+
+def test_update_one_file(tmpdir):
+    day = datetime(2014,1,1)
+    files = dict(('day{}'.format(x), [{
+        'since': day + timedelta(days=x, hours=10),
+        'until': day + timedelta(days=x, hours=11),
+    }]) for x in range(5))
+    stamps = dict((x, 1) for x in files)
+
+    cache = caching.Cache(str(tmpdir))
+    cache.get_stamp = stamps.get
+    index = IntervalIndex(cache, 'test')
+    index.sync(sorted(files), load=files.get)
+    assert index.find(day, day + timedelta(days=2)) == [('day0', 0),
+                                                         ('day1', 0)]
+
+    # a long fact is added to the first day
+    files['day0'].append({'since': day + timedelta(hours=20),
+                          'until': day + timedelta(days=3)})
+    stamps['day0'] = 2
+    index.sync(sorted(files), load=files.get)
+    assert index.find(day + timedelta(days=2, hours=12),
+                      day + timedelta(days=2, hours=13)) == [('day0', 1)]
+    assert sorted(cache.get_summaries('test')) == sorted(files)
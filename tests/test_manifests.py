@@ -0,0 +1,24 @@
+# coding: utf-8
+
+# python
+import random
+
+# this app
+from timetra.diary.manifests import _may_contain, make_bloom
+
+
+def test_bloom_has_no_false_negatives():
+    rnd = random.Random(0)
+    for i in range(200):
+        texts = [''.join(rnd.choice('abcdef ') for x in range(40))
+                 for y in range(10)]
+        bloom = make_bloom(texts)
+        for text in texts:
+            start = rnd.randint(0, 30)
+            assert _may_contain(bloom, text[start:start+rnd.randint(0, 10)])
+
+
+def test_bloom_rules_out():
+    bloom = make_bloom(['went to the opera', 'lunch'])
+    assert _may_contain(bloom, 'opera')
+    assert not _may_contain(bloom, 'theatre')
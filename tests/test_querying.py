@@ -0,0 +1,89 @@
+# coding: utf-8
+
+# python
+from datetime import datetime
+
+# 3rd-party
+import pytest
+
+# this app
+from timetra.diary.querying import QuerySyntaxError, compile_query
+
+
+FACT = {
+    'since': datetime(2014,1,1, 10,0),
+    'until': datetime(2014,1,1, 11,30),
+    'activity': 'Walk',
+    'category': 'Rest',
+    'description': 'Went to the park',
+    'tags': ['with-dog'],
+}
+
+
+@pytest.mark.parametrize('query, expected', [
+    ('walk', True),
+    ('PARK', True),
+    ('opera', False),
+    ('activity:walk', True),
+    ('activity:park', False),
+    ('note:"to the"', True),
+    ('activity:walk category:work', False),
+    ('activity:walk AND category:rest', True),
+    ('activity:run, category:rest', True),
+    ('activity:run OR category:work', False),
+    ('NOT tag:dog', False),
+    ('-tag:cat', True),
+    ('-(tag:dog)', False),
+    ('- walk', False),
+    ('-(tag:cat OR opera) walk', True),
+    ('- - walk', True),
+    ('(run OR walk) tag:dog', True),
+    ('duration>1h', True),
+    ('duration>=1h30m', True),
+    ('duration<1:30', False),
+    ('duration=90', True),
+    ('time:9-12', True),
+    ('time:10:30-12', False),
+    ('time:22-10', False),
+    ('time:22-10:30', True),
+    ('time>=18', False),
+])
+def test_match(query, expected):
+    assert compile_query(query).match(FACT) == expected
+
+
+def test_ongoing_has_no_duration():
+    fact = dict(FACT, until=None)
+    assert not compile_query('duration>0').match(fact)
+    assert not compile_query('duration<1h').match(fact)
+
+
+def test_filters():
+    assert compile_query().match(FACT)
+    assert compile_query(filters={'tags': 'dog'}).match(FACT)
+    assert not compile_query('walk', filters={'tags': 'cat'}).match(FACT)
+
+
+def test_pushdown():
+    query = compile_query('activity:wa activity:walk NOT tag:x duration>1h',
+                          filters={'category': 'rest'})
+    assert query.filters == {'activity': 'walk', 'category': 'rest'}
+    assert query.keys == {'activity', 'category', 'tags', 'since', 'until'}
+
+    # optional conditions cannot be used to skip files
+    assert compile_query('tag:a, tag:b').filters == {}
+    assert compile_query('walk').filters == {}
+
+    # nor negated ones
+    assert compile_query('-(tag:dog)').filters == {}
+    assert compile_query('activity:walk - tag:dog').filters == \
+        {'activity': 'walk'}
+
+
+@pytest.mark.parametrize('query', [
+    '', 'foo:x', 'activity=x', 'duration:1h', 'duration>abc', 'time:9',
+    'time:25-3', '(walk', 'walk)', 'walk OR', 'NOT', 'walk -', 'note:"x',
+])
+def test_syntax_errors(query):
+    with pytest.raises(QuerySyntaxError):
+        compile_query(query)
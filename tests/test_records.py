@@ -0,0 +1,58 @@
+# coding: utf-8
+
+# python
+from datetime import datetime
+import pickle
+
+# this app
+from timetra.diary.models import Fact, FactView
+from timetra.diary.records import DayRecord
+
+
+FACTS = [
+    Fact({'activity': 'sleep', 'since': datetime(2014,1,1, 0,0),
+          'until': datetime(2014,1,1, 8,0)}),
+    Fact({'activity': 'walk', 'category': 'health',
+          'since': datetime(2014,1,1, 9,0,0,500),
+          'until': datetime(2014,1,1, 10,0), 'tags': ['dog', None],
+          'description': 'Park', 'hamster_fact_id': 123}),
+    Fact({'activity': 'sleep', 'since': datetime(2014,1,1, 23,0)}),
+]
+
+
+def test_roundtrip():
+    record = pickle.loads(pickle.dumps(DayRecord(Fact, FACTS), protocol=-1))
+    assert len(record) == 3
+    assert list(record) == FACTS
+    assert record[-1] == FACTS[-1]
+    assert record[1:] == FACTS[1:]
+    assert list(reversed(record)) == FACTS[::-1]
+    assert isinstance(record[0], Fact)
+    assert record[1].duration == FACTS[1].duration
+
+
+def test_compact():
+    record = DayRecord(Fact, FACTS)
+    assert record.names == ['sleep', 'walk', 'health']
+    assert record.rows[0] == (1388534400, 1388563200, 0, None, None, None,
+                              None)
+
+
+def test_trusted_facts():
+    record = DayRecord(Fact, FACTS)
+    for fact, expected in zip(record, FACTS):
+        assert type(fact) is Fact
+        assert dict(fact) == dict(expected)
+        assert fact.activity == expected.activity
+        assert fact.until == expected.until
+    assert record[0].duration == FACTS[0].duration
+
+
+def test_views():
+    record = DayRecord(Fact, FACTS)
+    views = record.views()
+    assert views == [FactView.from_fact(x) for x in FACTS]
+    assert views[1].tags == ('dog', None)
+    assert views[1]['category'] == 'health'
+    assert views[0].get('category') is None
+    assert views[1].duration == FACTS[1].duration
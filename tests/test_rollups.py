@@ -0,0 +1,44 @@
+# coding: utf-8
+
+# python
+from datetime import datetime, timedelta
+import random
+
+# 3rd-party
+import pytest
+
+# this app
+from timetra.diary import caching
+from timetra.diary.aggregation import GROUP_BY, METRICS, aggregate_facts
+from timetra.diary.models import FactView
+from timetra.diary.rollups import DayRollups
+
+
+@pytest.mark.parametrize('group_by', GROUP_BY)
+@pytest.mark.parametrize('metric', METRICS)
+def test_matches_facts(tmpdir, in_memory_files, group_by, metric):
+    rnd = random.Random(0)
+    origin = datetime(2014,1,1)
+    now = origin + timedelta(days=50)
+    files = {}
+    for day in range(40):
+        facts = []
+        for i in range(rnd.randint(0, 5)):
+            since = origin + timedelta(days=day, minutes=rnd.randint(0, 1439))
+            until = since + timedelta(minutes=rnd.randint(1, 600))
+            if rnd.random() < 0.05:
+                until = None
+            facts.append(FactView(
+                since, until, rnd.choice('abc'), rnd.choice(['x', None]),
+                rnd.sample(['t1', 't2', 't3'], rnd.randint(0, 2))))
+        files['day{:0>2}'.format(day)] = facts
+
+    cache = caching.Cache(str(tmpdir))
+    rollups = DayRollups(cache, 'test')
+
+    rollups.sync(sorted(files), load=files.get)
+
+    paths = sorted(files)[5:20]
+    expected = aggregate_facts([x for path in paths for x in files[path]],
+                               group_by, metric, now=now)
+    assert rollups.get_totals(paths, group_by, metric, now=now) == expected
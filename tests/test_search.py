@@ -0,0 +1,111 @@
+# coding: utf-8
+
+# python
+from datetime import datetime, timedelta
+
+# this app
+from timetra.diary import search
+from timetra.diary.caching import FileStamp
+from timetra.diary.search import SearchIndex, make_snippet
+
+
+def _make_index(tmpdir, files):
+    # the "files" only exist in memory and never change
+    stamp = FileStamp(1, 1, 1, None)
+    index = SearchIndex(str(tmpdir), get_stamp=lambda path: stamp)
+    index.sync(sorted(files), load=files.get)
+    return index
+
+
+def _fact(day, activity, description=None):
+    return {'since': datetime(2014,1,1) + timedelta(days=day),
+            'activity': activity, 'description': description}
+
+
+def test_search(tmpdir):
+    files = {
+        'day1': [_fact(1, 'reading', 'A book about Python'),
+                 _fact(1, 'sleep')],
+        'day2': [_fact(2, 'programming', 'python, again')],
+        'day3': [_fact(3, 'walk', 'In the park')],
+    }
+    index = _make_index(tmpdir, files)
+
+    # a match in the activity weighs more; ties go to the latest fact
+    assert [x[1:] for x in index.search('PYTHON progr')] == [
+        ('day2', 0, 'python'),
+        ('day1', 0, 'python'),
+    ]
+    # short terms are scanned for
+    assert [x[1:3] for x in index.search('in')] == [
+        ('day2', 0),
+        ('day1', 0),
+        ('day3', 0),
+    ]
+    assert index.search('opera') == []
+    assert index.search('  ') == []
+    assert len(index.search('a', limit=2)) == 2
+
+
+def test_sync(tmpdir):
+    files = {'day1': [_fact(1, 'reading', 'Opera')]}
+    index = _make_index(tmpdir, files)
+    assert [x.path for x in index.search('opera')] == ['day1']
+
+    # unchanged files are not reloaded
+    index.sync(['day1'], load=None)
+
+    files = {'day2': [_fact(2, 'opera')]}
+    index.sync(sorted(files), load=files.get)
+    assert [x.path for x in index.search('opera')] == ['day2']
+
+
+def test_tree_stamp(tmpdir):
+    files = {'day1': [_fact(1, 'opera')]}
+    index = _make_index(tmpdir, files)
+    index.sync(sorted(files), load=files.get, tree_stamp=1)
+
+    def day_paths():
+        raise AssertionError('listed the files')
+        yield
+    index.sync(day_paths(), load=None, tree_stamp=1)
+
+    files = {'day2': [_fact(2, 'opera')]}
+    index.sync(sorted(files), load=files.get, tree_stamp=2)
+    assert [x.path for x in index.search('opera')] == ['day2']
+
+
+def test_stopgrams(tmpdir, monkeypatch):
+    monkeypatch.setattr(search, 'STOPGRAM_MIN_DOCS', 4)
+    monkeypatch.setattr(search, 'STOPGRAM_RATIO', 0.5)
+    files = dict(('day{}'.format(x), [_fact(x, 'the walk', 'The park')])
+                 for x in range(5))
+    files['day5'] = [_fact(5, 'opera', 'Went to the Opera')]
+    index = _make_index(tmpdir, files)
+
+    assert 'the' in index._stopgrams
+    assert 'ope' not in index._stopgrams
+    grams = set(x for x, in index.db.execute('SELECT gram FROM postings'))
+    assert grams == {'ope', 'per', 'era', 'wen', 'ent', 'nt ', 't t', ' to',
+                     'to ', 'o t', ' th', 'e o', ' op'}
+
+    # stop-trigrams are scanned for
+    assert [x.path for x in index.search('the')] == \
+        ['day4', 'day3', 'day2', 'day1', 'day0', 'day5']
+    assert [x[1:] for x in index.search('the opera')][0] == \
+        ('day5', 0, 'opera')
+
+    # and not indexed again
+    files['day6'] = [_fact(6, 'theatre')]
+    index.sync(sorted(files), load=files.get)
+    assert len(index.search('the')) == 7
+    assert not index.db.execute('SELECT * FROM postings WHERE gram = ?',
+                                ('the',)).fetchall()
+
+
+def test_make_snippet():
+    text = 'Went to the\nOpera with friends, then had a long walk home'
+    assert make_snippet(text, 'opera', context=10) == \
+        '…nt to the Opera with frie…'
+    assert make_snippet(text, context=10) == 'Went to th…'
+    assert make_snippet(None, 'opera') == ''
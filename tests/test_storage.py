@@ -1,14 +1,19 @@
 # coding: utf-8
 
 # python
-from datetime import datetime  #, timedelta
+from datetime import date, datetime, timedelta
+import os
+import shutil
 
 # 3rd-party
+from monk import ValidationError
 import pytest
 
 # this app
-from timetra.diary.models import Fact
-from timetra.diary.storage import Storage, UnknownActivity, AmbiguousActivityName
+from timetra.diary.models import Fact, FactView
+from timetra.diary.querying import QuerySyntaxError
+from timetra.diary.storage import (Storage, YamlBackend, FactNotFound,
+                                   UnknownActivity, AmbiguousActivityName)
 
 
 FIXTURE_ROOT = 'tests/fixtures'
@@ -22,6 +27,9 @@ class MockBackend:
     def add(self, fact):
         self.data.append(fact)
 
+    def add_many(self, facts):
+        self.data.extend(facts)
+
     def get(self, date_time):
         for fact in self.data:
             if fact.since == date_time:
@@ -112,6 +120,24 @@ class TestStorage:
         xs = list(self.storage.find(since=datetime(2014,1,1)))
         assert len(xs) == 0
 
+    def test_find_overlapping_facts(self):
+        # the backend has no method of its own; `find()` is used
+        xs = list(self.storage.find_overlapping_facts(
+            datetime(2013,4,13, 4,30), datetime(2013,4,13, 5,0)))
+        assert [x.activity for x in xs] == ['walk']
+
+        xs = list(self.storage.find_overlapping_facts(
+            datetime(2013,4,13, 4,0), datetime(2013,4,13, 4,28,54)))
+        assert xs == []
+
+    def test_find_overlapping_facts_open_end(self):
+        self.storage.add(Fact(activity='read', category='books',
+                              since=datetime(2013,4,13, 5,0), until=None,
+                              description='', tags=[]))
+        xs = list(self.storage.find_overlapping_facts(
+            datetime(2013,4,13, 4,30), None))
+        assert [x.activity for x in xs] == ['walk', 'read']
+
     def test_find_facts_until(self):
         xs = list(self.storage.find(until=datetime(2012,1,1)))
         assert len(xs) == 0
@@ -178,6 +204,20 @@ class TestStorage:
         assert len(xs) == 3
         assert xs[-1].activity == 'party'
 
+    def test_add_many_facts(self):
+        self.storage.add_many([
+            Fact(activity='party', category='leisure',
+                 since=datetime(2012,12,31, 23,55),
+                 until=datetime(2013,1,1, 1,30),
+                 description='Happy New Year!', tags=['with-friends']),
+            Fact(activity='sleep', category='self-care',
+                 since=datetime(2013,1,1, 2,0),
+                 until=datetime(2013,1,1, 11,0),
+                 description=None, tags=[]),
+        ])
+        xs = list(self.storage.find())
+        assert len(xs) == 4
+
     def test_update_fact(self):
         xs = list(self.storage.find())
         initial = xs[0]
@@ -240,3 +280,824 @@ class TestStorage:
             {'category': 'foss', 'activity': 'timetra'},
         ]
 
+
+
+def _make_yaml_backend(tmpdir, **kwargs):
+    data_dir = tmpdir.mkdir('data')
+    cache_dir = tmpdir.mkdir('cache')
+    return YamlBackend(str(data_dir), str(cache_dir), **kwargs)
+
+
+def _spy(obj, name, arg=0):
+    """
+    Wraps given method of given object.  Returns a list that gets the given
+    positional argument of each call.
+    """
+    calls = []
+    orig = getattr(obj, name)
+    def spy(*args, **kwargs):
+        calls.append(args[arg])
+        return orig(*args, **kwargs)
+    setattr(obj, name, spy)
+    return calls
+
+
+def _make_fact(since, minutes=30, **kwargs):
+    values = dict(activity='work', category='foss', description=None,
+                  tags=[])
+    values.update(kwargs)
+    return Fact(since=since, until=since + timedelta(minutes=minutes),
+                **values)
+
+
+class TestYamlBackendIndex:
+
+    def _populate(self, backend):
+        backend.add(_make_fact(datetime(2014,1,1, 10,0), activity='walk',
+                               tags=['with-dog']))
+        backend.add(_make_fact(datetime(2014,1,1, 12,0), activity='work'))
+        backend.add(_make_fact(datetime(2014,2,3, 9,0), activity='work'))
+        backend.add(_make_fact(datetime(2015,3,4, 8,0), activity='walk',
+                               description='in the park'))
+
+    def test_same_results(self, tmpdir):
+        plain = _make_yaml_backend(tmpdir.mkdir('plain'))
+        indexed = _make_yaml_backend(tmpdir.mkdir('indexed'), index=True)
+        self._populate(plain)
+        self._populate(indexed)
+
+        queries = [
+            {},
+            {'activity': 'walk'},
+            {'activity': 'WAL'},
+            {'tag': 'dog'},
+            {'activity': 'walk', 'description': 'park'},
+            {'since': datetime(2014,2,1), 'activity': 'work'},
+        ]
+        for query in queries:
+            expected = [x.since for x in plain.find(**query)]
+            assert [x.since for x in indexed.find(**query)] == expected
+
+    def test_skips_files(self, tmpdir):
+        backend = _make_yaml_backend(tmpdir, index=True)
+        self._populate(backend)
+
+        loaded = _spy(backend, 'get_cached_day_file')
+
+        # first query indexes all files
+        assert len(list(backend.find(activity='walk'))) == 2
+        del loaded[:]
+
+        assert len(list(backend.find(activity='walk'))) == 2
+        assert len(loaded) == 2
+
+        del loaded[:]
+        assert list(backend.find(tag='with-dog'))
+        assert loaded == [backend.get_file_path_for_day(datetime(2014,1,1))]
+
+    def test_unfiltered(self, tmpdir):
+        backend = _make_yaml_backend(tmpdir, index=True)
+        self._populate(backend)
+
+        synced = _spy(backend.index, 'sync')
+
+        # no indexed filters; the walk stops early
+        facts = list(backend.find(order='desc', limit=1))
+        assert [x.activity for x in facts] == ['walk']
+        facts = list(backend.find(description='park'))
+        assert [x.activity for x in facts] == ['walk']
+        assert synced == []
+
+        assert list(backend.find(activity='walk'))
+        assert len(synced) == 1
+
+    def test_removed_file(self, tmpdir):
+        backend = _make_yaml_backend(tmpdir, index=True)
+        self._populate(backend)
+        assert len(list(backend.find(activity='work'))) == 2
+
+        os.remove(backend.get_file_path_for_day(datetime(2014,2,3)))
+        assert len(list(backend.find(activity='work'))) == 1
+
+    def test_range_from_index(self, tmpdir, monkeypatch):
+        backend = _make_yaml_backend(tmpdir, index=True)
+        self._populate(backend)
+        assert len(list(backend.find(activity='walk'))) == 2
+
+        listed = []
+        orig_collect_day_paths = backend._collect_day_paths
+        def collect_day_paths(*args, **kwargs):
+            for path in orig_collect_day_paths(*args, **kwargs):
+                listed.append(path)
+                yield path
+        monkeypatch.setattr(backend, '_collect_day_paths', collect_day_paths)
+
+        # the tree is unchanged and the range is looked up in the index
+        facts = backend.find(activity='work', since=datetime(2014,1,1, 18,0),
+                             until=datetime(2015,3,4), order='desc')
+        assert [x.since for x in facts] == [datetime(2014,2,3, 9,0),
+                                            datetime(2014,1,1, 12,0)]
+        assert listed == []
+
+        backend.add(_make_fact(datetime(2015,3,4, 10,0), activity='work'))
+        facts = backend.find(activity='work', since=datetime(2015,3,4))
+        assert [x.since for x in facts] == [datetime(2015,3,4, 10,0)]
+        assert listed
+
+    def test_relative_data_dir(self, tmpdir, monkeypatch):
+        monkeypatch.chdir(tmpdir)
+        tmpdir.mkdir('data')
+        backend = YamlBackend('data', str(tmpdir.mkdir('cache')), index=True)
+        backend.add(_make_fact(datetime(2014,1,1, 10,0), activity='rare'))
+        assert len(list(backend.find(activity='rare'))) == 1
+
+        # the stored paths do not depend on the working directory
+        monkeypatch.chdir(tmpdir.mkdir('elsewhere'))
+        assert backend.compact_cache()[0] == 0
+        assert len(list(backend.find(activity='rare'))) == 1
+
+
+class TestYamlBackendJournal:
+
+    def test_add_appends_to_journal(self, tmpdir):
+        backend = _make_yaml_backend(tmpdir, journal=True)
+        backend.add(_make_fact(datetime(2014,1,1, 12,0), activity='b'))
+        backend.add(_make_fact(datetime(2014,1,1, 10,0), activity='a'))
+
+        path = backend.get_file_path_for_day(datetime(2014,1,1))
+        assert os.path.exists(backend.get_journal_path(path))
+        assert backend._load_from_file(path) == []
+
+        assert [x.activity for x in backend.find()] == ['a', 'b']
+        assert backend.get_latest().activity == 'b'
+
+    def test_compact(self, tmpdir):
+        backend = _make_yaml_backend(tmpdir, journal=True)
+        backend.journal = False
+        backend.add(_make_fact(datetime(2014,1,1, 11,0), activity='b'))
+        backend.journal = True
+        backend.add(_make_fact(datetime(2014,1,1, 12,0), activity='c'))
+        backend.add(_make_fact(datetime(2014,1,1, 10,0), activity='a'))
+        backend.add(_make_fact(datetime(2014,1,2, 10,0), activity='d'))
+
+        assert backend.compact() == 2
+        assert backend.compact() == 0
+
+        path = backend.get_file_path_for_day(datetime(2014,1,1))
+        assert not os.path.exists(backend.get_journal_path(path))
+        assert [x['activity'] for x in backend._load_from_file(path)] == \
+            ['a', 'b', 'c']
+        assert [x.activity for x in backend.find()] == ['a', 'b', 'c', 'd']
+
+    def test_journal_changes_noticed(self, tmpdir):
+        backend = _make_yaml_backend(tmpdir, journal=True, index=True)
+        backend.add(_make_fact(datetime(2014,1,1, 10,0), activity='a'))
+        assert [x.activity for x in backend.find(activity='b')] == []
+
+        # appended within the same timestamp tick
+        path = backend.get_file_path_for_day(datetime(2014,1,1))
+        journal_path = backend.get_journal_path(path)
+        stat = os.stat(journal_path)
+        backend.add(_make_fact(datetime(2014,1,1, 11,0), activity='b'))
+        os.utime(journal_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        assert [x.activity for x in backend.find(activity='b')] == ['b']
+
+        # the journal is removed by hand
+        os.remove(journal_path)
+        assert [x.activity for x in backend.find()] == []
+        assert [x.activity for x in backend.find(activity='b')] == []
+
+    def test_journal_hash_content(self, tmpdir):
+        backend = _make_yaml_backend(tmpdir, journal=True, hash_content=True)
+        backend.add(_make_fact(datetime(2014,1,1, 10,0), activity='a'))
+        assert [x.activity for x in backend.find()] == ['a']
+        backend.add(_make_fact(datetime(2014,1,1, 11,0), activity='b'))
+        assert [x.activity for x in backend.find()] == ['a', 'b']
+
+    def test_delete_journalled(self, tmpdir):
+        backend = _make_yaml_backend(tmpdir, journal=True)
+        backend.add(_make_fact(datetime(2014,1,1, 10,0), activity='a'))
+        backend.add(_make_fact(datetime(2014,1,1, 11,0), activity='b'))
+
+        backend.delete(datetime(2014,1,1, 10,0), 'a')
+        assert [x.activity for x in backend.find()] == ['b']
+
+
+class TestYamlBackendAddMany:
+
+    def test_add_many(self, tmpdir):
+        backend = _make_yaml_backend(tmpdir)
+        backend.add(_make_fact(datetime(2014,1,1, 11,0), activity='b'))
+
+        written = _spy(backend, '_write_to_file')
+
+        paths = backend.add_many([
+            _make_fact(datetime(2014,1,1, 12,0), activity='c'),
+            _make_fact(datetime(2014,1,2, 10,0), activity='e'),
+            _make_fact(datetime(2014,1,1, 10,0), activity='a'),
+            _make_fact(datetime(2014,1,1, 11,0), activity='b2'),
+            _make_fact(datetime(2014,1,2, 9,0), activity='d'),
+        ])
+        assert paths == [
+            backend.get_file_path_for_day(datetime(2014,1,1)),
+            backend.get_file_path_for_day(datetime(2014,1,2)),
+        ]
+        assert written == paths
+        assert [x.activity for x in backend.find()] == \
+            ['a', 'b', 'b2', 'c', 'd', 'e']
+
+    def test_add_many_journal(self, tmpdir):
+        backend = _make_yaml_backend(tmpdir, journal=True)
+        backend.add_many([
+            _make_fact(datetime(2014,1,1, 12,0), activity='b'),
+            _make_fact(datetime(2014,1,1, 10,0), activity='a'),
+        ])
+        assert [x.activity for x in backend.find()] == ['a', 'b']
+        backend.compact()
+        assert [x.activity for x in backend.find()] == ['a', 'b']
+
+
+class TestYamlBackendLatest:
+
+    def test_tail_record(self, tmpdir):
+        backend = _make_yaml_backend(tmpdir)
+        backend.add(_make_fact(datetime(2014,1,1, 10,0), activity='a'))
+        backend.add(_make_fact(datetime(2014,1,2, 10,0), activity='b'))
+
+        assert backend.get_latest().activity == 'b'
+
+        # now the tree is not walked at all
+        backend._collect_day_paths = None
+        assert backend.get_latest().activity == 'b'
+
+        backend.add(_make_fact(datetime(2014,2,1, 10,0), activity='c'))
+        assert backend.get_latest().activity == 'c'
+
+        backend.add(_make_fact(datetime(2014,1,3, 10,0), activity='x'))
+        assert backend.get_latest().activity == 'c'
+
+    def test_delete_latest(self, tmpdir):
+        backend = _make_yaml_backend(tmpdir)
+        backend.add(_make_fact(datetime(2014,1,1, 10,0), activity='a'))
+        backend.add(_make_fact(datetime(2014,1,2, 10,0), activity='b'))
+        assert backend.get_latest().activity == 'b'
+
+        backend.delete(datetime(2014,1,2, 10,0), 'b')
+        assert backend.get_latest().activity == 'a'
+
+    def test_external_changes(self, tmpdir):
+        backend = _make_yaml_backend(tmpdir)
+        backend.add(_make_fact(datetime(2014,1,1, 10,0), activity='a'))
+        assert backend.get_latest().activity == 'a'
+
+        # e.g. a file created in the editor
+        other = _make_yaml_backend(tmpdir.mkdir('other'))
+        other.data_dir = backend.data_dir
+        other.add(_make_fact(datetime(2015,1,1, 10,0), activity='b'))
+
+        assert backend.get_latest().activity == 'b'
+
+    def test_empty(self, tmpdir):
+        backend = _make_yaml_backend(tmpdir)
+        with pytest.raises(FactNotFound):
+            backend.get_latest()
+
+
+class TestYamlBackendActivities:
+
+    def test_known_activities(self, tmpdir):
+        backend = _make_yaml_backend(tmpdir)
+        backend.add(_make_fact(datetime(2014,1,1, 10,0), activity='walk',
+                               category='errands'))
+        backend.add(_make_fact(datetime(2014,1,2, 10,0), activity='walk',
+                               category='errands'))
+        backend.add(_make_fact(datetime(2014,1,2, 12,0), activity='timetra'))
+
+        assert backend.get_known_activities() == [
+            {'activity': 'walk', 'category': 'errands', 'count': 2,
+             'last_seen': datetime(2014,1,2, 10,0)},
+            {'activity': 'timetra', 'category': 'foss', 'count': 1,
+             'last_seen': datetime(2014,1,2, 12,0)},
+        ]
+
+        backend.delete(datetime(2014,1,2, 10,0), 'walk')
+        os.remove(backend.get_file_path_for_day(datetime(2014,1,2)))
+        assert backend.get_known_activities() == [
+            {'activity': 'walk', 'category': 'errands', 'count': 1,
+             'last_seen': datetime(2014,1,1, 10,0)},
+        ]
+
+    def test_unchanged_files_not_loaded(self, tmpdir):
+        backend = _make_yaml_backend(tmpdir)
+        backend.add(_make_fact(datetime(2014,1,1, 10,0), activity='walk'))
+        backend.get_known_activities()
+
+        loaded = _spy(backend, 'get_cached_day_file')
+
+        backend.add(_make_fact(datetime(2014,1,2, 10,0), activity='sleep'))
+
+        storage = Storage(backend)
+        assert storage.resolve_activity('sle') == {'activity': 'sleep',
+                                                   'category': 'foss'}
+        assert loaded == [backend.get_file_path_for_day(datetime(2014,1,2))]
+
+
+class TestYamlBackendOverlaps:
+
+    def test_overlapping_facts(self, tmpdir):
+        backend = _make_yaml_backend(tmpdir)
+        # a three-day trip
+        backend.add(_make_fact(datetime(2014,1,1, 10,0), activity='trip',
+                               minutes=3*24*60))
+        backend.add(_make_fact(datetime(2014,1,3, 9,0), activity='a'))
+        backend.add(_make_fact(datetime(2014,1,3, 10,0), activity='b'))
+        backend.add(_make_fact(datetime(2014,1,3, 11,0), activity='c'))
+
+        storage = Storage(backend)
+        def find(since, until):
+            return [x.activity for x in
+                    storage.find_overlapping_facts(since, until)]
+
+        assert find(datetime(2014,1,3, 10,10), datetime(2014,1,3, 10,20)) == \
+            ['trip', 'b']
+        # touching edges do not overlap
+        assert find(datetime(2014,1,3, 9,30), datetime(2014,1,3, 10,0)) == \
+            ['trip']
+        assert find(datetime(2014,1,3, 8,0), datetime(2014,1,3, 12,0)) == \
+            ['trip', 'a', 'b', 'c']
+        assert find(datetime(2014,1,5, 8,0), datetime(2014,1,5, 12,0)) == []
+
+        backend.delete(datetime(2014,1,1, 10,0), 'trip')
+        assert find(datetime(2014,1,3, 10,10), datetime(2014,1,3, 10,20)) == \
+            ['b']
+
+        # a period without an end
+        assert find(datetime(2014,1,3, 10,30), None) == ['c']
+
+    def test_sync_on_change(self, tmpdir, monkeypatch):
+        backend = _make_yaml_backend(tmpdir)
+        day = datetime(2014,1,1)
+        backend.add(_make_fact(day.replace(hour=10), activity='a'))
+        backend.add(_make_fact(day.replace(hour=11), activity='b'))
+        def find():
+            return [x['activity'] for x in backend.find_overlapping_facts(
+                day, day + timedelta(days=1))]
+        assert find() == ['a', 'b']
+
+        listed = []
+        orig_collect_day_paths = backend._collect_day_paths
+        def collect_day_paths(*args, **kwargs):
+            for path in orig_collect_day_paths(*args, **kwargs):
+                listed.append(path)
+                yield path
+        monkeypatch.setattr(backend, '_collect_day_paths', collect_day_paths)
+        assert find() == ['a', 'b']
+        assert listed == []
+
+        # edited in place: the tree stamp stays the same
+        path = backend.get_file_path_for_day(day)
+        with open(path) as f:
+            content = f.read()
+        with open(path, 'w') as f:
+            f.write(content[:content.index('- activity: b')])
+        assert find() == ['a']
+        assert listed == []
+
+        backend.add(_make_fact(day.replace(hour=12), activity='c'))
+        assert find() == ['a', 'c']
+        assert listed
+
+
+class TestYamlBackendValidation:
+
+    def _add_broken_fact(self, backend):
+        path = backend.get_file_path_for_day(datetime(2014,1,1))
+        backend.add(_make_fact(datetime(2014,1,1, 10,0)))
+        with open(path, 'a') as f:
+            f.write('- activity: 123\n  since: 2014-01-01 11:00:00\n'
+                    '  until: 2014-01-01 12:00:00\n  description: null\n')
+        return path
+
+    def test_validate_existing(self, tmpdir):
+        backend = _make_yaml_backend(tmpdir)
+        path = self._add_broken_fact(backend)
+        with pytest.raises(ValidationError) as excinfo:
+            backend.add(_make_fact(datetime(2014,1,1, 13,0)))
+        assert str(excinfo.value) == \
+            "{}: 'activity': must be str".format(path)
+
+    def test_trust_existing(self, tmpdir):
+        backend = _make_yaml_backend(tmpdir, validate_existing=False)
+        path = self._add_broken_fact(backend)
+        backend.add(_make_fact(datetime(2014,1,1, 13,0)))
+        with pytest.raises(ValidationError) as excinfo:
+            backend.add(_make_fact(datetime(2014,1,1, 14,0), activity=1))
+        assert str(excinfo.value) == \
+            "{}: 'activity': must be str".format(path)
+
+
+class TestYamlBackendReadonly:
+
+    def test_find_readonly(self, tmpdir):
+        backend = _make_yaml_backend(tmpdir, journal=True)
+        backend.add_many([
+            _make_fact(datetime(2014,1,1, 10,0), activity='a'),
+            _make_fact(datetime(2014,1,2, 10,0), activity='b', tags=['x']),
+        ])
+        backend.compact()
+        backend.add(_make_fact(datetime(2014,1,2, 9,0), activity='c'))
+
+        facts = list(backend.find(readonly=True))
+        assert all(isinstance(x, FactView) for x in facts)
+        assert [x.activity for x in facts] == ['a', 'c', 'b']
+        assert [x['since'] for x in facts] == \
+            [x.since for x in backend.find()]
+        assert facts[0].duration == timedelta(minutes=30)
+        assert [x.activity for x in backend.find(tag='x', readonly=True)] \
+            == ['b']
+
+        with pytest.raises(AttributeError):
+            facts[0].activity = 'z'
+
+    def test_find_fields(self, tmpdir):
+        backend = _make_yaml_backend(tmpdir, journal=True)
+        backend.add_many([
+            _make_fact(datetime(2014,1,1, 10,0), activity='a'),
+            _make_fact(datetime(2014,1,2, 10,0), activity='b', tags=['x']),
+        ])
+        backend.compact()
+        backend.add(_make_fact(datetime(2014,1,2, 9,0), activity='c'))
+
+        rows = list(backend.find(fields=('since', 'activity')))
+        assert rows == [(x.since, x.activity) for x in backend.find()]
+        assert rows[0].activity == 'a'
+
+        rows = list(backend.find(tag='x', fields=('until',)))
+        assert rows == [(datetime(2014,1,2, 10,30),)]
+        assert rows[0]._fields == ('until',)
+
+        with pytest.raises(ValueError):
+            list(backend.find(fields=('duration',)))
+
+
+class TestYamlBackendAggregate:
+
+    def _populate(self, backend):
+        backend.add_many([
+            _make_fact(datetime(2014,1,1, 10,0), activity='a', tags=['x']),
+            _make_fact(datetime(2014,1,1, 12,0), activity='b',
+                       category='home', tags=['x', 'y'], minutes=60),
+            _make_fact(datetime(2014,1,6, 10,0), activity='a', minutes=90),
+            _make_fact(datetime(2014,2,1, 10,0), activity='a'),
+        ])
+
+    @pytest.mark.parametrize('group_by,metric,expected', [
+        ('activity', 'duration', [('a', 150), ('b', 60)]),
+        ('activity', 'count', [('a', 3), ('b', 1)]),
+        ('category', 'duration', [('foss', 150), ('home', 60)]),
+        ('tag', 'count', [('x', 2), ('y', 1)]),
+        ('day', 'duration', [(datetime(2014,1,1).date(), 90),
+                             (datetime(2014,1,6).date(), 90),
+                             (datetime(2014,2,1).date(), 30)]),
+        ('week', 'count', [(datetime(2013,12,30).date(), 2),
+                           (datetime(2014,1,6).date(), 1),
+                           (datetime(2014,1,27).date(), 1)]),
+        ('month', 'count', [(datetime(2014,1,1).date(), 3),
+                            (datetime(2014,2,1).date(), 1)]),
+    ])
+    def test_aggregate(self, tmpdir, group_by, metric, expected):
+        backend = _make_yaml_backend(tmpdir)
+        self._populate(backend)
+        storage = Storage(backend)
+        totals = storage.aggregate(group_by=group_by, metric=metric)
+        if metric == 'duration':
+            expected = [(k, timedelta(minutes=v)) for k, v in expected]
+        assert list(totals.items()) == expected
+
+    def test_aggregate_range(self, tmpdir):
+        backend = _make_yaml_backend(tmpdir)
+        self._populate(backend)
+        totals = backend.aggregate(since=datetime(2014,1,2),
+                                   until=datetime(2014,1,31), metric='count')
+        assert totals == {'a': 1}
+
+        with pytest.raises(ValueError):
+            backend.aggregate(group_by='year')
+
+    def test_rollups_reused(self, tmpdir):
+        backend = _make_yaml_backend(tmpdir)
+        self._populate(backend)
+        assert backend.aggregate()['a'] == timedelta(minutes=150)
+
+        loaded = _spy(backend, 'get_cached_day_file')
+
+        assert backend.aggregate()['a'] == timedelta(minutes=150)
+        assert loaded == []
+
+        written = _spy(backend.cache, 'put_summary', arg=1)
+
+        backend.add(_make_fact(datetime(2014,1,6, 12,0), activity='a'))
+        assert backend.aggregate()['a'] == timedelta(minutes=180)
+        jan_6 = backend.get_file_path_for_day(datetime(2014,1,6))
+        assert loaded == [jan_6]
+        # only the rollup of the changed day is rewritten
+        assert written == [jan_6]
+
+
+class TestYamlBackendDayPaths:
+
+    def test_direct_paths(self, tmpdir, monkeypatch):
+        backend = _make_yaml_backend(tmpdir)
+        start = datetime(2013,12,20, 10,0)
+        backend.add_many([_make_fact(start + timedelta(days=x))
+                          for x in range(0, 60, 3)])
+        # not a day file
+        os.makedirs(os.path.join(backend.data_dir, '2014', '01', 'foo'))
+
+        cases = []
+        for since, until in [(datetime(2013,12,25), datetime(2014,1,10)),
+                             (datetime(2014,1,31).date(), datetime(2014,2,2))]:
+            for reverse in (False, True):
+                expected = list(backend._walk_day_paths(since, until,
+                                                        reverse=reverse))
+                assert expected
+                cases.append((since, until, reverse, expected))
+
+        def scandir(path):
+            raise AssertionError('listed {}'.format(path))
+        monkeypatch.setattr(os, 'scandir', scandir)
+        monkeypatch.setattr(os, 'listdir', scandir)
+        for since, until, reverse, expected in cases:
+            assert list(backend._collect_day_paths(
+                since, until, reverse=reverse)) == expected
+
+
+class TestYamlBackendManifests:
+
+    def test_skips_files(self, tmpdir):
+        backend = _make_yaml_backend(tmpdir)
+        facts = [_make_fact(datetime(2014,1,1, 10,0) + timedelta(days=x))
+                 for x in range(90)]
+        facts.append(_make_fact(datetime(2014,2,10, 12,0), activity='rare',
+                                tags=['Odd']))
+        backend.add_many(facts)
+
+        loaded = _spy(backend, 'get_cached_day_file')
+
+        # the first query builds the manifests
+        assert [x.activity for x in backend.find(activity='rar')] == ['rare']
+        del loaded[:]
+
+        feb_10 = backend.get_file_path_for_day(datetime(2014,2,10))
+        assert [x.activity for x in backend.find(activity='rar')] == ['rare']
+        assert loaded == [feb_10]
+
+        del loaded[:]
+        assert [x.activity for x in backend.find(tag='odd')] == ['rare']
+        assert loaded == [feb_10]
+
+        # a change is noticed
+        backend.add(_make_fact(datetime(2014,3,5, 12,0), activity='rare'))
+        del loaded[:]
+        assert len(list(backend.find(activity='rare'))) == 2
+        mar_5 = backend.get_file_path_for_day(datetime(2014,3,5))
+        assert loaded == [feb_10, mar_5, mar_5]
+
+    def test_skips_descriptions(self, tmpdir):
+        backend = _make_yaml_backend(tmpdir)
+        backend.add_many([
+            _make_fact(datetime(2014,1,1, 10,0) + timedelta(days=x),
+                       description='Routine day #{}'.format(x))
+            for x in range(30)
+        ] + [_make_fact(datetime(2014,1,15, 12,0),
+                        description='Went to the Opera')])
+        assert len(list(backend.find(description='opera'))) == 1
+
+        loaded = _spy(backend, 'get_cached_day_file')
+
+        assert [x.description for x in backend.find(description='opera')] \
+            == ['Went to the Opera']
+        assert loaded == [backend.get_file_path_for_day(datetime(2014,1,15))]
+
+        # too short to be ruled out
+        assert len(list(backend.find(description='#2'))) == 11
+
+    def test_drops_deleted_months(self, tmpdir):
+        backend = _make_yaml_backend(tmpdir)
+        backend.add_many([_make_fact(datetime(2014,1,1, 10,0) + timedelta(days=x))
+                          for x in range(59)])
+        key = 'manifests:' + os.path.abspath(backend.data_dir)
+
+        assert not list(backend.find(activity='rare'))
+        jan = os.path.dirname(backend.get_file_path_for_day(datetime(2014,1,1)))
+        feb = os.path.dirname(backend.get_file_path_for_day(datetime(2014,2,1)))
+        assert sorted(backend.cache.get_summary_paths(key)) == [jan, feb]
+
+        # one month is written as a single row
+        puts = _spy(backend.cache, 'put_summary', arg=1)
+        backend.add(_make_fact(datetime(2014,2,20, 12,0), activity='rare'))
+        assert len(list(backend.find(activity='rare'))) == 1
+        assert puts == [feb]
+
+        shutil.rmtree(jan)
+        assert len(list(backend.find(activity='rare'))) == 1
+        assert backend.cache.get_summary_paths(key) == [feb]
+
+
+class TestYamlBackendSearch:
+
+    def test_search(self, tmpdir):
+        backend = _make_yaml_backend(tmpdir)
+        backend.add_many([
+            _make_fact(datetime(2014,1,1, 10,0) + timedelta(days=x),
+                       description='Routine day #{}'.format(x))
+            for x in range(30)
+        ] + [_make_fact(datetime(2014,1,15, 12,0), activity='opera',
+                        description='Went to the Opera with friends')])
+
+        results = backend.search('opera friends')
+        assert [x.fact['activity'] for x in results] == ['opera']
+        assert results[0].snippet == 'Went to the Opera with friends'
+
+        results = backend.search('routine', limit=3)
+        assert [x.fact['since'].day for x in results] == [30, 29, 28]
+
+        # changes are noticed
+        backend.add(_make_fact(datetime(2014,3,5, 12,0), activity='opera'))
+        assert len(backend.search('opera')) == 2
+
+    def test_sync_on_change(self, tmpdir, monkeypatch):
+        backend = _make_yaml_backend(tmpdir, journal=True)
+        backend.add(_make_fact(datetime(2014,1,1, 10,0), activity='opera'))
+        assert len(backend.search('opera')) == 1
+
+        listed = []
+        orig_collect_day_paths = backend._collect_day_paths
+        def collect_day_paths(*args, **kwargs):
+            for path in orig_collect_day_paths(*args, **kwargs):
+                listed.append(path)
+                yield path
+        monkeypatch.setattr(backend, '_collect_day_paths', collect_day_paths)
+        assert len(backend.search('opera')) == 1
+        assert listed == []
+
+        # a journalled fact does not add a file
+        backend.add(_make_fact(datetime(2014,1,1, 12,0), activity='opera'))
+        assert len(backend.search('opera')) == 2
+        assert listed
+
+        # a day file added by another program changes the directories
+        other = YamlBackend(backend.data_dir, str(tmpdir.mkdir('other')))
+        other.add(_make_fact(datetime(2014,2,1, 12,0), activity='opera'))
+        assert len(backend.search('opera')) == 3
+
+    def test_edited_in_place(self, tmpdir):
+        backend = _make_yaml_backend(tmpdir)
+        day = datetime(2014,1,1)
+        backend.add_many([_make_fact(day.replace(hour=x), activity=activity)
+                          for x, activity in [(10, 'walk'), (11, 'walk'),
+                                              (12, 'opera')]])
+        assert [x.fact['activity'] for x in backend.search('opera')] == \
+            ['opera']
+
+        def rewrite(*facts):
+            # same file, same directories: the tree stamp stays the same
+            other = _make_yaml_backend(tmpdir.mkdir(str(len(tmpdir.listdir()))))
+            other.add_many(facts)
+            with open(other.get_file_path_for_day(day)) as f:
+                content = f.read()
+            with open(backend.get_file_path_for_day(day), 'w') as f:
+                f.write(content)
+
+        # the hit is at a position beyond the end of the file
+        rewrite(_make_fact(day.replace(hour=10), activity='opera'),
+                _make_fact(day.replace(hour=12), activity='walk'))
+        results = backend.search('opera')
+        assert [x.fact['since'].hour for x in results] == [10]
+
+        # the hit points to another fact
+        rewrite(_make_fact(day.replace(hour=10), activity='walk'))
+        assert backend.search('opera') == []
+
+    def test_shared_cache_dir(self, tmpdir):
+        cache_dir = str(tmpdir.mkdir('cache'))
+        first = YamlBackend(str(tmpdir.mkdir('first')), cache_dir)
+        second = YamlBackend(str(tmpdir.mkdir('second')), cache_dir)
+        first.add(_make_fact(datetime(2014,1,1, 10,0), activity='opera'))
+        second.add(_make_fact(datetime(2014,1,2, 10,0), activity='opera'))
+
+        assert [x.fact['since'].day for x in first.search('opera')] == [1]
+        assert [x.fact['since'].day for x in second.search('opera')] == [2]
+
+        # the other diary's search has not dropped the files
+        indexed = _spy(first.search_index, '_index_file')
+        assert len(first.search('opera')) == 1
+        assert indexed == []
+
+    def test_compact_cache(self, tmpdir):
+        backend = _make_yaml_backend(tmpdir, index=True)
+        backend.add_many([_make_fact(datetime(2014,1,1, 10,0) + timedelta(days=x),
+                                     activity='opera')
+                          for x in range(3)])
+        assert len(backend.search('opera')) == 3
+        assert len(list(backend.find(activity='opera'))) == 3
+        assert list(backend.get_known_activities())
+
+        os.remove(backend.get_file_path_for_day(datetime(2014,1,1)))
+        cnt, reclaimed = backend.compact_cache()
+        # the cached file, the activities summary and both indexes
+        assert cnt == 4
+        count, = backend.search_index.db.execute(
+            'SELECT COUNT(*) FROM docs').fetchone()
+        assert count == 2
+        count, = backend.index.db.execute(
+            'SELECT COUNT(*) FROM files').fetchone()
+        assert count == 2
+
+
+class TestYamlBackendLimit:
+
+    def _populate(self, backend):
+        backend.add_many([
+            _make_fact(datetime(2014,1,1, 10,0) + timedelta(days=x),
+                       activity='walk' if x % 10 else 'opera')
+            for x in range(90)
+        ])
+
+    def test_order_limit_offset(self, tmpdir):
+        backend = _make_yaml_backend(tmpdir)
+        self._populate(backend)
+
+        facts = list(backend.find(order='desc', limit=3))
+        assert [x['since'].date() for x in facts] == [
+            date(2014,3,31), date(2014,3,30), date(2014,3,29)]
+
+        facts = list(backend.find(activity='opera', order='desc', limit=2,
+                                  offset=1))
+        assert [x['since'].date() for x in facts] == [
+            date(2014,3,12), date(2014,3,2)]
+
+        facts = list(backend.find(activity='opera', offset=8))
+        assert [x['since'].date() for x in facts] == [date(2014,3,22)]
+
+        with pytest.raises(ValueError):
+            backend.find(order='random')
+
+    def test_stops_early(self, tmpdir):
+        backend = _make_yaml_backend(tmpdir)
+        self._populate(backend)
+
+        loaded = _spy(backend, 'get_cached_day_file')
+
+        facts = list(backend.find(order='desc', limit=2))
+        assert len(facts) == 2
+        assert len(loaded) == 2
+
+        # only the last month is looked into
+        del loaded[:]
+        facts = list(backend.find(activity='walk', order='desc', limit=2))
+        assert len(facts) == 2
+        assert all('/2014/03/' in x for x in loaded)
+
+
+class TestYamlBackendQuery:
+
+    def test_query(self, tmpdir):
+        backend = _make_yaml_backend(tmpdir)
+        backend.add_many([
+            _make_fact(datetime(2014,1,1, 10,0) + timedelta(days=x),
+                       minutes=30 + x, activity='walk' if x % 10 else 'opera',
+                       tags=['with-dog'] if x % 2 else [])
+            for x in range(90)
+        ])
+
+        facts = list(backend.find(query='opera duration>1h'))
+        assert [x['since'].date() for x in facts] == [
+            date(2014,2,10), date(2014,2,20), date(2014,3,2), date(2014,3,12),
+            date(2014,3,22)]
+
+        facts = list(backend.find(activity='opera', query='NOT time:9-11',
+                                  order='desc', limit=1))
+        assert facts == []
+
+        facts = backend.find(since=date(2014,1,1), until=date(2014,1,10),
+                             query='activity:opera, tag:dog', fields=['since'])
+        assert [x.since.day for x in facts] == [1, 2, 4, 6, 8, 10]
+
+        with pytest.raises(QuerySyntaxError):
+            backend.find(query='(opera')
+
+    def test_pushdown(self, tmpdir):
+        backend = _make_yaml_backend(tmpdir)
+        backend.add_many([
+            _make_fact(datetime(2014,1,1, 10,0) + timedelta(days=x),
+                       activity='opera' if x == 40 else 'walk')
+            for x in range(90)
+        ])
+        assert len(list(backend.find(query='activity:opera'))) == 1
+
+        loaded = _spy(backend, 'get_cached_day_file')
+
+        facts = list(backend.find(query='activity:opera NOT tag:x'))
+        assert len(facts) == 1
+        assert loaded == [backend.get_file_path_for_day(date(2014,2,10))]
@@ -0,0 +1,61 @@
+# coding: utf-8
+
+# python
+from datetime import date, datetime
+import random
+
+# 3rd-party
+import monk
+import pytest
+
+# this app
+from timetra.diary.models import Fact
+from timetra.diary.validation import compile_validator
+
+
+VALID = {'activity': 'walk', 'since': datetime(2014,1,1, 10,0),
+         'until': datetime(2014,1,1, 11,0), 'description': None}
+
+VALUES = [None, 1, True, 'x', datetime(2014,1,1), date(2014,1,1), [], ['a'],
+          [None], [1], ('a',), {}]
+
+KEYS = ['activity', 'since', 'until', 'description', 'category', 'tags',
+        'hamster_fact_id', 'foo']
+
+
+def _get_error(func, *args):
+    try:
+        func(*args)
+    except (monk.ValidationError, TypeError) as e:
+        return type(e), str(e)
+
+
+def test_same_as_monk():
+    validate = compile_validator(Fact.structure)
+    rnd = random.Random(0)
+    for i in range(2000):
+        data = dict(VALID)
+        for key in rnd.sample(KEYS, rnd.randint(0, 3)):
+            if rnd.random() < 0.2:
+                data.pop(key, None)
+            else:
+                data[key] = rnd.choice(VALUES)
+        expected = _get_error(monk.validate, Fact.structure, data)
+        assert _get_error(validate, data) == expected
+
+
+def test_path_context():
+    validate = compile_validator(Fact.structure)
+    validate(dict(VALID, tags=['a', None], category='b'), 'foo.yaml')
+    with pytest.raises(monk.ValidationError) as excinfo:
+        validate(dict(VALID, tags=['a', 1]), 'foo.yaml')
+    assert str(excinfo.value).startswith("foo.yaml: 'tags': #1: 1")
+
+
+def test_model():
+    # as used when loading day files: only the type is checked
+    validate = compile_validator(Fact)
+    validate(Fact(VALID))
+    for data in [VALID, None, []]:
+        assert _get_error(validate, data) == \
+            _get_error(monk.validate, Fact, data)
@@ -0,0 +1,69 @@
+# coding: utf-8
+
+# python
+from collections import OrderedDict
+from datetime import datetime
+import importlib.util
+
+# 3rd-party
+import pytest
+import yaml
+
+# this app
+from timetra.diary import yamlio
+
+
+DUMPERS = [yaml.SafeDumper]
+if yamlio.HAS_LIBYAML:
+    DUMPERS.append(yaml.CSafeDumper)
+
+
+@pytest.fixture
+def representers(request):
+    "Restores the representers of the global yaml dumpers after the test."
+    dumpers = set([yaml.Dumper, yamlio.Dumper] + DUMPERS)
+    saved = dict((x, dict(x.__dict__['yaml_representers'])
+                  if 'yaml_representers' in x.__dict__ else None)
+                 for x in dumpers)
+    def restore():
+        for dumper, representers in saved.items():
+            if representers is not None:
+                dumper.yaml_representers = representers
+            elif 'yaml_representers' in dumper.__dict__:
+                del dumper.yaml_representers
+    request.addfinalizer(restore)
+
+
+@pytest.mark.parametrize('dumper', DUMPERS)
+def test_representers(dumper, monkeypatch, representers):
+    monkeypatch.setattr(yamlio, 'Dumper', dumper)
+    yamlio.configure_yaml()
+
+    data = [OrderedDict([
+        ('activity', 'walk'),
+        ('since', datetime(2014,1,1, 10,0)),
+        ('description', yamlio.Literal('first line\nsecond line')),
+    ])]
+    dumped = yamlio.dump(data)
+
+    assert dumped.index('activity') < dumped.index('since')
+    assert 'description: |' in dumped
+    assert yamlio.load(dumped) == [dict(data[0])]
+
+
+def test_without_libyaml(monkeypatch, representers):
+    monkeypatch.delattr(yaml, 'CSafeLoader', raising=False)
+    monkeypatch.delattr(yaml, 'CSafeDumper', raising=False)
+
+    # a separate copy of the module, imported without LibYAML
+    spec = importlib.util.spec_from_file_location('yamlio_without_libyaml',
+                                                  yamlio.__file__)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    assert not module.HAS_LIBYAML
+    assert module.Dumper is yaml.SafeDumper
+
+    data = [{'description': module.Literal('first line\nsecond line')}]
+    dumped = module.dump(data)
+    assert 'description: |' in dumped
+    assert module.load(dumped) == [{'description': 'first line\nsecond line'}]
@@ -0,0 +1,98 @@
+# coding: utf-8
+#
+#    Timetra is a time tracking application and library.
+#    Copyright © 2010-2014  Andrey Mikhaylenko
+#
+#    This file is part of Timetra.
+#
+#    Timetra is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Timetra is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with Timetra.  If not, see <http://gnu.org/licenses/>.
+#
+"""
+Aggregation
+===========
+
+Totals of facts grouped by activity, category, tag or period.
+"""
+from collections import OrderedDict
+import datetime
+
+
+__all__ = ['GROUP_BY', 'METRICS', 'get_group_keys', 'aggregate_facts']
+
+
+GROUP_BY = ('activity', 'category', 'tag', 'day', 'week', 'month')
+
+METRICS = ('duration', 'count')
+
+
+def check_arguments(group_by, metric):
+    if group_by not in GROUP_BY:
+        raise ValueError('group_by must be one of {}'.format(
+            ', '.join(GROUP_BY)))
+    if metric not in METRICS:
+        raise ValueError('metric must be one of {}'.format(', '.join(METRICS)))
+
+
+def get_period_key(date, group_by):
+    "Returns the first day of the period that contains given date."
+    if group_by == 'week':
+        return date - datetime.timedelta(days=date.weekday())
+    if group_by == 'month':
+        return date.replace(day=1)
+    return date
+
+
+def get_group_keys(fact, group_by):
+    """
+    Returns a list of keys under which given fact is counted.  A fact is
+    counted once per tag; facts without tags are not counted by tag.  The
+    periods are determined by the start of the fact.
+    """
+    if group_by == 'tag':
+        return list(getattr(fact, 'tags', None) or ())
+    if group_by in ('day', 'week', 'month'):
+        return [get_period_key(fact.since.date(), group_by)]
+    return [getattr(fact, group_by, None)]
+
+
+def sort_totals(totals):
+    "Returns an `OrderedDict` with given totals ordered by key."
+    # `None` (e.g. a fact without category) goes last
+    keys = sorted(totals, key=lambda x: (x is None, x or ''))
+    return OrderedDict((k, totals[k]) for k in keys)
+
+
+def aggregate_facts(facts, group_by, metric, now=None):
+    """
+    Returns an `OrderedDict` of totals for given facts.  The facts only need
+    the attributes `since`, `until` and the one for `group_by`.
+
+    :param metric:
+        `duration` (a `timedelta`; facts in progress count until `now`) or
+        `count` (the number of facts).
+    """
+    check_arguments(group_by, metric)
+    now = now or datetime.datetime.now()
+    totals = {}
+    for fact in facts:
+        if metric == 'count':
+            value = 1
+        else:
+            value = (fact.until or now) - fact.since
+        for key in get_group_keys(fact, group_by):
+            if key in totals:
+                totals[key] += value
+            else:
+                totals[key] = value
+    return sort_totals(totals)
@@ -37,6 +37,7 @@ import yaml
 from .storage import Storage, YamlBackend
 
 from .diary import Diary
+from .maintenance import CacheMaintenance
 from .reporting import Reporting
 from .timer import Timing
 from .curses import TUI
@@ -66,6 +67,7 @@ def main():
     reporting = Reporting({'storage': storage})
     timing = Timing({'storage': storage})
     tui = TUI({'storage': storage})
+    cache = CacheMaintenance({'storage': storage})
     #old_cli = LegacyCLI({'storage': storage})
 
     command_tree = {
@@ -81,6 +83,7 @@ def main():
         'tui': [
             tui.run,
         ],
+        'cache': cache.commands,
         #'old':    old_cli.commands,
     }
     for namespace, commands in command_tree.items():
@@ -1,25 +1,110 @@
 # coding: utf-8
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+import glob
+import hashlib
 import logging
 import os
+import pickle
+import re
 import shelve
+import sqlite3
+import stat
+import time
 
-import yaml
-from monk import ValidationError, validate
+import monk
 
+from . import validation, yamlio
+from .records import DayRecord
 
-__all__ = ['Cache']
+
+__all__ = ['Cache', 'CachedSummaries', 'ShelveStore', 'SQLiteStore',
+           'FileStamp', 'get_file_stamp', 'get_model_version',
+           'connect_sqlite', 'remove_sqlite_files']
 
 
 log = logging.getLogger(__name__)
 
 
-class Cache:
-    APP_NAME = 'timetra-diary'
+# the number of files handed to a worker process at once (see `Cache.warm()`)
+BATCH_SIZE = 100
+
+# the last access time of an entry is only updated when it is older than
+# this many seconds, so that reads don't turn into writes
+ACCESS_RESOLUTION = 3600
+
+# the number of new entries after which the size limit is checked
+EVICTION_INTERVAL = 100
+
+
+# bump when the way objects are stored in the cache changes
+PAYLOAD_VERSION = 2
+
+# seconds to wait for another process to finish writing to an SQLite database
+SQLITE_TIMEOUT = 30
+
+
+FileStamp = namedtuple('FileStamp', 'mtime_ns size ino digest')
+
+
+def get_file_stamp(path, hash_content=False, journal_suffix=None):
+    """
+    Returns a :class:`FileStamp` for given path.  A file is considered
+    unchanged while its stamp is the same.
+
+    The modification time alone is not enough: editors and sync tools may
+    rewrite a file within the same timestamp tick.  Most of them change the
+    size or (when writing a new file and renaming it) the inode.  For the
+    rest there is `hash_content`, which adds a digest of the content.
+
+    If `journal_suffix` is given, the stamp of the file's journal (the path
+    with the suffix), if any, is folded into the digest, so that appending
+    to the journal, editing or removing it changes the stamp of the file.
+    """
+    st = os.stat(path)
+    if stat.S_ISDIR(st.st_mode):
+        return FileStamp(st.st_mtime_ns, st.st_size, st.st_ino, None)
+    digest = None
+    if hash_content:
+        with open(path, 'rb') as f:
+            digest = hashlib.sha1(f.read()).digest()
+    if journal_suffix:
+        try:
+            journal = get_file_stamp(path + journal_suffix, hash_content)
+        except FileNotFoundError:
+            pass
+        else:
+            digest = hashlib.sha1(repr((digest, journal)).encode()).digest()
+    return FileStamp(st.st_mtime_ns, st.st_size, st.st_ino, digest)
+
+
+def connect_sqlite(path, isolation_level=''):
+    """
+    Returns a connection to given SQLite database, set up the same way for
+    the cache and the indexes next to it.  The database is in WAL mode, so
+    any number of processes may read it while another one is writing, and
+    writers wait for each other up to :data:`SQLITE_TIMEOUT` seconds.  A
+    commit is not synced to disk; a crash may lose the last transactions
+    but does not corrupt the database, which only holds derived data.
+    """
+    db = sqlite3.connect(path, timeout=SQLITE_TIMEOUT,
+                         isolation_level=isolation_level)
+    db.execute('PRAGMA journal_mode=WAL')
+    db.execute('PRAGMA synchronous=NORMAL')
+    return db
+
+
+class ShelveStore:
+    """
+    Cache store based on :mod:`shelve`.  Three keys are kept per file: the
+    stamp with the model version, the content and the usage (payload size
+    and last access time).
+    """
     FILE_NAME = 'yaml_files.db'
 
-    def __init__(self, root_dir=None):
-        cache_dir = root_dir or self._make_xdg_dir()
-        path = cache_dir + '/' + self.FILE_NAME
+    def __init__(self, cache_dir):
+        path = os.path.join(cache_dir, self.FILE_NAME)
 
         if not os.path.exists(path):
             log.info('Creating cache database...')
@@ -34,55 +119,818 @@ class Cache:
         self.path = path
         self.db = db
 
+    def get(self, path):
+        "Returns a `(stamp, version, data)` tuple for given path or `None`."
+        header = self.db.get('changed:' + path)
+        if header is None:
+            return None
+        size, accessed = self.db.get('usage:' + path, (0, 0))
+        now = int(time.time())
+        if accessed < now - ACCESS_RESOLUTION:
+            self.db['usage:' + path] = size, now
+        stamp, version = header
+        return stamp, version, self.db['content:' + path]
+
+    def get_header(self, path):
+        "Returns a `(stamp, version)` tuple for given path or `None`."
+        return self.db.get('changed:' + path)
+
+    def put(self, path, stamp, version, data):
+        size = len(pickle.dumps(data, protocol=-1))
+        self.db['content:' + path] = data
+        self.db['changed:' + path] = stamp, version
+        self.db['usage:' + path] = size, int(time.time())
+
+    def remove(self, path):
+        for prefix in ('content:', 'changed:', 'usage:'):
+            self.db.pop(prefix + path, None)
+
+    def get_entries(self):
+        "Returns a list of `(path, size, last_accessed)` tuples."
+        entries = []
+        for key in self.db.keys():
+            if key.startswith('changed:'):
+                path = key[len('changed:'):]
+                size, accessed = self.db.get('usage:' + path, (0, 0))
+                entries.append((path, size, accessed))
+        return entries
+
+    def vacuum(self):
+        # dbm files never shrink; the only way is to write a new one
+        items = dict(self.db.items())
+        self.db.close()
+        self._remove_files()
+        self.db = shelve.open(self.path, flag='n', protocol=-1)
+        self.db.update(items)
+        self.db.sync()
+
+    def _remove_files(self):
+        # depending on the dbm module there are several files with the same
+        # prefix, e.g. `.db` or `.dat`, `.dir` and `.bak`
+        for file_path in glob.glob(glob.escape(self.path) + '*'):
+            os.remove(file_path)
+
+    def get_meta(self, key, default=None):
+        return self.db.get('meta:' + key, default)
+
+    def set_meta(self, key, value):
+        self.db['meta:' + key] = value
+
+    def _get_summary_prefix(self, key):
+        return 'summary:' + key + '\0'
+
+    def get_summaries(self, key):
+        "Returns a `{path: value}` dict of the summaries under given key."
+        prefix = self._get_summary_prefix(key)
+        return dict((x[len(prefix):], self.db[x]) for x in self.db.keys()
+                    if x.startswith(prefix))
+
+    def get_summary(self, key, path, default=None):
+        return self.db.get(self._get_summary_prefix(key) + path, default)
+
+    def get_summary_paths(self, key):
+        prefix = self._get_summary_prefix(key)
+        return [x[len(prefix):] for x in self.db.keys()
+                if x.startswith(prefix)]
+
+    def put_summary(self, key, path, value):
+        self.db[self._get_summary_prefix(key) + path] = value
+
+    def remove_summary(self, key, path):
+        self.db.pop(self._get_summary_prefix(key) + path, None)
+
+    def clear_summaries(self, key):
+        for path in self.get_summary_paths(key):
+            self.remove_summary(key, path)
+
+    def get_summary_entries(self):
+        "Returns a list of `(key, path)` tuples for all summaries."
+        return [tuple(x[len('summary:'):].split('\0', 1))
+                for x in self.db.keys() if x.startswith('summary:')]
+
+    def get_derived_size(self):
+        "Returns the total size of the summaries and meta records in bytes."
+        return sum(len(pickle.dumps(self.db[x], protocol=-1))
+                   for x in self.db.keys()
+                   if x.startswith(('summary:', 'meta:')))
+
+    @contextmanager
+    def transaction(self):
+        yield
+        self.db.sync()
+
+    def close(self):
+        self.db.close()
+
+    def reset(self):
+        "Closes the database and removes its files."
+        try:
+            self.db.close()
+        except:
+            pass
+        self._remove_files()
+
+
+class SQLiteStore:
+    """
+    Cache store based on SQLite.  There is one row per file with its stamp
+    and pickled content.  The database is in WAL mode, so any number of
+    processes may read it while another one is writing.
+    """
+    FILE_NAME = 'yaml_files.sqlite'
+
+    SCHEMA_VERSION = 5
+
+    def __init__(self, cache_dir):
+        path = os.path.join(cache_dir, self.FILE_NAME)
+
+        if not os.path.exists(path):
+            log.info('Creating cache database...')
+
+        try:
+            db = self._connect(path)
+        except sqlite3.DatabaseError:
+            log.warn('Could not load cache, recreating...')
+            os.remove(path)
+            db = self._connect(path)
+
+        self.path = path
+        self.db = db
+        self._depth = 0
+
+    def _connect(self, path):
+        # autocommit unless within `transaction()`
+        db = connect_sqlite(path, isolation_level=None)
+        version, = db.execute('PRAGMA user_version').fetchone()
+        if version != self.SCHEMA_VERSION:
+            # it's only a cache; start over
+            for table in ('files', 'meta', 'summaries'):
+                db.execute('DROP TABLE IF EXISTS ' + table)
+            db.execute('PRAGMA user_version = {:d}'.format(
+                self.SCHEMA_VERSION))
+        db.execute('CREATE TABLE IF NOT EXISTS files ('
+                   '  path TEXT PRIMARY KEY,'
+                   '  mtime_ns INTEGER NOT NULL,'
+                   '  size INTEGER NOT NULL,'
+                   '  ino INTEGER NOT NULL,'
+                   '  digest BLOB,'
+                   '  version TEXT NOT NULL,'
+                   '  accessed INTEGER NOT NULL,'
+                   '  payload BLOB NOT NULL)')
+        db.execute('CREATE TABLE IF NOT EXISTS meta ('
+                   '  key TEXT PRIMARY KEY,'
+                   '  value BLOB NOT NULL)')
+        # one row per file (or other unit) of derived data; see
+        # `CachedSummaries`
+        db.execute('CREATE TABLE IF NOT EXISTS summaries ('
+                   '  key TEXT NOT NULL,'
+                   '  path TEXT NOT NULL,'
+                   '  payload BLOB NOT NULL,'
+                   '  PRIMARY KEY (key, path)'
+                   ') WITHOUT ROWID')
+        return db
+
+    def get(self, path):
+        "Returns a `(stamp, version, data)` tuple for given path or `None`."
+        row = self.db.execute('SELECT mtime_ns, size, ino, digest, version, '
+                              '  accessed, payload '
+                              'FROM files WHERE path = ?', (path,)).fetchone()
+        if row is None:
+            return None
+        now = int(time.time())
+        if row[5] < now - ACCESS_RESOLUTION:
+            self.db.execute('UPDATE files SET accessed = ? WHERE path = ?',
+                            (now, path))
+        return FileStamp(*row[:4]), row[4], pickle.loads(row[6])
+
+    def get_header(self, path):
+        "Returns a `(stamp, version)` tuple for given path or `None`."
+        row = self.db.execute('SELECT mtime_ns, size, ino, digest, version '
+                              'FROM files WHERE path = ?', (path,)).fetchone()
+        return (FileStamp(*row[:4]), row[4]) if row else None
+
+    def put(self, path, stamp, version, data):
+        payload = pickle.dumps(data, protocol=-1)
+        self.db.execute('INSERT OR REPLACE INTO files '
+                        'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                        (path,) + tuple(stamp) +
+                        (version, int(time.time()), payload))
+
+    def remove(self, path):
+        self.db.execute('DELETE FROM files WHERE path = ?', (path,))
+
+    def get_entries(self):
+        "Returns a list of `(path, size, last_accessed)` tuples."
+        return self.db.execute('SELECT path, length(payload), accessed '
+                               'FROM files').fetchall()
+
+    def vacuum(self):
+        self.db.execute('VACUUM')
+        # the pages are copied through the WAL; give that space back too
+        self.db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+    def get_meta(self, key, default=None):
+        row = self.db.execute('SELECT value FROM meta WHERE key = ?',
+                              (key,)).fetchone()
+        if row is None:
+            return default
+        return pickle.loads(row[0])
+
+    def set_meta(self, key, value):
+        payload = pickle.dumps(value, protocol=-1)
+        self.db.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                        (key, payload))
+
+    def get_summaries(self, key):
+        "Returns a `{path: value}` dict of the summaries under given key."
+        rows = self.db.execute('SELECT path, payload FROM summaries '
+                               'WHERE key = ?', (key,))
+        return dict((path, pickle.loads(payload)) for path, payload in rows)
+
+    def get_summary(self, key, path, default=None):
+        row = self.db.execute('SELECT payload FROM summaries '
+                              'WHERE key = ? AND path = ?',
+                              (key, path)).fetchone()
+        if row is None:
+            return default
+        return pickle.loads(row[0])
+
+    def get_summary_paths(self, key):
+        return [x for x, in self.db.execute('SELECT path FROM summaries '
+                                            'WHERE key = ?', (key,))]
+
+    def put_summary(self, key, path, value):
+        payload = pickle.dumps(value, protocol=-1)
+        self.db.execute('INSERT OR REPLACE INTO summaries VALUES (?, ?, ?)',
+                        (key, path, payload))
+
+    def remove_summary(self, key, path):
+        self.db.execute('DELETE FROM summaries WHERE key = ? AND path = ?',
+                        (key, path))
+
+    def clear_summaries(self, key):
+        self.db.execute('DELETE FROM summaries WHERE key = ?', (key,))
+
+    def get_summary_entries(self):
+        "Returns a list of `(key, path)` tuples for all summaries."
+        return self.db.execute('SELECT key, path FROM summaries').fetchall()
+
+    def get_derived_size(self):
+        "Returns the total size of the summaries and meta records in bytes."
+        size, = self.db.execute(
+            'SELECT (SELECT total(length(payload)) FROM summaries)'
+            '  + (SELECT total(length(value)) FROM meta)').fetchone()
+        return int(size)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Groups the writes made within the block into a single transaction.
+        Nested blocks join the outer transaction.
+        """
+        if self._depth:
+            self._depth += 1
+            try:
+                yield
+            finally:
+                self._depth -= 1
+            return
+
+        self.db.execute('BEGIN IMMEDIATE')
+        self._depth = 1
+        try:
+            yield
+        except:
+            self.db.execute('ROLLBACK')
+            raise
+        else:
+            self.db.execute('COMMIT')
+        finally:
+            self._depth = 0
+
+    def close(self):
+        self.db.close()
+
+    def reset(self):
+        "Closes the database and removes its files."
+        try:
+            self.db.close()
+        except:
+            pass
+        remove_sqlite_files(self.path)
+
+
+STORES = {
+    'shelve': ShelveStore,
+    'sqlite': SQLiteStore,
+}
+
+
+class Cache:
+    """
+    Cache of objects loaded from YAML files.  An entry is valid while the
+    file's stamp (see :func:`get_file_stamp`) and the model version (see
+    :func:`get_model_version`) stay the same.  Outdated entries are replaced
+    one by one as the files are read again.
+
+    :param root_dir:
+        the cache directory.  Defaults to the XDG cache directory.
+    :param store:
+        the name of the store (see :data:`STORES`).
+    :param hash_content:
+        if `True`, the stamp also includes a digest of the file content.
+        This costs reading each file on every access; only worth it on
+        filesystems with coarse timestamps.
+    :param max_size:
+        the maximum total size of the cache in bytes.  The summaries, the
+        meta records and the sidecar databases (see :meth:`add_sidecar`)
+        count against it, but only the cached file contents are evicted
+        (least recently used first) when it is exceeded; the rest is derived
+        from the existing files and is dropped along with them by
+        :meth:`compact`.  The files on disk are only shrunk by
+        :meth:`compact` too.  Unlimited by default.
+    :param journal_suffix:
+        if given, the objects from a file's journal (the path with this
+        suffix) are cached together with the file's own, ordered by `since`.
+        The journal is part of the file's stamp.
+    """
+    APP_NAME = 'timetra-diary'
+
+    def __init__(self, root_dir=None, store='sqlite', hash_content=False,
+                 max_size=None, journal_suffix=None):
+        cache_dir = root_dir or self._make_xdg_dir()
+        self.store = STORES[store](cache_dir)
+        self.path = self.store.path
+        self.hash_content = hash_content
+        self.max_size = max_size
+        self.journal_suffix = journal_suffix
+        self._puts = 0
+        # path → (stamp, version, data) to be written; see `batch()`
+        self._pending = None
+        # path → function that returns the object keeping the database
+        self._sidecars = {}
+
+    def add_sidecar(self, path, get):
+        """
+        Registers a database kept next to the cache and derived from the
+        cached files, such as an index.  Its files count against
+        :attr:`max_size` and it is compacted along with the cache.
+
+        :param get:
+            a function that returns the object keeping the database.  It
+            must have the `collect_garbage()` and `vacuum()` methods.  The
+            function is only called by :meth:`compact` if the database
+            exists.
+        """
+        self._sidecars[path] = get
+
+    def get_stamp(self, path):
+        return get_file_stamp(path, hash_content=self.hash_content,
+                              journal_suffix=self.journal_suffix)
+
     def _make_xdg_dir(self):
         import xdg.BaseDirectory
         return xdg.BaseDirectory.save_cache_path(self.APP_NAME)
 
     def get_cached_yaml_file(self, path, model):
+        """
+        Returns a :class:`~timetra.diary.records.DayRecord` with the objects
+        from given file.
+        """
         #results = tmpl_cache.get(key=search_param, createfunc=load_card)
-        time_key = 'changed:' + path
-        data_key = 'content:' + path
-        mtime_cache = self.db.get(time_key)
-        mtime_file = os.stat(path).st_mtime
-        if mtime_cache == mtime_file:
-            data = self.db[data_key]
-            log.debug('[x]', path)
+        stamp = self.get_stamp(path)
+        version = get_model_version(model)
+        cached = self._pending and self._pending.get(path)
+        if not cached:
+            cached = self.store.get(path)
+        if cached and cached[:2] == (stamp, version):
+            data = cached[2]
+            log.debug('[x] %s', path)
         else:
-            log.debug('[ ]', path)
-            data = list(self._load_object_list(path, model))
-            self.db[data_key] = data
-            self.db[time_key] = mtime_file
-        #cache.close()
+            log.debug('[ ] %s', path)
+            data = DayRecord(model, _load_day(path, model,
+                                              self.journal_suffix))
+            if self._pending is None:
+                self.store.put(path, stamp, version, data)
+            else:
+                self._pending[path] = stamp, version, data
+                if len(self._pending) >= BATCH_SIZE:
+                    self._flush()
+            self._puts += 1
+            if self._puts >= EVICTION_INTERVAL:
+                self.evict()
         return data
 
+    @contextmanager
+    def batch(self):
+        """
+        Defers writing the entries loaded within the block and writes them
+        in a transaction per :data:`BATCH_SIZE` entries.  Unlike
+        :meth:`transaction`, no lock is held while the block runs, so it may
+        wrap a lazy walk over the files.  Nested blocks join the outer one.
+        """
+        if self._pending is not None:
+            yield
+            return
+        self._pending = {}
+        try:
+            yield
+        finally:
+            self._flush()
+            self._pending = None
 
-    def _load_object_list(self, path, model):
-        with open(path) as f:
-            try:
-                items = yaml.load(f)
-            except:
-                print('FAILED to load', model, 'from', path)
-                raise
+    def _flush(self):
+        if not self._pending:
+            return
+        with self.store.transaction():
+            for path, (stamp, version, data) in self._pending.items():
+                self.store.put(path, stamp, version, data)
+        self._pending.clear()
+
+    def _collect_stale_paths(self, paths, version):
+        for path in paths:
+            if self.store.get_header(path) != (self.get_stamp(path), version):
+                yield path
+
+    def warm(self, paths, model, workers=None, batch_size=BATCH_SIZE):
+        """
+        Loads and validates the files that are missing from the cache or have
+        changed, using a pool of processes, and stores the results.  Returns
+        the number of files loaded.
+
+        :param workers:
+            the number of worker processes.  Defaults to the number of CPUs.
+        :param batch_size:
+            the number of files handed to a worker at once.  The results of
+            each batch are written in a single transaction.
+
+        """
+        version = get_model_version(model)
+        stale = list(self._collect_stale_paths(paths, version))
+        if not stale:
+            return 0
+
+        batches = [stale[i:i+batch_size]
+                   for i in range(0, len(stale), batch_size)]
+
+        log.info('Loading %d files with %s workers...', len(stale),
+                 workers or 'all available')
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_load_files, batch, model,
+                                       self.hash_content, self.journal_suffix)
+                       for batch in batches]
+            for future in as_completed(futures):
+                with self.store.transaction():
+                    for path, stamp, data in future.result():
+                        self.store.put(path, stamp, version, data)
+
+        self.evict()
+        return len(stale)
+
+    def collect_garbage(self):
+        """
+        Removes the entries and summaries for files that do not exist
+        anymore.  Returns the number of removed entries.
+        """
+        cnt = 0
+        with self.store.transaction():
+            for path, size, accessed in self.store.get_entries():
+                if not os.path.exists(path):
+                    self.store.remove(path)
+                    cnt += 1
+            # the aggregated state is rebuilt on load (see `CachedSummaries`)
+            for key, path in self.store.get_summary_entries():
+                if not os.path.exists(path):
+                    self.store.remove_summary(key, path)
+                    cnt += 1
+        return cnt
+
+    def _get_sidecar_size(self):
+        return sum(_get_files_size(x) for x in self._sidecars)
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the total size of
+        the cache is within :attr:`max_size`.  Returns the number of removed
+        entries.
+        """
+        self._puts = 0
+        if self.max_size is None:
+            return 0
+        entries = self.store.get_entries()
+        total = (sum(x[1] for x in entries) + self.store.get_derived_size() +
+                 self._get_sidecar_size())
+        if total <= self.max_size:
+            return 0
+        cnt = 0
+        entries.sort(key=lambda x: x[2])
+        with self.store.transaction():
+            for path, size, accessed in entries:
+                if total <= self.max_size:
+                    break
+                self.store.remove(path)
+                total -= size
+                cnt += 1
+        log.debug('Evicted %d entries', cnt)
+        return cnt
+
+    def get_disk_usage(self):
+        "Returns the total size of the cache and sidecar files in bytes."
+        return _get_files_size(self.path) + self._get_sidecar_size()
+
+    def compact(self):
+        """
+        Removes the entries for missing files (here and in the sidecar
+        databases), evicts entries beyond :attr:`max_size` and shrinks the
+        files on disk.  Returns a `(removed_entries, reclaimed_bytes)` tuple.
+        """
+        before = self.get_disk_usage()
+        cnt = self.collect_garbage()
+        sidecars = [get() for path, get in sorted(self._sidecars.items())
+                    if os.path.exists(path)]
+        for sidecar in sidecars:
+            cnt += sidecar.collect_garbage()
+        cnt += self.evict()
+        self.store.vacuum()
+        for sidecar in sidecars:
+            sidecar.vacuum()
+        return cnt, before - self.get_disk_usage()
+
+    def get_meta(self, key, default=None):
+        "Returns an arbitrary value stored with :meth:`set_meta`."
+        return self.store.get_meta(key, default)
+
+    def set_meta(self, key, value):
+        self.store.set_meta(key, value)
+
+    def get_summaries(self, key):
+        "Returns a `{path: value}` dict stored with :meth:`put_summary`."
+        return self.store.get_summaries(key)
+
+    def get_summary(self, key, path, default=None):
+        return self.store.get_summary(key, path, default)
+
+    def get_summary_paths(self, key):
+        return self.store.get_summary_paths(key)
+
+    def put_summary(self, key, path, value):
+        self.store.put_summary(key, path, value)
 
-        if not items:
+    def remove_summary(self, key, path):
+        self.store.remove_summary(key, path)
+
+    def clear_summaries(self, key):
+        self.store.clear_summaries(key)
+
+    def transaction(self):
+        "Groups the writes made within the block (if the store supports it)."
+        return self.store.transaction()
+
+    def reset(self):
+        self.store.reset()
+
+
+class CachedSummaries:
+    """
+    Base class for data derived from files and kept in the cache along with
+    the stamps of the files it was computed from.  Only new and changed
+    files are read on :meth:`sync`.
+
+    The summary of each file is stored separately, so a change to one file
+    only rewrites its own summary.  Subclasses implement :meth:`summarize`
+    and keep their aggregated state (which should stay small; it is stored
+    as a whole) up to date in :meth:`_on_added` and :meth:`_on_removed`.
+
+    :param cache:
+        a :class:`Cache` instance.
+    :param key:
+        the key under which the data is stored in the cache.
+    """
+    # bump in subclasses when the summaries change; stored data with another
+    # version is discarded
+    VERSION = 1
+
+    def __init__(self, cache, key):
+        self.cache = cache
+        self.key = key
+        # the tree stamp of the last full sync, if any; see `sync()`
+        self._tree_stamp = None
+        # path → (stamp, summary)
+        self._files, state = self._load()
+        self._load_state(state)
+
+    def _load(self):
+        "Returns the stored `({path: (stamp, summary)}, state)` tuple."
+        record = self.cache.get_meta(self.key) or {}
+        if record.get('version') != self.VERSION:
+            self.cache.clear_summaries(self.key)
+            return {}, None
+        files = self.cache.get_summaries(self.key)
+        if record.get('count') != len(files):
+            # some summaries were dropped by `Cache.collect_garbage()`
+            self._load_state(None)
+            for path, (stamp, summary) in files.items():
+                self._on_added(path, summary)
+            return files, self._dump_state()
+        self._tree_stamp = record.get('tree_stamp')
+        return files, record.get('state')
+
+    def summarize(self, path, items):
+        "Returns a summary for given list of items loaded from given path."
+        raise NotImplementedError
+
+    def _load_state(self, state):
+        pass
+
+    def _dump_state(self):
+        return None
+
+    def _on_added(self, path, summary):
+        pass
+
+    def _on_removed(self, path, summary):
+        pass
+
+    def _on_changed(self):
+        "Called after a :meth:`sync` that changed anything."
+        pass
+
+    def _save(self, added, removed):
+        "Stores the summaries of given (added or changed, removed) paths."
+        log.debug('Saving %s (%d changed, %d removed)', self.key,
+                  len(added), len(removed))
+        with self.cache.transaction():
+            for path in added:
+                self.cache.put_summary(self.key, path, self._files[path])
+            for path in removed:
+                self.cache.remove_summary(self.key, path)
+            self.cache.set_meta(self.key, {'version': self.VERSION,
+                                           'count': len(self._files),
+                                           'state': self._dump_state(),
+                                           'tree_stamp': self._tree_stamp})
+
+    def sync(self, paths, load, prune=True, tree_stamp=None):
+        """
+        Updates the data with given files.
+
+        :param load:
+            a function that takes a path and returns the list of items.
+            It is only called for new or changed files.
+        :param prune:
+            if `True`, files not listed anymore are forgotten.  Pass `False`
+            if the paths are only a subset of the known ones.
+        :param tree_stamp:
+            a cheap stamp of the whole set of files.  If it is the same as on
+            the last sync with `prune`, the paths are not even listed.  A
+            file that has changed without changing the tree stamp is only
+            noticed by :meth:`refresh`.
+        """
+        if tree_stamp is not None and tree_stamp == self._tree_stamp:
             return
+        added = []
+        seen = set()
+        for path in paths:
+            seen.add(path)
+            if self._update(path, self.cache.get_stamp(path), load):
+                added.append(path)
 
-        for data in items:
-            obj = model(data)
+        removed = list(set(self._files) - seen) if prune else []
+        for path in removed:
+            entry = self._files.pop(path)
+            self._on_removed(path, entry[1])
 
+        stamped = prune and tree_stamp != self._tree_stamp
+        if stamped:
+            self._tree_stamp = tree_stamp
+        if added or removed:
+            self._on_changed()
+        if added or removed or stamped:
+            self._save(added, removed)
+
+    def refresh(self, paths, load):
+        """
+        Updates the data with those of given files that have changed since
+        the last sync or do not exist anymore, regardless of the tree stamp
+        (see :meth:`sync`).  Returns `True` if there were any.
+        """
+        added = []
+        removed = []
+        for path in paths:
             try:
-                validate(model, obj)
-            except (ValidationError, TypeError) as e:
-                raise type(e)('{path}: {e}'.format(path=path, e=e))
+                stamp = self.cache.get_stamp(path)
+            except FileNotFoundError:
+                if path in self._files:
+                    entry = self._files.pop(path)
+                    self._on_removed(path, entry[1])
+                    removed.append(path)
+                continue
+            if self._update(path, stamp, load):
+                added.append(path)
+        if not (added or removed):
+            return False
+        self._on_changed()
+        self._save(added, removed)
+        return True
 
-            yield obj
+    def _update(self, path, stamp, load):
+        # returns `True` if the file is new or has changed
+        entry = self._files.get(path)
+        if entry and entry[0] == stamp:
+            return False
+        summary = self.summarize(path, load(path))
+        if entry:
+            del self._files[path]
+            self._on_removed(path, entry[1])
+        self._files[path] = stamp, summary
+        self._on_added(path, summary)
+        return True
 
-    def reset(self):
+
+def remove_sqlite_files(path):
+    "Removes given SQLite database along with its WAL files."
+    # SQLite in WAL mode keeps a couple of files next to the database
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def _get_files_size(path):
+    # SQLite in WAL mode and dbm keep several files with the same prefix
+    return sum(os.path.getsize(x) for x in glob.glob(glob.escape(path) + '*'))
+
+
+_model_versions = {}
+
+
+def get_model_version(model):
+    """
+    Returns a short string that identifies the structure of given model
+    together with the versions of :mod:`monk` and of the cache payload.
+    Cached objects are only reused if stored under the same version.
+    """
+    if model not in _model_versions:
+        # reprs of callables (e.g. defaults) contain memory addresses
+        structure = re.sub(r' at 0x[0-9a-f]+', '', repr(model.structure))
+        source = '\n'.join([
+            str(PAYLOAD_VERSION),
+            getattr(monk, '__version__', ''),
+            model.__module__ + '.' + model.__name__,
+            structure,
+        ])
+        digest = hashlib.sha1(source.encode('utf-8')).hexdigest()
+        _model_versions[model] = digest[:16]
+    return _model_versions[model]
+
+
+_validators = {}
+
+
+def _get_validator(model):
+    # same as `monk.validate(model, obj)`, compiled once per model
+    if model not in _validators:
+        _validators[model] = validation.compile_validator(model)
+    return _validators[model]
+
+
+def _load_object_list(path, model):
+    with open(path) as f:
         try:
-            self.db.close()
+            items = yamlio.load(f)
         except:
-            pass
-        os.remove(self.path)
+            print('FAILED to load', model, 'from', path)
+            raise
+
+    if not items:
+        return
+
+    validate = _get_validator(model)
+    for data in items:
+        obj = model(data)
+        validate(obj, path)
+        yield obj
+
+
+def _load_day(path, model, journal_suffix=None):
+    items = _load_object_list(path, model)
+    if journal_suffix and os.path.exists(path + journal_suffix):
+        journalled = _load_object_list(path + journal_suffix, model)
+        # the sort is stable so the order within the file is preserved
+        items = sorted(list(items) + list(journalled),
+                       key=lambda x: x['since'])
+    return items
+
+
+def _load_files(paths, model, hash_content=False, journal_suffix=None):
+    # runs in a worker process (see `Cache.warm()`)
+    results = []
+    for path in paths:
+        stamp = get_file_stamp(path, hash_content=hash_content,
+                               journal_suffix=journal_suffix)
+        results.append((path, stamp,
+                        DayRecord(model, _load_day(path, model,
+                                                   journal_suffix))))
+    return results
 
 
 #cache = Cache()
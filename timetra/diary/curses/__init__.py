@@ -158,15 +158,13 @@ class DayView(object):
             ])
             self.factlog.body.append(text)
 
-    def refresh_stats(self, facts):
+    def refresh_stats(self, since, until=None):
         # Summary by categories
         self.stats.body[:] = []
-        categories = {}
-        if not facts:
+        categories = self.storage.aggregate(since=since, until=until,
+                                            group_by='category')
+        if not categories:
             return
-        for fact in facts:
-            categories.setdefault(fact.category, datetime.timedelta(0))
-            categories[fact.category] += fact.duration
         padding = max(len(str(x)) for x in categories if str(x)) + 1
         for category in sorted(categories, key=lambda k: categories[k]):
             total_seconds = categories[category].total_seconds()
@@ -210,12 +208,15 @@ class DayView(object):
 
         today = datetime.datetime.today()
         facts = list(reversed(list(self.storage.find(since=today))))
+        since, until = today, None
 
         if not facts:
             facts = [self.storage.get_latest_fact()]
+            # nothing today; the stats are for the day of the latest fact
+            since = until = facts[0].since.date()
 
         self.refresh_factlist(facts)
-        self.refresh_stats(facts)
+        self.refresh_stats(since, until)
         self.refresh_current_activity(facts)
 
     def render(self):
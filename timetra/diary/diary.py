@@ -37,6 +37,7 @@ import argh
 import blessings
 from confu import Configurable
 
+from .querying import QuerySyntaxError
 from .storage import Storage
 from . import utils
 
@@ -65,7 +66,7 @@ class Diary(Configurable):
         """
         return [
             self.find, self.add, self.edit, self.today, self.yesterday,
-            self.insert, self.list_activities,
+            self.insert, self.list_activities, self.compact, self.search,
         ]
 
     def _collect_activities(self):
@@ -74,17 +75,20 @@ class Diary(Configurable):
         of current storage as keys, and the number of relevant facts as
         values.
         """
-        # TODO: cache results and only scan the whole storage if forced
         xs = {}
-        for x in self.storage.find():
-            if 'activity' not in x:
-                continue
+        for x in self.storage.get_known_activities():
             activity = x['activity']
-            xs[activity] = xs.get(activity, 0) + 1
+            xs[activity] = xs.get(activity, 0) + x.get('count', 1)
         return xs
 
+    @argh.wrap_errors([QuerySyntaxError])
+    @argh.arg('-q', '--query', help='e.g. "tag:work NOT note:email '
+                                    'duration>1h time:9-13"')
+    @argh.arg('--order', choices=['asc', 'desc'])
+    @argh.arg('--limit', type=int)
     def find(self, when=None, days=0, since=None, until=None, activity=None,
-             note=None, tag=None, fmt=FACT_FORMAT, count=False):
+             note=None, tag=None, fmt=FACT_FORMAT, count=False, order='asc',
+             limit=None, query=None):
 
         if since:
             since = utils.parse_date(since)
@@ -102,7 +106,8 @@ class Diary(Configurable):
             until = utils.parse_date(when)
 
         facts = self.storage.find(since=since, until=until, activity=activity,
-                                  description=note, tag=tag)
+                                  description=note, tag=tag, order=order,
+                                  limit=limit, query=query)
         total_hours = 0
         for fact in facts:
             fact['activity'] = t.yellow(fact['activity'])
@@ -270,3 +275,20 @@ class Diary(Configurable):
                            key=lambda kv: kv[1],
                            reverse=True):
             yield '{:>5}× {}'.format(v, k)
+
+    def compact(self):
+        """
+        Merges journalled facts into day files.
+        """
+        cnt = self.storage.compact()
+        return 'Compacted {} day files'.format(cnt)
+
+    def search(self, limit=20, *query):
+        """
+        Finds facts that mention given words in their activity or description.
+        The most relevant facts come first.
+        """
+        results = self.storage.search(' '.join(query), limit=limit)
+        for score, fact, snippet in results:
+            yield '{:%Y-%m-%d %H:%M} {} {}'.format(
+                fact['since'], t.yellow(fact['activity']), t.blue(snippet))
@@ -0,0 +1,241 @@
+# coding: utf-8
+#
+#    Timetra is a time tracking application and library.
+#    Copyright © 2010-2014  Andrey Mikhaylenko
+#
+#    This file is part of Timetra.
+#
+#    Timetra is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Timetra is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with Timetra.  If not, see <http://gnu.org/licenses/>.
+#
+"""
+Indexing
+========
+
+An optional SQLite index of facts kept next to the YAML file cache.
+
+The index does not replace the day files.  It only tells which of them *may*
+contain facts matching given filters within given range of dates, so that
+the rest is neither listed nor loaded at all.  The exact matching is still
+done on the facts themselves.
+"""
+import datetime
+import logging
+import os
+import pickle
+
+from .caching import (FileStamp, connect_sqlite, get_file_stamp,
+                      remove_sqlite_files)
+
+
+__all__ = ['FactIndex']
+
+
+log = logging.getLogger(__name__)
+
+
+# fact keys (as used in filters) that can be looked up in the index
+INDEXED_KEYS = ('activity', 'category', 'tags')
+
+TAG_SEPARATOR = '\n'
+
+
+def _to_text(value):
+    # same semantics as in querying.Contains
+    return str(value or '').lower()
+
+
+def _to_date(value):
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    return value
+
+
+def _format_date_time(value):
+    if value is None:
+        return None
+    return value.isoformat(' ')
+
+
+class FactIndex:
+    """
+    :param root_dir:
+        the directory to keep the index in.
+    :param get_stamp:
+        a function that takes a path and returns a
+        :class:`~timetra.diary.caching.FileStamp`.
+    """
+    FILE_NAME = 'facts_index.db'
+    SCHEMA_VERSION = 3
+
+    def __init__(self, root_dir, get_stamp=get_file_stamp):
+        path = os.path.join(root_dir, self.FILE_NAME)
+
+        if not os.path.exists(path):
+            log.info('Creating facts index...')
+
+        self.path = path
+        self.get_stamp = get_stamp
+        self.db = connect_sqlite(path)
+        self._create_tables()
+
+    def _create_tables(self):
+        with self.db:
+            version, = self.db.execute('PRAGMA user_version').fetchone()
+            if version != self.SCHEMA_VERSION:
+                # rebuilt from the day files on next sync
+                for table in ('files', 'facts', 'state'):
+                    self.db.execute('DROP TABLE IF EXISTS ' + table)
+                self.db.execute('PRAGMA user_version = {:d}'.format(
+                    self.SCHEMA_VERSION))
+            self.db.execute('CREATE TABLE IF NOT EXISTS files ('
+                            '  path TEXT PRIMARY KEY,'
+                            '  mtime_ns INTEGER NOT NULL,'
+                            '  size INTEGER NOT NULL,'
+                            '  ino INTEGER NOT NULL,'
+                            '  digest BLOB)')
+            # textual columns are stored lowercased; they are only used
+            # for matching, the facts themselves are read from day files
+            self.db.execute('CREATE TABLE IF NOT EXISTS facts ('
+                            '  path TEXT NOT NULL,'
+                            '  since TEXT NOT NULL,'
+                            '  until TEXT,'
+                            '  activity TEXT NOT NULL,'
+                            '  category TEXT NOT NULL,'
+                            '  tags TEXT NOT NULL)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS facts_path '
+                            'ON facts (path)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS facts_since '
+                            'ON facts (since)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS state ('
+                            '  key TEXT PRIMARY KEY,'
+                            '  value BLOB NOT NULL)')
+
+    def _get_state(self, key, default=None):
+        row = self.db.execute('SELECT value FROM state WHERE key = ?',
+                              (key,)).fetchone()
+        return default if row is None else pickle.loads(row[0])
+
+    def _set_state(self, key, value):
+        self.db.execute('INSERT OR REPLACE INTO state VALUES (?, ?)',
+                        (key, pickle.dumps(value, protocol=-1)))
+
+    def _index_file(self, path, stamp, facts):
+        self.db.execute('DELETE FROM facts WHERE path = ?', (path,))
+        rows = []
+        for fact in facts:
+            tags = [_to_text(x) for x in fact.get('tags') or []]
+            rows.append((
+                path,
+                _format_date_time(fact['since']),
+                _format_date_time(fact.get('until')),
+                _to_text(fact.get('activity')),
+                _to_text(fact.get('category')),
+                TAG_SEPARATOR.join(tags),
+            ))
+        self.db.executemany('INSERT INTO facts VALUES (?, ?, ?, ?, ?, ?)',
+                            rows)
+        self.db.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)',
+                        (path,) + tuple(stamp))
+
+    def _forget_file(self, path):
+        self.db.execute('DELETE FROM facts WHERE path = ?', (path,))
+        self.db.execute('DELETE FROM files WHERE path = ?', (path,))
+
+    def sync(self, day_paths, load, tree_stamp=None):
+        """
+        Makes sure that given day files are indexed and up to date.  Files
+        that are not among given paths are dropped from the index.
+
+        :param day_paths:
+            an iterable of *all* day file paths.
+        :param load:
+            a function that takes a path and returns the list of facts.
+        :param tree_stamp:
+            a cheap stamp of the whole tree of day files.  If it is the same
+            as on the last sync, the paths are not even listed.
+
+        Files with unchanged stamp are not loaded.
+        """
+        if tree_stamp is not None and \
+                tree_stamp == self._get_state('tree_stamp'):
+            return
+        known = dict((row[0], FileStamp(*row[1:])) for row in self.db.execute(
+            'SELECT path, mtime_ns, size, ino, digest FROM files'))
+        with self.db:
+            for path in day_paths:
+                try:
+                    stamp = self.get_stamp(path)
+                except FileNotFoundError:
+                    continue
+                if known.pop(path, None) != stamp:
+                    log.debug('Indexing %s', path)
+                    self._index_file(path, stamp, load(path))
+            for path in known:
+                self._forget_file(path)
+            self._set_state('tree_stamp', tree_stamp)
+
+    def find_paths(self, filters, since=None, until=None, reverse=False):
+        """
+        Returns a list of indexed file paths that contain at least one fact
+        that *may* match given filters (same semantics as in
+        :class:`~timetra.diary.querying.Contains`) and starts within given
+        dates (or datetimes, of which only the date is used), ordered by
+        date.  Filters on keys that are not indexed are ignored here.
+        """
+        clauses = []
+        params = []
+        for key, pattern in (filters or {}).items():
+            if key not in INDEXED_KEYS:
+                continue
+            clauses.append('instr({}, ?)'.format(key))
+            params.append(pattern.lower())
+        # the dates are narrowed down by the index on `since`
+        if since is not None:
+            clauses.append('since >= ?')
+            params.append(_to_date(since).isoformat())
+        if until is not None:
+            clauses.append('since < ?')
+            params.append((_to_date(until) +
+                           datetime.timedelta(days=1)).isoformat())
+
+        query = 'SELECT DISTINCT path FROM facts'
+        if clauses:
+            query += ' WHERE ' + ' AND '.join(clauses)
+        # day file paths sort by date (YYYY/MM/DD.yaml)
+        query += ' ORDER BY path' + (' DESC' if reverse else '')
+        return [path for path, in self.db.execute(query, params)]
+
+    def collect_garbage(self):
+        """
+        Drops the files that do not exist anymore from the index.  Returns
+        their number.
+        """
+        paths = [x for x, in self.db.execute('SELECT path FROM files')
+                 if not os.path.exists(x)]
+        with self.db:
+            for path in paths:
+                self._forget_file(path)
+        return len(paths)
+
+    def vacuum(self):
+        self.db.execute('VACUUM')
+        # the pages are copied through the WAL; give that space back too
+        self.db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+    def reset(self):
+        try:
+            self.db.close()
+        except:
+            pass
+        remove_sqlite_files(self.path)
@@ -0,0 +1,157 @@
+# coding: utf-8
+#
+#    Timetra is a time tracking application and library.
+#    Copyright © 2010-2014  Andrey Mikhaylenko
+#
+#    This file is part of Timetra.
+#
+#    Timetra is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Timetra is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with Timetra.  If not, see <http://gnu.org/licenses/>.
+#
+"""
+Interval index
+==============
+
+An index of `(since, until)` intervals of all facts for exact overlap
+queries regardless of the facts' length.
+
+The intervals of each day file are kept in the cache together with the
+earliest start and the latest end in the file.  In memory the files are
+ordered by their earliest start together with a segment tree of their latest
+ends.  A query finds the files starting before the end of given period by
+bisection, descends only into the branches of the tree that contain a file
+ending after the start of the period and then checks the intervals of these
+files only.
+
+The tree is never stored; it is rebuilt from the per-file summaries (one
+entry per file, not per fact) after the files have changed.
+"""
+from array import array
+from bisect import bisect_left
+import datetime
+
+from .caching import CachedSummaries
+
+
+__all__ = ['IntervalIndex']
+
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+# an ongoing fact (without `until`) overlaps anything after its start
+OPEN_END = float('inf')
+
+
+def to_timestamp(value):
+    # naive local time; only used for ordering so no time zone is involved
+    return (value - EPOCH).total_seconds()
+
+
+class IntervalIndex(CachedSummaries):
+    """
+    :param cache:
+        a :class:`~timetra.diary.caching.Cache` instance.
+    :param key:
+        the key under which the index is stored in the cache.
+    """
+    VERSION = 2
+
+    def summarize(self, path, facts):
+        """
+        Returns a `(first_start, last_end, intervals)` tuple where
+        `intervals` is a list of `(start, end)` timestamps in file order.
+        The bounds are `None` if there are no facts.
+        """
+        intervals = []
+        for fact in facts:
+            until = fact.get('until')
+            end = to_timestamp(until) if until else OPEN_END
+            intervals.append((to_timestamp(fact['since']), end))
+        if not intervals:
+            return None, None, intervals
+        return (min(x[0] for x in intervals), max(x[1] for x in intervals),
+                intervals)
+
+    def _load_state(self, state):
+        self._tree = None
+
+    def _on_changed(self):
+        self._tree = None
+
+    def _build(self):
+        items = []
+        for path, (stamp, (first_start, last_end, intervals)) in \
+                self._files.items():
+            if intervals:
+                items.append((first_start, last_end, path))
+        items.sort()
+
+        self._starts = array('d', (x[0] for x in items))
+        self._paths = [x[2] for x in items]
+
+        # the leaves hold the latest end of each file; each inner node holds
+        # the maximum of its children
+        size = 1
+        while size < len(items):
+            size *= 2
+        tree = array('d', [float('-inf')]) * (2 * size)
+        for i, item in enumerate(items):
+            tree[size + i] = item[1]
+        for i in reversed(range(1, size)):
+            tree[i] = max(tree[2 * i], tree[2 * i + 1])
+        self._tree = tree
+
+    def _find_paths(self, start, end):
+        # the files that have a fact starting before `end` and a fact
+        # ending after `start`
+        limit = bisect_left(self._starts, end)
+        if not limit:
+            return []
+
+        tree = self._tree
+        size = len(tree) // 2
+        found = []
+        # nodes are `(index, first_leaf, last_leaf + 1)`
+        stack = [(1, 0, size)]
+        while stack:
+            node, lo, hi = stack.pop()
+            if limit <= lo or tree[node] <= start:
+                continue
+            if hi - lo == 1:
+                found.append(self._paths[lo])
+                continue
+            mid = (lo + hi) // 2
+            stack.append((2 * node + 1, mid, hi))
+            stack.append((2 * node, lo, mid))
+        return found
+
+    def find(self, since, until):
+        """
+        Returns a list of `(path, position)` pairs for the facts that overlap
+        given period, ordered by the start of the fact.  A fact overlaps the
+        period if it starts before the period ends and ends after it starts.
+        If `until` is `None`, the period has no end.
+        """
+        if self._tree is None:
+            self._build()
+        start = to_timestamp(since)
+        end = OPEN_END if until is None else to_timestamp(until)
+
+        found = []
+        for path in self._find_paths(start, end):
+            intervals = self._files[path][1][2]
+            for position, (fact_start, fact_end) in enumerate(intervals):
+                if fact_start < end and start < fact_end:
+                    found.append((fact_start, path, position))
+        found.sort()
+        return [x[1:] for x in found]
@@ -0,0 +1,63 @@
+# coding: utf-8
+#
+#    Timetra is a time tracking application and library.
+#    Copyright © 2010-2014  Andrey Mikhaylenko
+#
+#    This file is part of Timetra.
+#
+#    Timetra is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Timetra is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with Timetra.  If not, see <http://gnu.org/licenses/>.
+#
+"""
+Maintenance
+===========
+
+Commands for managing the cache.
+"""
+import time
+
+import argh
+from confu import Configurable
+
+from .storage import Storage
+
+
+class CacheMaintenance(Configurable):
+    needs = {
+        'storage': Storage,
+    }
+
+    @property
+    def commands(self):
+        return [self.warm, self.vacuum]
+
+    @argh.arg('--workers', type=int, help='number of worker processes')
+    def warm(self, workers=None):
+        """
+        Loads all changed or not yet cached day files into the cache using
+        a pool of worker processes (one per CPU by default).
+        """
+        started = time.time()
+        cnt = self['storage'].warm_cache(workers=workers)
+        return 'Cached {} files in {:.1f}s'.format(cnt, time.time() - started)
+
+    def vacuum(self):
+        """
+        Removes cache and index entries for deleted day files and cache
+        entries beyond the size limit, then shrinks the cache files on disk.
+        Not to be confused with `compact`, which merges journals into day
+        files.
+        """
+        cnt, reclaimed = self['storage'].compact_cache()
+        return 'Removed {} entries, reclaimed {:.1f} KiB'.format(
+            cnt, reclaimed / 1024)
@@ -0,0 +1,226 @@
+# coding: utf-8
+#
+#    Timetra is a time tracking application and library.
+#    Copyright © 2010-2014  Andrey Mikhaylenko
+#
+#    This file is part of Timetra.
+#
+#    Timetra is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Timetra is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with Timetra.  If not, see <http://gnu.org/licenses/>.
+#
+"""
+Month manifests
+===============
+
+A manifest per month directory, kept in the cache as a row of its own, with
+a summary of each day file: the number of facts, the earliest start, the
+latest end and the sets of activities, categories and tags (lowercased).
+The union of these sets for the whole month is a zone map that tells whether
+the month may contain a matching fact at all.
+
+Descriptions are free text, so instead of a set each day has a Bloom filter
+of the trigrams of its (lowercased) descriptions.  A pattern can only occur
+in a day whose filter has all the trigrams of the pattern.
+
+Files and months that cannot match the filters are skipped without loading
+the facts.  Only the keys listed in :data:`SKIP_KEYS` are checked, with the
+same case-insensitive substring semantics as the filters themselves.
+"""
+import os
+import zlib
+
+from .caching import CachedSummaries
+
+
+__all__ = ['MonthManifest', 'ZONE_KEYS', 'SKIP_KEYS', 'filter_day_paths']
+
+
+# filter keys that can be checked against a zone map
+ZONE_KEYS = ('activity', 'category', 'tags')
+
+# filter keys that can rule out a file
+SKIP_KEYS = ZONE_KEYS + ('description',)
+
+# the size of a day's Bloom filter in bits; about 5% false positives with
+# 500 distinct trigrams
+BLOOM_BITS = 4096
+
+
+def _to_text(value):
+    # same semantics as in querying.Contains
+    return str(value or '').lower()
+
+
+def _iter_trigrams(text):
+    for i in range(len(text) - 2):
+        yield text[i:i+3]
+
+
+def _get_bloom_mask(trigram):
+    # two bits per trigram; `hash()` is not stable across processes
+    h = zlib.crc32(trigram.encode('utf-8'))
+    return (1 << (h % BLOOM_BITS)) | (1 << (h // BLOOM_BITS % BLOOM_BITS))
+
+
+def make_bloom(texts):
+    "Returns a Bloom filter (an `int`) of trigrams of given texts."
+    bloom = 0
+    for text in texts:
+        for trigram in _iter_trigrams(text):
+            bloom |= _get_bloom_mask(trigram)
+    return bloom
+
+
+def _may_contain(bloom, pattern):
+    for trigram in _iter_trigrams(pattern):
+        mask = _get_bloom_mask(trigram)
+        if bloom & mask != mask:
+            return False
+    # patterns shorter than a trigram cannot be ruled out
+    return True
+
+
+def _may_match(zone, filters):
+    for key, pattern in filters.items():
+        pattern = pattern.lower()
+        if key in ZONE_KEYS:
+            if not any(pattern in value for value in zone[key]):
+                return False
+        elif key == 'description' and 'description' in zone:
+            if not _may_contain(zone['description'], pattern):
+                return False
+    return True
+
+
+class MonthManifest(CachedSummaries):
+    """
+    :param cache:
+        a :class:`~timetra.diary.caching.Cache` instance.
+    :param key:
+        the key under which the manifests of all months are stored in the
+        cache.
+    :param month_dir:
+        the month directory; its manifest is a row of its own under `key`.
+    """
+    VERSION = 3
+
+    def __init__(self, cache, key, month_dir):
+        self.month_dir = month_dir
+        super().__init__(cache, key)
+
+    def _load(self):
+        record = self.cache.get_summary(self.key, self.month_dir)
+        if not record or record.get('version') != self.VERSION:
+            return {}, None
+        return record['files'], record['zone']
+
+    def _save(self, added, removed):
+        # the days of a month are few; the month is written as a whole
+        self.cache.put_summary(self.key, self.month_dir, {
+            'version': self.VERSION,
+            'files': self._files,
+            'zone': self._zone,
+        })
+
+    def summarize(self, path, facts):
+        summary = {
+            'count': 0,
+            'since': None,
+            'until': None,
+            'activity': set(),
+            'category': set(),
+            'tags': set(),
+        }
+        descriptions = []
+        for fact in facts:
+            summary['count'] += 1
+            if summary['since'] is None or fact.since < summary['since']:
+                summary['since'] = fact.since
+            if fact.until and (summary['until'] is None or
+                               summary['until'] < fact.until):
+                summary['until'] = fact.until
+            summary['activity'].add(_to_text(fact.activity))
+            summary['category'].add(_to_text(fact.category))
+            summary['tags'].update(_to_text(x) for x in fact.tags)
+            descriptions.append(_to_text(fact.description))
+        summary['description'] = make_bloom(descriptions)
+        return summary
+
+    def _load_state(self, state):
+        self._zone = state or self._build_zone()
+
+    def _dump_state(self):
+        return self._zone
+
+    def _on_changed(self):
+        self._zone = self._build_zone()
+
+    def _build_zone(self):
+        zone = dict((key, set()) for key in ZONE_KEYS)
+        for stamp, summary in self._files.values():
+            for key in ZONE_KEYS:
+                zone[key].update(summary[key])
+        return zone
+
+    def filter_paths(self, paths, filters):
+        """
+        Returns those of given (synced) paths that may contain facts matching
+        given filters.
+        """
+        if not _may_match(self._zone, filters):
+            return []
+        return [x for x in paths if _may_match(self._files[x][1], filters)]
+
+
+def filter_day_paths(cache, key, day_paths, filters, load, complete=False):
+    """
+    Yields those of given day paths that may contain facts matching given
+    filters.  The manifests of the months are updated on the way.
+
+    :param key:
+        the key under which the manifests are stored in the cache (one per
+        data directory).
+    :param day_paths:
+        an ordered iterable of day file paths (``YYYY/MM/DD.yaml``).
+    :param load:
+        a function that takes a path and returns the list of facts (with
+        attribute access).
+    :param complete:
+        `True` if all existing day files are listed.  Otherwise the
+        manifests keep the files that are not listed.  If all paths are
+        consumed, the manifests of months that are gone are dropped.
+    """
+    seen = set()
+
+    def flush(month_dir, paths):
+        seen.add(month_dir)
+        manifest = MonthManifest(cache, key, month_dir)
+        manifest.sync(paths, load=load, prune=complete)
+        return manifest.filter_paths(paths, filters)
+
+    month_dir, paths = None, []
+    for path in day_paths:
+        this_month_dir = os.path.abspath(os.path.dirname(path))
+        if this_month_dir != month_dir:
+            if paths:
+                for x in flush(month_dir, paths):
+                    yield x
+            month_dir, paths = this_month_dir, []
+        paths.append(path)
+    if paths:
+        for x in flush(month_dir, paths):
+            yield x
+
+    if complete:
+        for month_dir in set(cache.get_summary_paths(key)) - seen:
+            cache.remove_summary(key, month_dir)
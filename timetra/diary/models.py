@@ -31,6 +31,17 @@ class Model(modeling.TypedDictReprMixin,
         self._insert_defaults()
         self._make_dot_expanded()
 
+    @classmethod
+    def from_trusted(cls, data):
+        """
+        Returns an instance built from `data` as is, without inserting the
+        defaults.  For data that is known to be complete and valid, e.g.
+        loaded from the cache.  Nested dictionaries are not dot-expanded.
+        """
+        obj = dict.__new__(cls)
+        dict.update(obj, data)
+        return obj
+
 
 class Fact(Model):
     structure = fact_schema
@@ -38,3 +49,64 @@ class Fact(Model):
     @property
     def duration(self):
         return (self.until or datetime.datetime.now()) - self.since
+
+
+class FactView:
+    """
+    A read-only fact for query results.  Supports attribute and item access
+    to the main fields and :attr:`duration`, but none of the dictionary and
+    validation machinery of :class:`Fact`.
+    """
+    __slots__ = ('since', 'until', 'activity', 'category', 'tags',
+                 'description')
+
+    def __init__(self, since, until=None, activity=None, category=None,
+                 tags=(), description=None):
+        set_field = object.__setattr__
+        set_field(self, 'since', since)
+        set_field(self, 'until', until)
+        set_field(self, 'activity', activity)
+        set_field(self, 'category', category)
+        set_field(self, 'tags', tuple(tags or ()))
+        set_field(self, 'description', description)
+
+    @classmethod
+    def from_fact(cls, fact):
+        return cls(fact['since'], fact.get('until'), fact.get('activity'),
+                   fact.get('category'), fact.get('tags'),
+                   fact.get('description'))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('{} is read-only'.format(type(self).__name__))
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __contains__(self, key):
+        return key in self.__slots__
+
+    def get(self, key, default=None):
+        if key not in self.__slots__:
+            return default
+        return getattr(self, key)
+
+    def keys(self):
+        return list(self.__slots__)
+
+    def __eq__(self, other):
+        if not isinstance(other, FactView):
+            return NotImplemented
+        return all(self[x] == other[x] for x in self.__slots__)
+
+    def __hash__(self):
+        return hash((self.since, self.activity))
+
+    def __repr__(self):
+        return '<{} {} {}>'.format(type(self).__name__, self.since,
+                                   self.activity)
+
+    @property
+    def duration(self):
+        return (self.until or datetime.datetime.now()) - self.since
@@ -0,0 +1,437 @@
+# coding: utf-8
+#
+#    Timetra is a time tracking application and library.
+#    Copyright © 2010-2014  Andrey Mikhaylenko
+#
+#    This file is part of Timetra.
+#
+#    Timetra is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Timetra is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with Timetra.  If not, see <http://gnu.org/licenses/>.
+#
+"""
+Querying
+========
+
+A small query language for facts.  A query is parsed once into a tree of
+nodes; the tree is then compiled into a single predicate (a chain of
+closures) that is called for each fact, and the parts of the query that the
+facts index and the month manifests understand are handed over to them as
+plain filters so that day files which cannot match are not read at all.
+
+Syntax::
+
+    walk                      any of activity, category, description or
+                              tags contains "walk"
+    activity:walk             the activity contains "walk"
+    category:foss tag:urgent  both (AND is implied; may be spelled out)
+    tag:work, tag:home        either (`,` is the same as OR)
+    NOT tag:work              negation (also `-tag:work`, `-(a OR b)`)
+    (a OR b) c                grouping
+    note:"went to"            quoted values may contain spaces
+    duration>1h               also >=, <, <=, = with 1h, 30m, 1h30m, 1:30
+    time:9-12:30              started between 9:00 and 12:30 (may wrap
+                              around midnight, e.g. time:22-6)
+    time>=18                  started at or after 18:00
+
+Text matching is case-insensitive and by substring, the same as with the
+`filters` accepted by :meth:`YamlBackend.collect_facts`.  Ongoing facts have
+no duration and never match a `duration` condition.
+"""
+import operator
+import re
+
+from . import utils
+
+
+__all__ = ['Query', 'QuerySyntaxError', 'compile_query', 'parse_query']
+
+
+# fact keys that can be matched by substring; these are also the keys that
+# the index and the manifests can use to skip day files
+TEXT_KEYS = ('activity', 'category', 'description', 'tags')
+
+FIELD_ALIASES = {
+    'activity': 'activity',
+    'category': 'category',
+    'description': 'description',
+    'note': 'description',
+    'tag': 'tags',
+    'tags': 'tags',
+}
+
+OPERATORS = {
+    '=': operator.eq,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+TOKEN_RE = re.compile(r'\s*(?:(?P<punct>[(),])|'
+                      r'(?P<word>(?:[^\s(),"]|"[^"]*")+))')
+TERM_RE = re.compile(r'^(?P<field>[a-z]+)(?P<op>:|>=|<=|>|<|=)(?P<value>.*)$')
+DURATION_RE = re.compile(r'^(?:(?P<hours>\d+)h)?(?:(?P<minutes>\d+)m)?$')
+TIME_RE = re.compile(r'^(?P<hours>\d{1,2})(?::(?P<minutes>\d{2}))?$')
+
+
+class QuerySyntaxError(ValueError):
+    pass
+
+
+#--- Nodes
+
+
+class Contains:
+    "The value of given key contains given text (case-insensitive)."
+    def __init__(self, key, pattern):
+        self.key = key
+        self.pattern = pattern.lower()
+
+    @property
+    def keys(self):
+        return {self.key}
+
+    def compile(self):
+        key, pattern = self.key, self.pattern
+
+        def match(fact):
+            value = fact.get(key)
+            # support multiple values per key
+            if isinstance(value, (list, tuple)):
+                return any(pattern in str(v or '').lower() for v in value)
+            return pattern in str(value or '').lower()
+        return match
+
+
+class Compare:
+    """
+    The number returned by given function for the fact compares to given
+    value.  The function may return `None` which never matches.
+    """
+    def __init__(self, get_value, keys, op, value):
+        self.get_value = get_value
+        self._keys = set(keys)
+        self.op = op
+        self.value = value
+
+    @property
+    def keys(self):
+        return self._keys
+
+    def compile(self):
+        get_value, compare, expected = self.get_value, self.op, self.value
+
+        def match(fact):
+            value = get_value(fact)
+            return value is not None and compare(value, expected)
+        return match
+
+
+class TimeRange:
+    """
+    The fact starts at or after `start` and before `end` (seconds since
+    midnight).  If `end` is not after `start`, the range wraps around
+    midnight.
+    """
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+
+    @property
+    def keys(self):
+        return {'since'}
+
+    def compile(self):
+        start, end = self.start, self.end
+        if start < end:
+            return lambda fact: start <= _get_time_of_day(fact) < end
+        return lambda fact: not end <= _get_time_of_day(fact) < start
+
+
+class Not:
+    def __init__(self, node):
+        self.node = node
+
+    @property
+    def keys(self):
+        return self.node.keys
+
+    def compile(self):
+        match = self.node.compile()
+        return lambda fact: not match(fact)
+
+
+class And:
+    def __init__(self, nodes):
+        self.nodes = nodes
+
+    @property
+    def keys(self):
+        return set().union(*(x.keys for x in self.nodes))
+
+    def compile(self):
+        matchers = tuple(x.compile() for x in self.nodes)
+        if len(matchers) == 1:
+            return matchers[0]
+
+        def match(fact):
+            for matcher in matchers:
+                if not matcher(fact):
+                    return False
+            return True
+        return match
+
+
+class Or:
+    def __init__(self, nodes):
+        self.nodes = nodes
+
+    @property
+    def keys(self):
+        return set().union(*(x.keys for x in self.nodes))
+
+    def compile(self):
+        matchers = tuple(x.compile() for x in self.nodes)
+        if len(matchers) == 1:
+            return matchers[0]
+
+        def match(fact):
+            for matcher in matchers:
+                if matcher(fact):
+                    return True
+            return False
+        return match
+
+
+def _get_duration(fact):
+    until = fact.get('until')
+    if until is None:
+        return None
+    return (until - fact['since']).total_seconds()
+
+
+def _get_time_of_day(fact):
+    since = fact['since']
+    return since.hour * 3600 + since.minute * 60 + since.second
+
+
+#--- Parsing
+
+
+def _tokenize(text):
+    tokens = []
+    position = 0
+    text = text.strip()
+    while position < len(text):
+        match = TOKEN_RE.match(text, position)
+        if not match:
+            raise QuerySyntaxError('Unbalanced quotes in query "{}"'
+                                   .format(text))
+        tokens.append(match.group('punct') or match.group('word'))
+        position = match.end()
+    return tokens
+
+
+def _unquote(value):
+    return value.replace('"', '')
+
+
+def _parse_duration(value):
+    match = DURATION_RE.match(value)
+    if match and value:
+        return (int(match.group('hours') or 0) * 3600 +
+                int(match.group('minutes') or 0) * 60)
+    try:
+        # same as elsewhere: "1:30" or "90" (minutes)
+        return utils.parse_delta(value).total_seconds()
+    except (AttributeError, ValueError):
+        raise QuerySyntaxError('Bad duration "{}"; expected e.g. 1h30m, 45m '
+                               'or 1:30'.format(value))
+
+
+def _parse_time_of_day(value):
+    match = TIME_RE.match(value)
+    if match:
+        hours = int(match.group('hours'))
+        minutes = int(match.group('minutes') or 0)
+        if hours <= 24 and minutes < 60:
+            return hours * 3600 + minutes * 60
+    raise QuerySyntaxError('Bad time of day "{}"; expected e.g. 9 or 09:30'
+                           .format(value))
+
+
+def _parse_term(token):
+    match = TERM_RE.match(token)
+    if not match:
+        return Or([Contains(x, _unquote(token)) for x in TEXT_KEYS])
+
+    field, op, value = match.group('field', 'op', 'value')
+    value = _unquote(value)
+    if not value:
+        raise QuerySyntaxError('Missing value in "{}"'.format(token))
+
+    if field in FIELD_ALIASES:
+        if op != ':':
+            raise QuerySyntaxError('Text fields only support ":" in "{}"'
+                                   .format(token))
+        return Contains(FIELD_ALIASES[field], value)
+
+    if field == 'duration':
+        if op == ':':
+            raise QuerySyntaxError('Expected a comparison in "{}", e.g. '
+                                   'duration>1h'.format(token))
+        return Compare(_get_duration, ('since', 'until'), OPERATORS[op],
+                       _parse_duration(value))
+
+    if field == 'time':
+        if op != ':':
+            return Compare(_get_time_of_day, ('since',), OPERATORS[op],
+                           _parse_time_of_day(value))
+        start, sep, end = value.partition('-')
+        if not sep:
+            raise QuerySyntaxError('Expected a range in "{}", e.g. '
+                                   'time:9-12'.format(token))
+        start = _parse_time_of_day(start)
+        end = _parse_time_of_day(end)
+        return TimeRange(start % SECONDS_PER_DAY, end % SECONDS_PER_DAY)
+
+    raise QuerySyntaxError('Unknown field "{}"; expected one of {}'.format(
+        field, ', '.join(sorted(set(FIELD_ALIASES) | {'duration', 'time'}))))
+
+
+class _Parser:
+    """
+    A recursive descent parser for::
+
+        query   := and_expr (("OR" | ",") and_expr)*
+        and_expr := not_expr ("AND"? not_expr)*
+        not_expr := ("NOT" | "-") not_expr | "(" query ")" | term
+    """
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.position = 0
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+
+    def next(self):
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def parse(self):
+        node = self.parse_or()
+        if self.peek() is not None:
+            raise QuerySyntaxError('Unexpected "{}"'.format(self.peek()))
+        return node
+
+    def parse_or(self):
+        nodes = [self.parse_and()]
+        while self.peek() in ('OR', ','):
+            self.next()
+            nodes.append(self.parse_and())
+        return nodes[0] if len(nodes) == 1 else Or(nodes)
+
+    def parse_and(self):
+        nodes = [self.parse_not()]
+        while self.peek() not in (None, 'OR', ',', ')'):
+            if self.peek() == 'AND':
+                self.next()
+            nodes.append(self.parse_not())
+        return nodes[0] if len(nodes) == 1 else And(nodes)
+
+    def parse_not(self):
+        token = self.next()
+        if token is None or token in ('OR', 'AND', ',', ')'):
+            raise QuerySyntaxError('Expected a term instead of {}'.format(
+                '"{}"'.format(token) if token else 'end of query'))
+        if token in ('NOT', '-'):
+            # a standalone dash, e.g. "- walk" or "-(a OR b)"
+            return Not(self.parse_not())
+        if token == '(':
+            node = self.parse_or()
+            if self.next() != ')':
+                raise QuerySyntaxError('Missing closing parenthesis')
+            return node
+        if token.startswith('-') and len(token) > 1:
+            return Not(_parse_term(token[1:]))
+        return _parse_term(token)
+
+
+def parse_query(text):
+    """
+    Returns the tree of nodes for given query string.  Raises
+    :class:`QuerySyntaxError` if the query is malformed.
+    """
+    tokens = _tokenize(text)
+    if not tokens:
+        raise QuerySyntaxError('Empty query')
+    return _Parser(tokens).parse()
+
+
+#--- Compiled queries
+
+
+class Query:
+    """
+    A compiled query.
+
+    .. attribute:: match
+
+        a function that takes a fact (anything with `get()` and item access)
+        and returns `True` if the fact matches the query.
+
+    .. attribute:: keys
+
+        the set of fact keys the query looks at.
+
+    .. attribute:: filters
+
+        a `{key: pattern}` dict of substring conditions that every matching
+        fact satisfies, in the format understood by the index and the
+        manifests.  Facts satisfying all of them may still not match.
+    """
+    def __init__(self, node):
+        self.node = node
+        self.keys = node.keys
+        self.match = node.compile()
+        self.filters = _get_required_filters(node)
+
+
+def _get_required_filters(node):
+    # only conditions that are required by the query as a whole may be
+    # used to skip files; negated ones (`Not`) never are
+    nodes = node.nodes if isinstance(node, And) else [node]
+    filters = {}
+    for x in nodes:
+        if isinstance(x, Contains) and x.key in TEXT_KEYS:
+            # the longer pattern is the more selective one
+            if len(x.pattern) > len(filters.get(x.key, '')):
+                filters[x.key] = x.pattern
+    return filters
+
+
+def compile_query(text=None, filters=None):
+    """
+    Returns a :class:`Query` that matches the facts that match both given
+    query string and all of given `{key: pattern}` filters.  Either may be
+    omitted; without both every fact matches.
+    """
+    nodes = [Contains(k, v) for k, v in (filters or {}).items()]
+    if text is not None:
+        node = parse_query(text)
+        nodes.extend(node.nodes if isinstance(node, And) else [node])
+    return Query(And(nodes))
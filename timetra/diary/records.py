@@ -0,0 +1,194 @@
+# coding: utf-8
+#
+#    Timetra is a time tracking application and library.
+#    Copyright © 2010-2014  Andrey Mikhaylenko
+#
+#    This file is part of Timetra.
+#
+#    Timetra is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Timetra is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with Timetra.  If not, see <http://gnu.org/licenses/>.
+#
+"""
+Day records
+===========
+
+A compact representation of the facts of a day file, as kept in the cache.
+
+Each fact is a tuple of plain values: epoch seconds for `since` and `until`,
+indices into the day's table of activity and category names, a tuple of
+tags and the description.  Such tuples pickle and unpickle much faster than
+model instances.  The objects are only built when accessed.
+"""
+from collections import namedtuple
+import datetime
+
+from .models import FactView
+
+
+__all__ = ['DayRecord', 'get_projection_type']
+
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+# the keys stored in the tuple; any other keys go to the `extra` dict
+SINCE, UNTIL, ACTIVITY, CATEGORY, TAGS, DESCRIPTION, EXTRA = range(7)
+KNOWN_KEYS = ('since', 'until', 'activity', 'category', 'tags', 'description')
+
+
+def encode_time(value):
+    # naive local time without microseconds, i.e. any sane timestamp in
+    # a day file; anything else is kept as is
+    if value is None or value.tzinfo or value.microsecond:
+        return value
+    return int((value - EPOCH).total_seconds())
+
+
+def decode_time(value):
+    if isinstance(value, int):
+        return EPOCH + datetime.timedelta(seconds=value)
+    return value
+
+
+_projection_types = {}
+
+
+def get_projection_type(fields):
+    """
+    Returns a named tuple class with given fields (a subset of
+    :data:`KNOWN_KEYS`).
+    """
+    fields = tuple(fields)
+    if fields not in _projection_types:
+        unknown = [x for x in fields if x not in KNOWN_KEYS]
+        if unknown:
+            raise ValueError('cannot project on {}'.format(
+                ', '.join(unknown)))
+        _projection_types[fields] = namedtuple('Projection', fields)
+    return _projection_types[fields]
+
+
+class DayRecord:
+    """
+    A read-only sequence of model instances stored as tuples.
+
+    :param model:
+        the model class to build the instances with.  The instances are
+        built with `model.from_trusted()` if available, as the stored data
+        has already been validated.
+    :param items:
+        an iterable of dictionaries (usually instances of the model).
+    """
+    __slots__ = ('model', 'names', 'rows')
+
+    def __init__(self, model, items=()):
+        self.model = model
+        self.names = []
+        self.rows = []
+        ids = {}
+
+        def intern(name):
+            if name not in ids:
+                ids[name] = len(self.names)
+                self.names.append(name)
+            return ids[name]
+
+        for item in items:
+            extra = dict((k, v) for k, v in item.items()
+                         if k not in KNOWN_KEYS)
+            tags = item.get('tags')
+            self.rows.append((
+                encode_time(item.get('since')),
+                encode_time(item.get('until')),
+                intern(item['activity']) if 'activity' in item else None,
+                intern(item['category']) if 'category' in item else None,
+                None if tags is None else tuple(tags),
+                item.get('description'),
+                extra or None,
+            ))
+
+    def decode(self, row):
+        "Returns a dictionary of raw values for given row."
+        data = {
+            'since': decode_time(row[SINCE]),
+            'until': decode_time(row[UNTIL]),
+            'description': row[DESCRIPTION],
+        }
+        if row[ACTIVITY] is not None:
+            data['activity'] = self.names[row[ACTIVITY]]
+        if row[CATEGORY] is not None:
+            data['category'] = self.names[row[CATEGORY]]
+        if row[TAGS] is not None:
+            data['tags'] = list(row[TAGS])
+        if row[EXTRA]:
+            data.update(row[EXTRA])
+        return data
+
+    def build(self, row):
+        "Returns a model instance for given row."
+        make = getattr(self.model, 'from_trusted', self.model)
+        return make(self.decode(row))
+
+    def view(self, row):
+        "Returns a :class:`~timetra.diary.models.FactView` for given row."
+        return FactView(
+            decode_time(row[SINCE]),
+            decode_time(row[UNTIL]),
+            None if row[ACTIVITY] is None else self.names[row[ACTIVITY]],
+            None if row[CATEGORY] is None else self.names[row[CATEGORY]],
+            row[TAGS],
+            row[DESCRIPTION],
+        )
+
+    def views(self):
+        "Returns a list of :class:`~timetra.diary.models.FactView` objects."
+        return [self.view(x) for x in self.rows]
+
+    def _get_column(self, field):
+        # returns a function that extracts given field from a row
+        names = self.names
+        if field in ('since', 'until'):
+            index = SINCE if field == 'since' else UNTIL
+            return lambda row: decode_time(row[index])
+        if field in ('activity', 'category'):
+            index = ACTIVITY if field == 'activity' else CATEGORY
+            return lambda row: (None if row[index] is None
+                                else names[row[index]])
+        if field == 'tags':
+            return lambda row: row[TAGS] or ()
+        return lambda row: row[DESCRIPTION]
+
+    def project(self, fields):
+        """
+        Returns a list of named tuples with given fields only (see
+        :func:`get_projection_type`).
+        """
+        make = get_projection_type(fields)
+        columns = [self._get_column(x) for x in fields]
+        return [make(*[column(row) for column in columns])
+                for row in self.rows]
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.build(x) for x in self.rows[index]]
+        return self.build(self.rows[index])
+
+    def __iter__(self):
+        for row in self.rows:
+            yield self.build(row)
+
+    def __repr__(self):
+        return '<{} of {} {}>'.format(type(self).__name__, len(self),
+                                      self.model.__name__)
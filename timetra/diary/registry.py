@@ -0,0 +1,94 @@
+# coding: utf-8
+#
+#    Timetra is a time tracking application and library.
+#    Copyright © 2010-2014  Andrey Mikhaylenko
+#
+#    This file is part of Timetra.
+#
+#    Timetra is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Timetra is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with Timetra.  If not, see <http://gnu.org/licenses/>.
+#
+"""
+Activity registry
+=================
+
+Known `(activity, category)` pairs with the number of facts and the time
+each pair was last seen.  The registry is kept in the cache and updated per
+day file, so only the files changed since the last call are read.
+"""
+from .caching import CachedSummaries
+
+
+__all__ = ['ActivityRegistry']
+
+
+class ActivityRegistry(CachedSummaries):
+    """
+    :param cache:
+        a :class:`~timetra.diary.caching.Cache` instance.
+    :param key:
+        the key under which the registry is stored in the cache.
+    """
+    def summarize(self, path, facts):
+        "Returns a `{(activity, category): [count, last_seen]}` dict."
+        summary = {}
+        for fact in facts:
+            pair = fact.get('activity'), fact.get('category')
+            if pair[0] is None:
+                continue
+            stats = summary.setdefault(pair, [0, None])
+            stats[0] += 1
+            if stats[1] is None or stats[1] < fact['since']:
+                stats[1] = fact['since']
+        return summary
+
+    def _load_state(self, state):
+        # (activity, category) → [count, last_seen]
+        self._totals = state or {}
+
+    def _dump_state(self):
+        return self._totals
+
+    def _on_added(self, path, summary):
+        for pair, (count, last_seen) in summary.items():
+            stats = self._totals.setdefault(pair, [0, None])
+            stats[0] += count
+            if stats[1] is None or stats[1] < last_seen:
+                stats[1] = last_seen
+
+    def _on_removed(self, path, summary):
+        for pair, (count, last_seen) in summary.items():
+            stats = self._totals[pair]
+            stats[0] -= count
+            if not stats[0]:
+                del self._totals[pair]
+            elif stats[1] == last_seen:
+                # this file may have held the latest occurence
+                stats[1] = max(x[1][pair][1] for x in self._files.values()
+                               if pair in x[1])
+
+    def get_activities(self):
+        """
+        Returns a list of dictionaries with keys `activity`, `category`,
+        `count` and `last_seen`, ordered by category and activity.
+        """
+        items = []
+        for pair in sorted(self._totals, key=lambda x: (x[1] or '', x[0])):
+            count, last_seen = self._totals[pair]
+            items.append({
+                'activity': pair[0],
+                'category': pair[1],
+                'count': count,
+                'last_seen': last_seen,
+            })
+        return items
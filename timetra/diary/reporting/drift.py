@@ -168,7 +168,8 @@ def collect_drift_data(storage, activity, span_days):
 
     dates = DriftData(span_days, until)
 
-    facts = storage.find(since, until=until, activity=activity)
+    facts = storage.find(since, until=until, activity=activity,
+                         fields=('since', 'until'))
     for fact in facts:
         dates.add_fact(fact.since, fact.until)
 
@@ -48,7 +48,8 @@ def predict_next_occurence(storage, activity, num_facts=4):
     average duration as estimated duration.
     """
     yesterday = (datetime.now() - timedelta(days=1)).date()
-    all_facts = storage.find(since=yesterday, activity=activity)
+    all_facts = storage.find(since=yesterday, activity=activity,
+                             readonly=True)
     recent_facts = list(all_facts)[-num_facts:]
     if len(recent_facts) < 2:
         return None
@@ -0,0 +1,130 @@
+# coding: utf-8
+#
+#    Timetra is a time tracking application and library.
+#    Copyright © 2010-2014  Andrey Mikhaylenko
+#
+#    This file is part of Timetra.
+#
+#    Timetra is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Timetra is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with Timetra.  If not, see <http://gnu.org/licenses/>.
+#
+"""
+Day rollups
+===========
+
+Per-day totals kept in the cache: the time spent and the number of facts per
+activity, category, tag and day, the first start and the last end.  Each
+rollup is a row of its own that is only recomputed and rewritten when its
+day file changes, so aggregate queries over long periods read one small
+record per day instead of the facts, and adding a fact costs one row.
+"""
+import datetime
+
+from .aggregation import check_arguments, get_period_key, sort_totals
+from .caching import CachedSummaries
+
+
+__all__ = ['DayRollups']
+
+
+def _add(totals, key, seconds, count=1):
+    stats = totals.setdefault(key, [0, 0])
+    stats[0] += seconds
+    stats[1] += count
+
+
+class DayRollups(CachedSummaries):
+    """
+    :param cache:
+        a :class:`~timetra.diary.caching.Cache` instance.
+    :param key:
+        the key under which the rollups are stored in the cache.
+    """
+    def summarize(self, path, facts):
+        """
+        Returns a dictionary with `[seconds, count]` pairs by `activity`,
+        `category`, `tag` and `day`, the overall `first_start`, `last_end` and
+        `count`, and the facts still in progress as `open` (their duration
+        depends on the time of the query).
+        """
+        rollup = {
+            'activity': {},
+            'category': {},
+            'tag': {},
+            'day': {},
+            'first_start': None,
+            'last_end': None,
+            'count': 0,
+            'open': [],
+        }
+        for fact in facts:
+            rollup['count'] += 1
+            first_start = rollup['first_start']
+            if first_start is None or fact.since < first_start:
+                rollup['first_start'] = fact.since
+            if fact.until is None:
+                rollup['open'].append((fact.since, fact.activity,
+                                       fact.category, tuple(fact.tags)))
+                continue
+            if rollup['last_end'] is None or rollup['last_end'] < fact.until:
+                rollup['last_end'] = fact.until
+            seconds = (fact.until - fact.since).total_seconds()
+            _add(rollup['activity'], fact.activity, seconds)
+            _add(rollup['category'], fact.category, seconds)
+            for tag in fact.tags:
+                _add(rollup['tag'], tag, seconds)
+            _add(rollup['day'], fact.since.date(), seconds)
+        return rollup
+
+    def get_rollup(self, path):
+        "Returns the rollup for given path (see :meth:`summarize`)."
+        return self._files[path][1]
+
+    def get_totals(self, paths, group_by, metric, now=None):
+        """
+        Returns an `OrderedDict` of totals for given (synced) paths.  Same as
+        :func:`~timetra.diary.aggregation.aggregate_facts` for the facts in
+        these files.
+        """
+        check_arguments(group_by, metric)
+        now = now or datetime.datetime.now()
+        index = 1 if metric == 'count' else 0
+        source = 'day' if group_by in ('week', 'month') else group_by
+
+        totals = {}
+
+        def add(key, value):
+            if source == 'day':
+                key = get_period_key(key, group_by)
+            totals[key] = totals.get(key, 0) + value
+
+        for path in paths:
+            rollup = self.get_rollup(path)
+            for key, stats in rollup[source].items():
+                add(key, stats[index])
+            for since, activity, category, tags in rollup['open']:
+                value = 1 if metric == 'count' else \
+                    (now - since).total_seconds()
+                keys = {
+                    'activity': [activity],
+                    'category': [category],
+                    'tag': tags,
+                    'day': [since.date()],
+                }[source]
+                for key in keys:
+                    add(key, value)
+
+        if metric == 'duration':
+            for key in totals:
+                totals[key] = datetime.timedelta(seconds=totals[key])
+        return sort_totals(totals)
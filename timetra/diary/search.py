@@ -0,0 +1,374 @@
+# coding: utf-8
+#
+#    Timetra is a time tracking application and library.
+#    Copyright © 2010-2014  Andrey Mikhaylenko
+#
+#    This file is part of Timetra.
+#
+#    Timetra is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Timetra is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with Timetra.  If not, see <http://gnu.org/licenses/>.
+#
+"""
+Full-text search
+================
+
+A persistent trigram index over the activity names and descriptions of all
+facts, kept in SQLite next to the file cache and updated per day file.
+
+A query term can only occur in the facts that contain each of its trigrams,
+so the facts listed under the rarest of them are the only ones checked for
+the actual substring.  Terms shorter than a trigram are matched by a scan of
+the lowercased texts in the database, which is still much cheaper than
+loading the day files.
+
+Trigrams found in a large share of the facts narrow the search down too
+little to be worth their postings.  Such stop-trigrams are dropped from the
+index; terms made of them only are scanned for like the short ones.
+
+Hits are ranked by the terms they contain: rare terms weigh more than common
+ones and a match in the activity name weighs twice as much as one in the
+description.  Ties go to the most recent fact.  The ranking is done by
+SQLite, so common terms do not build large intermediate results in Python.
+"""
+from collections import namedtuple
+import logging
+import math
+import os
+import pickle
+
+from .caching import (FileStamp, connect_sqlite, get_file_stamp,
+                      remove_sqlite_files)
+
+
+__all__ = ['SearchIndex', 'SearchHit', 'SearchResult', 'make_snippet']
+
+
+log = logging.getLogger(__name__)
+
+
+# `term` is the best of the query terms found in the description, if any
+SearchHit = namedtuple('SearchHit', 'score path position term')
+
+# what the storage returns: the fact itself and a part of its description
+SearchResult = namedtuple('SearchResult', 'score fact snippet')
+
+ACTIVITY_WEIGHT = 2
+DESCRIPTION_WEIGHT = 1
+
+# the number of characters shown around the match in a snippet
+SNIPPET_CONTEXT = 30
+
+# a trigram found in more than this share of the facts is a stop-trigram
+STOPGRAM_RATIO = 0.1
+
+# stop-trigrams are chosen once there are this many facts, and again each
+# time their number doubles
+STOPGRAM_MIN_DOCS = 1000
+
+
+def _get_trigrams(text):
+    return set(text[i:i+3] for i in range(len(text) - 2))
+
+
+def make_snippet(text, term=None, context=SNIPPET_CONTEXT):
+    """
+    Returns the part of given text around the first case-insensitive
+    occurence of `term` (or the beginning of the text), on a single line.
+    """
+    text = ' '.join((text or '').split())
+    start = text.lower().find(term) if term else -1
+    if start == -1:
+        start, length = 0, 0
+    else:
+        length = len(term)
+    left = max(0, start - context)
+    right = min(len(text), start + length + context)
+    snippet = text[left:right]
+    if left:
+        snippet = '…' + snippet
+    if right < len(text):
+        snippet += '…'
+    return snippet
+
+
+class SearchIndex:
+    """
+    :param root_dir:
+        the directory to keep the index in.
+    :param get_stamp:
+        a function that takes a path and returns a
+        :class:`~timetra.diary.caching.FileStamp`.
+    """
+    FILE_NAME = 'search_index.db'
+    SCHEMA_VERSION = 2
+
+    def __init__(self, root_dir, get_stamp=get_file_stamp):
+        path = os.path.join(root_dir, self.FILE_NAME)
+
+        if not os.path.exists(path):
+            log.info('Creating search index...')
+
+        self.path = path
+        self.get_stamp = get_stamp
+        self.db = connect_sqlite(path)
+        self._create_tables()
+        self._stopgrams = set(x for x, in self.db.execute(
+            'SELECT gram FROM stopgrams'))
+
+    def _create_tables(self):
+        with self.db:
+            version, = self.db.execute('PRAGMA user_version').fetchone()
+            if version != self.SCHEMA_VERSION:
+                # rebuilt from the day files on next sync
+                for table in ('files', 'docs', 'postings', 'stopgrams',
+                              'state'):
+                    self.db.execute('DROP TABLE IF EXISTS ' + table)
+                self.db.execute('PRAGMA user_version = {:d}'.format(
+                    self.SCHEMA_VERSION))
+            self.db.execute('CREATE TABLE IF NOT EXISTS files ('
+                            '  path TEXT PRIMARY KEY,'
+                            '  mtime_ns INTEGER NOT NULL,'
+                            '  size INTEGER NOT NULL,'
+                            '  ino INTEGER NOT NULL,'
+                            '  digest BLOB)')
+            # one row per fact; textual columns are stored lowercased
+            self.db.execute('CREATE TABLE IF NOT EXISTS docs ('
+                            '  id INTEGER PRIMARY KEY,'
+                            '  path TEXT NOT NULL,'
+                            '  position INTEGER NOT NULL,'
+                            '  since TEXT NOT NULL,'
+                            '  activity TEXT NOT NULL,'
+                            '  description TEXT NOT NULL)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS docs_path '
+                            'ON docs (path)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS postings ('
+                            '  gram TEXT NOT NULL,'
+                            '  doc INTEGER NOT NULL,'
+                            '  PRIMARY KEY (gram, doc)'
+                            ') WITHOUT ROWID')
+            self.db.execute('CREATE INDEX IF NOT EXISTS postings_doc '
+                            'ON postings (doc)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS stopgrams ('
+                            '  gram TEXT PRIMARY KEY)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS state ('
+                            '  key TEXT PRIMARY KEY,'
+                            '  value BLOB NOT NULL)')
+
+    def _get_state(self, key, default=None):
+        row = self.db.execute('SELECT value FROM state WHERE key = ?',
+                              (key,)).fetchone()
+        return default if row is None else pickle.loads(row[0])
+
+    def _set_state(self, key, value):
+        self.db.execute('INSERT OR REPLACE INTO state VALUES (?, ?)',
+                        (key, pickle.dumps(value, protocol=-1)))
+
+    def _forget_file(self, path):
+        self.db.execute('DELETE FROM postings WHERE doc IN '
+                        '  (SELECT id FROM docs WHERE path = ?)', (path,))
+        self.db.execute('DELETE FROM docs WHERE path = ?', (path,))
+        self.db.execute('DELETE FROM files WHERE path = ?', (path,))
+
+    def _index_file(self, path, stamp, facts):
+        self._forget_file(path)
+        for position, fact in enumerate(facts):
+            activity = str(fact.get('activity') or '').lower()
+            description = str(fact.get('description') or '').lower()
+            cursor = self.db.execute(
+                'INSERT INTO docs (path, position, since, activity, '
+                '  description) VALUES (?, ?, ?, ?, ?)',
+                (path, position, fact['since'].isoformat(' '), activity,
+                 description))
+            grams = _get_trigrams(activity) | _get_trigrams(description)
+            grams -= self._stopgrams
+            self.db.executemany('INSERT INTO postings VALUES (?, ?)',
+                                ((x, cursor.lastrowid) for x in grams))
+        self.db.execute('INSERT INTO files VALUES (?, ?, ?, ?, ?)',
+                        (path,) + tuple(stamp))
+
+    def sync(self, day_paths, load, tree_stamp=None):
+        """
+        Makes sure that given day files are indexed and up to date.  Files
+        that are not among given paths are dropped from the index.
+
+        :param day_paths:
+            an iterable of *all* day file paths.
+        :param load:
+            a function that takes a path and returns the list of facts.
+        :param tree_stamp:
+            a cheap stamp of the whole tree of day files.  If it is the same
+            as on the last sync, the paths are not even listed.
+
+        Files with unchanged stamp are not loaded.
+        """
+        if tree_stamp is not None and \
+                tree_stamp == self._get_state('tree_stamp'):
+            return
+        known = dict((row[0], FileStamp(*row[1:])) for row in self.db.execute(
+            'SELECT path, mtime_ns, size, ino, digest FROM files'))
+        with self.db:
+            changed = False
+            for path in day_paths:
+                try:
+                    stamp = self.get_stamp(path)
+                except FileNotFoundError:
+                    continue
+                if known.pop(path, None) != stamp:
+                    log.debug('Indexing %s', path)
+                    self._index_file(path, stamp, load(path))
+                    changed = True
+            for path in known:
+                self._forget_file(path)
+            if changed:
+                self._update_stopgrams()
+            self._set_state('tree_stamp', tree_stamp)
+
+    def refresh(self, paths, load):
+        """
+        Re-indexes those of given files that have changed since they were
+        indexed and drops the ones that do not exist anymore.  Returns `True`
+        if there were any.  Unlike :meth:`sync`, this checks the stamps of
+        given files even if the tree stamp is the same, so it notices a file
+        edited in place.
+        """
+        changed = False
+        with self.db:
+            for path in paths:
+                row = self.db.execute('SELECT mtime_ns, size, ino, digest '
+                                      'FROM files WHERE path = ?',
+                                      (path,)).fetchone()
+                try:
+                    stamp = self.get_stamp(path)
+                except FileNotFoundError:
+                    self._forget_file(path)
+                    changed = True
+                    continue
+                if row is None or FileStamp(*row) != stamp:
+                    log.debug('Re-indexing %s', path)
+                    self._index_file(path, stamp, load(path))
+                    changed = True
+        return changed
+
+    def _update_stopgrams(self):
+        total, = self.db.execute('SELECT COUNT(*) FROM docs').fetchone()
+        if total < max(STOPGRAM_MIN_DOCS,
+                       2 * self._get_state('stopgram_docs', 0)):
+            return
+        log.debug('Choosing stop-trigrams for %d facts', total)
+        grams = [x for x, in self.db.execute(
+            'SELECT gram FROM postings GROUP BY gram HAVING COUNT(*) > ?',
+            (int(total * STOPGRAM_RATIO),))]
+        for gram in grams:
+            self.db.execute('DELETE FROM postings WHERE gram = ?', (gram,))
+        self.db.executemany('INSERT OR IGNORE INTO stopgrams VALUES (?)',
+                            ((x,) for x in grams))
+        self._stopgrams.update(grams)
+        self._set_state('stopgram_docs', total)
+
+    def _match_term(self, term):
+        """
+        Returns a `(from_where, params)` pair: the part of a query that
+        selects the docs (aliased ``d``) that contain given (lowercased)
+        term, or `None` if there are certainly none.
+        """
+        match = '(instr(d.activity, ?) OR instr(d.description, ?))'
+        grams = _get_trigrams(term) - self._stopgrams
+        if not grams:
+            return 'docs d WHERE ' + match, [term, term]
+        # the postings of the rarest trigram are the fewest candidates
+        counts = []
+        for gram in grams:
+            count, = self.db.execute('SELECT COUNT(*) FROM postings '
+                                     'WHERE gram = ?', (gram,)).fetchone()
+            if not count:
+                return None
+            counts.append((count, gram))
+        return ('docs d JOIN postings p ON p.doc = d.id '
+                'WHERE p.gram = ? AND ' + match), [min(counts)[1], term, term]
+
+    def search(self, query, limit=20):
+        """
+        Returns a list of up to `limit` :class:`SearchHit` tuples for the facts
+        that contain any of the whitespace-separated terms of `query` in their
+        activity or description (case-insensitive), best first.
+        """
+        terms = set(query.lower().split())
+        if not terms:
+            return []
+        total, = self.db.execute('SELECT COUNT(*) FROM docs').fetchone()
+
+        # the score of each term's hits in one query, summed up per doc
+        selects = []
+        params = []
+        weights = {}
+        for term in sorted(terms):
+            matched = self._match_term(term)
+            if matched is None:
+                continue
+            from_where, match_params = matched
+            count, = self.db.execute('SELECT COUNT(*) FROM ' + from_where,
+                                     match_params).fetchone()
+            if not count:
+                continue
+            weights[term] = weight = math.log(1 + total / count)
+            selects.append('SELECT d.id AS doc,'
+                           '  (instr(d.activity, ?) > 0) * ?'
+                           '  + (instr(d.description, ?) > 0) * ? AS score '
+                           'FROM ' + from_where)
+            params.extend([term, ACTIVITY_WEIGHT * weight,
+                           term, DESCRIPTION_WEIGHT * weight] + match_params)
+        if not selects:
+            return []
+
+        if len(selects) == 1:
+            hits = selects[0]
+        else:
+            hits = ('SELECT doc, SUM(score) AS score FROM ({}) GROUP BY doc'
+                    .format(' UNION ALL '.join(selects)))
+        rows = self.db.execute(
+            'SELECT round(h.score, 9), d.path, d.position, d.description '
+            'FROM ({}) h JOIN docs d ON d.id = h.doc '
+            'ORDER BY round(h.score, 9) DESC, d.since DESC '
+            'LIMIT ?'.format(hits), params + [limit])
+
+        # the best of the terms found in the description goes to the snippet
+        by_weight = sorted(weights, key=weights.get, reverse=True)
+        hits = []
+        for score, path, position, description in rows:
+            term = next((x for x in by_weight if x in description), None)
+            hits.append(SearchHit(round(score, 3), path, position, term))
+        return hits
+
+    def collect_garbage(self):
+        """
+        Drops the files that do not exist anymore from the index.  Returns
+        their number.
+        """
+        paths = [x for x, in self.db.execute('SELECT path FROM files')
+                 if not os.path.exists(x)]
+        with self.db:
+            for path in paths:
+                self._forget_file(path)
+        return len(paths)
+
+    def vacuum(self):
+        self.db.execute('VACUUM')
+        # the pages are copied through the WAL; give that space back too
+        self.db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+    def reset(self):
+        try:
+            self.db.close()
+        except:
+            pass
+        remove_sqlite_files(self.path)
@@ -24,49 +24,23 @@ Storage
 """
 from collections import OrderedDict
 import datetime
+import hashlib
+import itertools
 import os
 #from warnings import warn
 
 import monk
-import yaml
 
 
-from . import caching, models
+from . import (aggregation, caching, indexing, intervals, manifests, models,
+               querying, records, registry, rollups, search, validation,
+               yamlio)
+from .yamlio import Literal
 
 
 __all__ = ['Storage']
 
 
-#--- YAML STUFF
-#
-#
-
-
-# http://stackoverflow.com/questions/8640959/how-can-i-control-what-scalar-form-pyyaml-uses-for-my-data
-class Literal(str):
-    pass
-
-def _represent_literal(dumper, data):
-    return dumper.represent_scalar('tag:yaml.org,2002:str', data, style='|')
-
-
-def _represent_dictorder(self, data):
-    return self.represent_mapping('tag:yaml.org,2002:map', data.items())
-
-
-def configure_yaml():
-    yaml.add_representer(Literal, _represent_literal)
-    yaml.add_representer(OrderedDict, _represent_dictorder)
-
-
-configure_yaml()
-
-
-#
-#
-#--- / YAML STUFF
-
-
 def _prepare_value_for_yaml(value):
     """
     Returns a YAML-friendly representation of given value.  Normally it just
@@ -76,7 +50,7 @@ def _prepare_value_for_yaml(value):
     Preconditions:
 
     * a representer for :class:`Literal` is registered in the `yaml` library.
-      This is normally done by calling :func:`configure_yaml`.
+      This is done by :mod:`~timetra.diary.yamlio` on import.
 
     """
     if value and isinstance(value, str) and '\n' in value:
@@ -97,7 +71,7 @@ def _prepare_fact_for_yaml(fact_dict):
     * the `structure` attribute of class :class:`~timetra.diary.models.Fact`
       is an `OrderedDict`;
     * a representer for :class:`OrderedDict` is registered in the `yaml`
-      library.  This is normally done by calling :func:`configure_yaml`.
+      library.  This is done by :mod:`~timetra.diary.yamlio` on import.
 
     :param fact_dict:
         A `dict`-like object representing the fact.
@@ -121,46 +95,327 @@ def _prepare_fact_for_yaml(fact_dict):
     return fact_od
 
 
-class YamlBackend:
-    "Provides low-level access to the facts database"
+_validate_fact = validation.compile_validator(models.Fact.structure)
 
-    def __init__(self, data_dir, cache_dir=None):
-        self.data_dir = data_dir
-        self.cache = caching.Cache(cache_dir)
 
-    def get_cached_day_file(self, path):
-        return self.cache.get_cached_yaml_file(path, model=models.Fact)
+def _validate_and_prepare_fact(fact, path=None):
+    """
+    Inserts defaults into given fact, validates it and returns the result of
+    :func:`_prepare_fact_for_yaml`.  The `path` is mentioned in the error
+    message, if any.
+    """
+    # insert defaults
+    monk.merge_defaults(models.Fact.structure, fact)
 
-    def _is_fact_matching(self, fact, filters):
-        if not filters:
-            return True
-        for key, pattern in filters.items():
-            pattern = pattern.lower()
+    # validate structure and types
+    _validate_fact(fact, path)
 
-            # support multiple values per key
-            value = fact.get(key)
-            if isinstance(value, list):
-                values = value
-            else:
-                values = [value]
+    # ensure field order and stuff
+    return _prepare_fact_for_yaml(fact)
 
-            if not any(pattern in str(v or '').lower() for v in values):
-                return False
-        return True
 
-    def _collect_day_paths(self, since=None, until=None):
+def _to_date(value):
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    return value
 
-        for year in sorted(os.listdir(self.data_dir)):
-            year_num = int(year)
+
+def _scan_dir(path, reverse=False):
+    """
+    Returns a sorted list of `(name, is_dir)` pairs for given directory.
+    The type comes from the directory listing itself where the platform
+    provides it (:func:`os.scandir`); otherwise `is_dir` is `None`.
+    """
+    if hasattr(os, 'scandir'):
+        entries = [(x.name, x.is_dir()) for x in os.scandir(path)]
+    else:
+        entries = [(x, None) for x in os.listdir(path)]
+    return sorted(entries, reverse=reverse)
+
+
+def _insert_sorted(facts, fact):
+    "Inserts given fact into a list of facts ordered by `since`."
+    for i, other in enumerate(facts):
+        if fact['since'] < other['since']:
+            facts.insert(i, fact)
+            break
+    else:
+        facts.append(fact)
+
+
+def _merge_sorted(facts, new_facts):
+    """
+    Returns a list with given new facts (ordered by `since`) merged into
+    given list of facts in a single pass.  Same as calling
+    :func:`_insert_sorted` for each new fact.
+    """
+    merged = []
+    new_facts = iter(new_facts)
+    pending = next(new_facts, None)
+    for fact in facts:
+        while pending is not None and pending['since'] < fact['since']:
+            merged.append(pending)
+            pending = next(new_facts, None)
+        merged.append(fact)
+    if pending is not None:
+        merged.append(pending)
+        merged.extend(new_facts)
+    return merged
+
+
+class YamlBackend:
+    """
+    Provides low-level access to the facts database.
+
+    :param data_dir:
+        the directory with day files (``YYYY/MM/DD.yaml``).
+    :param cache_dir:
+        the directory for the file cache (XDG cache dir by default).
+    :param cache_store:
+        the kind of cache store: ``sqlite`` (default) or ``shelve``.
+    :param index:
+        if `True`, an SQLite index of facts is kept next to the file cache
+        and used to skip day files that cannot match the filters.
+    :param hash_content:
+        if `True`, cached data is also checked against a digest of the day
+        file content.  Use on filesystems with coarse timestamps.
+    :param cache_max_size:
+        the maximum size of the cache in bytes, including the indexes
+        (unlimited by default).  See :class:`~timetra.diary.caching.Cache`.
+    :param validate_existing:
+        if `False`, only new facts are validated when a day file is
+        rewritten; the facts that were already in the file are trusted.
+    :param journal:
+        if `True`, :meth:`add` appends new facts to a per-day journal
+        (``YYYY/MM/DD.yaml.journal``) instead of rewriting the day file.
+        Journalled facts are merged into day files by :meth:`compact` and
+        are transparently included in all reads.
+    """
+    JOURNAL_SUFFIX = '.journal'
+
+    # bounded ranges up to this many days are resolved by computing the day
+    # file paths instead of listing the directories
+    DIRECT_PATHS_MAX_DAYS = 31
+
+    def __init__(self, data_dir, cache_dir=None, cache_store='sqlite',
+                 index=False, journal=False, hash_content=False,
+                 cache_max_size=None, validate_existing=True):
+        # the paths of day files are stored in the cache and the indexes
+        # and checked for existence later, possibly from another directory
+        self.data_dir = os.path.abspath(data_dir)
+        self.journal = journal
+        self.validate_existing = validate_existing
+        self.cache = caching.Cache(cache_dir, store=cache_store,
+                                   hash_content=hash_content,
+                                   max_size=cache_max_size,
+                                   journal_suffix=self.JOURNAL_SUFFIX)
+        if index:
+            os.makedirs(self._get_index_dir(), exist_ok=True)
+            self.index = indexing.FactIndex(self._get_index_dir(),
+                                            get_stamp=self.cache.get_stamp)
+            self.cache.add_sidecar(self.index.path, lambda: self.index)
+        else:
+            self.index = None
+        self._activities = None
+        self._intervals = None
+        self._rollups = None
+        self._search_index = None
+        search_path = os.path.join(self._get_index_dir(),
+                                   search.SearchIndex.FILE_NAME)
+        self.cache.add_sidecar(search_path, lambda: self.search_index)
+
+    @property
+    def activities(self):
+        "The :class:`~timetra.diary.registry.ActivityRegistry` (lazy)."
+        if self._activities is None:
+            key = 'activities:' + self.data_dir
+            self._activities = registry.ActivityRegistry(self.cache, key)
+        return self._activities
+
+    @property
+    def intervals(self):
+        "The :class:`~timetra.diary.intervals.IntervalIndex` (lazy)."
+        if self._intervals is None:
+            key = 'intervals:' + self.data_dir
+            self._intervals = intervals.IntervalIndex(self.cache, key)
+        return self._intervals
+
+    @property
+    def rollups(self):
+        "The :class:`~timetra.diary.rollups.DayRollups` (lazy)."
+        if self._rollups is None:
+            key = 'rollups:' + self.data_dir
+            self._rollups = rollups.DayRollups(self.cache, key)
+        return self._rollups
+
+    @property
+    def search_index(self):
+        "The :class:`~timetra.diary.search.SearchIndex` (lazy)."
+        if self._search_index is None:
+            index_dir = self._get_index_dir()
+            os.makedirs(index_dir, exist_ok=True)
+            self._search_index = search.SearchIndex(
+                index_dir, get_stamp=self.cache.get_stamp)
+        return self._search_index
+
+    def _get_index_dir(self):
+        # the indexes drop the files they are not given on sync, so diaries
+        # that share the cache directory get a set each
+        digest = hashlib.sha1(self.data_dir.encode('utf-8')).hexdigest()
+        return os.path.join(os.path.dirname(self.cache.path), 'indexes',
+                            digest[:16])
+
+    def warm_cache(self, workers=None):
+        """
+        Loads all day files that are not cached yet (or have changed) into
+        the cache using a pool of `workers` processes.  Returns the number of
+        loaded files.
+        """
+        return self.cache.warm(self._collect_day_paths(), model=models.Fact,
+                               workers=workers)
+
+    def compact_cache(self):
+        """
+        Drops cache and index entries for deleted day files and cache entries
+        beyond the size limit and shrinks the cache files.  Returns a
+        `(removed_entries, reclaimed_bytes)` tuple.
+        """
+        return self.cache.compact()
+
+    def _stat_tail(self, path):
+        # A new day file changes the stamp of its month directory, a new
+        # month changes the year directory and a new year changes the data
+        # directory.  Together with the file itself this tells whether
+        # the tail record may have become stale.
+        month_dir = os.path.dirname(path)
+        year_dir = os.path.dirname(month_dir)
+        paths = self.data_dir, year_dir, month_dir, path
+        return tuple(self.cache.get_stamp(x) for x in paths)
+
+    def _get_generation_key(self):
+        return 'generation:' + self.data_dir
+
+    def _get_tree_stamp(self):
+        """
+        Returns a cheap stamp of the whole tree of day files: the number of
+        writes made through the backend and the stamps of the data, year and
+        month directories (a directory changes when a file is added to it or
+        removed from it).  A day file edited in place by another program
+        does not change it.
+        """
+        dirs = [self.data_dir]
+        for year, is_dir in _scan_dir(self.data_dir):
+            if is_dir is False:
+                continue
+            year_path = os.path.join(self.data_dir, year)
+            dirs.append(year_path)
+            dirs.extend(os.path.join(year_path, month)
+                        for month, is_dir in _scan_dir(year_path)
+                        if is_dir is not False)
+        generation = self.cache.get_meta(self._get_generation_key(), 0)
+        return generation, tuple(self.cache.get_stamp(x) for x in dirs)
+
+    def _get_tail_key(self):
+        return 'tail:' + self.data_dir
+
+    def _get_tail(self):
+        """
+        Returns a `(path, since)` tuple for the latest fact if the tail
+        record is still valid, otherwise `None`.
+        """
+        record = self.cache.get_meta(self._get_tail_key())
+        if not record:
+            return None
+        path, since, stamps = record
+        try:
+            if self._stat_tail(path) == stamps:
+                return path, since
+        except FileNotFoundError:
+            pass
+        return None
+
+    def _set_tail(self, path, since):
+        stamps = self._stat_tail(path)
+        self.cache.set_meta(self._get_tail_key(), (path, since, stamps))
+
+    def _drop_tail(self):
+        self.cache.set_meta(self._get_tail_key(), None)
+
+    def _update_tail_after_add(self, tail, path, since):
+        """
+        Updates the tail record after a fact starting at `since` has been
+        written to `path`.  `tail` is the result of :meth:`_get_tail` obtained
+        *before* writing.
+        """
+        if tail is None:
+            # unknown; the next `get_latest()` will walk the tree
+            return
+        tail_path, tail_since = tail
+        if tail_since <= since:
+            self._set_tail(path, since)
+        else:
+            # the tail is still there but the mtimes may have changed
+            self._set_tail(tail_path, tail_since)
+
+    def get_cached_day_file(self, path, readonly=False):
+        """
+        Returns a sequence of facts from given day file and its journal.  If
+        `readonly` is `True`, the facts are
+        :class:`~timetra.diary.models.FactView` objects.
+        """
+        # the journal is merged (and stamped) by the cache
+        facts = self.cache.get_cached_yaml_file(path, model=models.Fact)
+        if readonly:
+            facts = facts.views()
+        return facts
+
+    def _get_day_projection(self, path, fields):
+        record = self.cache.get_cached_yaml_file(path, model=models.Fact)
+        return record.project(fields)
+
+    def _collect_day_paths(self, since=None, until=None, reverse=False):
+        if since and until:
+            first, last = _to_date(since), _to_date(until)
+            if (last - first).days < self.DIRECT_PATHS_MAX_DAYS:
+                return self._compute_day_paths(first, last, reverse=reverse)
+        return self._walk_day_paths(since, until, reverse=reverse)
+
+    def _compute_day_paths(self, first, last, reverse=False):
+        # one `stat` per day instead of listing the directories
+        days = range((last - first).days + 1)
+        if reverse:
+            days = reversed(days)
+        for offset in days:
+            path = self.get_file_path_for_day(
+                first + datetime.timedelta(days=offset))
+            if os.path.isfile(path):
+                yield path
+
+    def _walk_day_paths(self, since=None, until=None, reverse=False):
+        # Out-of-range names are skipped rather than ending the loop so that
+        # the same code works for both directions.  Subdirectories are only
+        # listed when needed, so reverse walks are lazy too.
+
+        for year, is_dir in _scan_dir(self.data_dir, reverse=reverse):
+            if is_dir is False:
+                continue
+            try:
+                year_num = int(year)
+            except ValueError as e:
+                print('Bogus year dir/file name: {} — {}'.format(
+                    os.path.join(self.data_dir, year), e))
+                continue
 
             if since and year_num < since.year:
                 continue
             if until and year_num > until.year:
-                break
+                continue
 
             year_path = os.path.join(self.data_dir, year)
 
-            for month in sorted(os.listdir(year_path)):
+            for month, is_dir in _scan_dir(year_path, reverse=reverse):
+                if is_dir is False:
+                    continue
                 try:
                     month_num = int(month)
                 except ValueError as e:
@@ -171,11 +426,13 @@ class YamlBackend:
                 if since and year_num == since.year and month_num < since.month:
                     continue
                 if until and year_num == until.year and month_num > until.month:
-                    break
+                    continue
 
                 month_path = os.path.join(year_path, month)
 
-                for day_file in sorted(os.listdir(month_path)):
+                for day_file, is_dir in _scan_dir(month_path, reverse=reverse):
+                    if is_dir:
+                        continue
                     _day, _ext = os.path.splitext(day_file)
                     if _ext != '.yaml':
                         continue
@@ -190,23 +447,88 @@ class YamlBackend:
                     if since and year_num == since.year and month_num == since.month and day_num < since.day:
                         continue
                     if until and year_num == until.year and month_num == until.month and day_num > until.day:
-                        break
+                        continue
 
                     yield os.path.join(month_path, day_file)
 
     def collect_facts(self, since=None, until=None, filters=None,
-                      hint_reverse=False):
-        day_paths = self._collect_day_paths(since=since, until=until)
-        if hint_reverse:
-            # optimization hint
-            day_paths = reversed(list(day_paths))
-        for day_path in day_paths:
-            day_facts = self.get_cached_day_file(day_path)
-            if hint_reverse:
-                day_facts = reversed(day_facts)
-            for fact in day_facts:
-                if self._is_fact_matching(fact, filters):
-                    yield fact
+                      hint_reverse=False, readonly=False, fields=None,
+                      order='asc', limit=None, offset=0, query=None):
+        """
+        Returns an iterator of facts within given range that match given
+        filters and query (see :mod:`timetra.diary.querying`), ordered by
+        start (ascending or, if `order` is ``desc``, descending).  The first
+        `offset` matches are skipped and at most `limit` are returned; day
+        files beyond that are not read at all.  `hint_reverse` is the same as
+        ``order='desc'``.
+        """
+        if order not in ('asc', 'desc'):
+            raise ValueError('Unknown order "{}"; expected "asc" or "desc"'
+                             .format(order))
+        # parsed once, before anything is read
+        compiled = querying.compile_query(query, filters)
+        facts = self._iter_facts(since=since, until=until, query=compiled,
+                                 reverse=hint_reverse or order == 'desc',
+                                 readonly=readonly, fields=fields)
+        if offset or limit is not None:
+            stop = None if limit is None else offset + limit
+            facts = itertools.islice(facts, offset, stop)
+        return facts
+
+    def _iter_facts(self, since=None, until=None, query=None, reverse=False,
+                    readonly=False, fields=None):
+        match = query.match
+        # conditions that every matching fact satisfies; these let the index
+        # and the manifests skip whole files
+        filters = query.filters
+        if fields is not None:
+            fields = tuple(fields)
+            # the query may need more fields than requested
+            wanted = fields + tuple(sorted(x for x in query.keys
+                                           if x not in fields))
+            make = records.get_projection_type(fields)
+
+        if self.index is not None and \
+                set(filters) & set(indexing.INDEXED_KEYS):
+            # the files are only listed and stamped if the tree has changed
+            # (see `search()` for the files edited in place); the paths
+            # within the range come from the index
+            with self.cache.batch():
+                self.index.sync(self._collect_day_paths(),
+                                load=self.get_cached_day_file,
+                                tree_stamp=self._get_tree_stamp())
+            day_paths = self.index.find_paths(filters, since=since,
+                                              until=until, reverse=reverse)
+        else:
+            # the directories are walked lazily in either direction, so
+            # nothing is read beyond the last fact that is actually consumed
+            day_paths = self._collect_day_paths(since=since, until=until,
+                                                reverse=reverse)
+            if filters and set(filters) & set(manifests.SKIP_KEYS):
+                load = lambda path: self.get_cached_day_file(path,
+                                                             readonly=True)
+                day_paths = manifests.filter_day_paths(
+                    self.cache, 'manifests:' + self.data_dir,
+                    day_paths, filters, load=load,
+                    complete=since is None and until is None)
+        # on a cold cache every file read is a new entry
+        with self.cache.batch():
+            for day_path in day_paths:
+                if fields is None:
+                    day_facts = self.get_cached_day_file(day_path,
+                                                         readonly=readonly)
+                else:
+                    day_facts = self._get_day_projection(day_path, wanted)
+                if reverse:
+                    day_facts = reversed(day_facts)
+                for fact in day_facts:
+                    if fields is None:
+                        if match(fact):
+                            yield fact
+                    elif not query.keys:
+                        yield fact
+                    elif match(fact._asdict()):
+                        yield make(*fact[:len(fields)])
 
     def get_file_path_for_day(self, date):
         return os.path.join(
@@ -216,51 +538,137 @@ class YamlBackend:
             '{:0>2}.yaml'.format(date.day),
         )
 
+    def get_journal_path(self, day_path):
+        return day_path + self.JOURNAL_SUFFIX
+
     def _load_from_file(self, file_path):
         if os.path.exists(file_path):
             with open(file_path) as f:
-                return yaml.load(f)
+                return yamlio.load(f)
         return []
 
-    def _dump_to_file(self, file_path, facts, create=False):
+    def _dump_to_file(self, file_path, facts, create=False, existing=()):
+        # `existing` are the facts that were read from the file
+        if self.validate_existing:
+            existing = ()
+        trusted = set(id(x) for x in existing)
+        fact_ods = []
+        for fact in facts:
+            if id(fact) in trusted:
+                fact_ods.append(_prepare_fact_for_yaml(fact))
+            else:
+                fact_ods.append(_validate_and_prepare_fact(fact, file_path))
+        self._write_to_file(file_path, fact_ods)
+
+    def _write_to_file(self, file_path, fact_ods, mode='w'):
+        # expects facts already prepared with `_prepare_fact_for_yaml()`
         if not os.path.exists(file_path):
             # make sure the year and month dirs are created
             month_dir = os.path.dirname(file_path)
             if not os.path.exists(month_dir):
                 os.makedirs(month_dir)
 
-        fact_ods = []
-        for fact in facts:
-            # insert defaults
-            monk.merge_defaults(models.Fact.structure, fact)
+        with open(file_path, mode) as f:
+            yamlio.dump(fact_ods, f)
 
-            # validate structure and types
-            monk.validate(models.Fact.structure, fact)
+        # see `_get_tree_stamp()`
+        key = self._get_generation_key()
+        self.cache.set_meta(key, self.cache.get_meta(key, 0) + 1)
 
-            # ensure field order and stuff
-            fact_od = _prepare_fact_for_yaml(fact)
+    def _append_to_journal(self, file_path, facts):
+        journal_path = self.get_journal_path(file_path)
+        fact_ods = [_validate_and_prepare_fact(fact, journal_path)
+                    for fact in facts]
+
+        if not os.path.exists(file_path):
+            # the day file must exist for the day to be discovered
+            self._dump_to_file(file_path, [], create=True)
 
-            fact_ods.append(fact_od)
+        # a YAML list can be extended by simply appending items to the file;
+        # the journal is part of the day file's stamp (see `Cache`)
+        self._write_to_file(journal_path, fact_ods, mode='a')
 
-        with open(file_path, 'w') as f:
-            yaml.dump(fact_ods, f, allow_unicode=True, default_flow_style=False)
+    def _compact_day(self, file_path):
+        """
+        Merges the journal (if any) into given day file.  Returns `True` if
+        there was a journal.
+        """
+        journal_path = self.get_journal_path(file_path)
+        if not os.path.exists(journal_path):
+            return False
+
+        existing = list(self._load_from_file(file_path) or [])
+        facts = list(existing)
+        for fact in self._load_from_file(journal_path) or []:
+            _insert_sorted(facts, fact)
+        self._dump_to_file(file_path, facts, create=True, existing=existing)
+        os.remove(journal_path)
+        return True
+
+    def compact(self):
+        """
+        Merges all journals into their day files.  Returns the number of
+        affected day files.
+        """
+        cnt = 0
+        for file_path in self._collect_day_paths():
+            if self._compact_day(file_path):
+                cnt += 1
+        return cnt
 
     def add(self, fact):
         # we expect the `fact` dictionary to be already validated
         file_path = self.get_file_path_for_day(fact['since'])
-        facts = list(self._load_from_file(file_path) or [])
 
-        for i, other in enumerate(facts):
-            if fact['since'] < other['since']:
-                facts.insert(i, fact)
-                break
+        tail = self._get_tail()
+
+        if self.journal:
+            self._append_to_journal(file_path, [fact])
         else:
-            facts.append(fact)
+            existing = list(self._load_from_file(file_path) or [])
+            facts = list(existing)
+            _insert_sorted(facts, fact)
+            self._dump_to_file(file_path, facts, create=True,
+                               existing=existing)
 
-        self._dump_to_file(file_path, facts, create=True)
+        self._update_tail_after_add(tail, file_path, fact['since'])
 
         return file_path
 
+    def add_many(self, facts):
+        """
+        Adds given facts.  Each affected day file is read and written only
+        once; only the new facts are validated.  Returns the list of affected
+        file paths.
+        """
+        tail = self._get_tail()
+
+        facts_by_path = OrderedDict()
+        for fact in facts:
+            file_path = self.get_file_path_for_day(fact['since'])
+            facts_by_path.setdefault(file_path, []).append(fact)
+
+        for file_path, new_facts in facts_by_path.items():
+            new_facts = sorted(new_facts, key=lambda x: x['since'])
+
+            if self.journal:
+                self._append_to_journal(file_path, new_facts)
+                continue
+
+            existing_ods = [_prepare_fact_for_yaml(x) for x in
+                            self._load_from_file(file_path) or []]
+            new_ods = [_validate_and_prepare_fact(x, file_path)
+                       for x in new_facts]
+            self._write_to_file(file_path,
+                                _merge_sorted(existing_ods, new_ods))
+
+        if facts_by_path:
+            latest_path = max(facts_by_path)
+            latest = max(facts_by_path[latest_path], key=lambda x: x['since'])
+            self._update_tail_after_add(tail, latest_path, latest['since'])
+
+        return list(facts_by_path)
+
     def get(self, date_time):
         facts = self.collect_facts(since=date_time.date(),
                                    until=date_time.date())
@@ -272,6 +680,8 @@ class YamlBackend:
 
     def delete(self, since, activity):
         file_path = self.get_file_path_for_day(since)
+        tail = self._get_tail()
+        self._compact_day(file_path)
         facts = self._load_from_file(file_path)
 
         for i, fact in enumerate(facts):
@@ -281,7 +691,15 @@ class YamlBackend:
         else:
             raise FactNotFound('{} {}'.format(since, activity))
 
-        self._dump_to_file(file_path, facts, create=False)
+        self._dump_to_file(file_path, facts, create=False, existing=facts)
+
+        if tail is None:
+            return
+        if tail == (file_path, since):
+            # the previous fact will be found by `get_latest()`
+            self._drop_tail()
+        else:
+            self._set_tail(*tail)
 
     def update(self, old_fact, kwargs):
         # make sure it exists
@@ -306,9 +724,47 @@ class YamlBackend:
         self.add(new_fact)
 
     def get_latest(self):
-        return self.collect_facts(hint_reverse=True).__next__()
+        tail = self._get_tail()
+        if tail:
+            facts = self.get_cached_day_file(tail[0])
+            if facts:
+                return facts[-1]
+
+        for path in self._collect_day_paths(reverse=True):
+            facts = self.get_cached_day_file(path)
+            if facts:
+                latest = facts[-1]
+                self._set_tail(path, latest['since'])
+                return latest
+
+        raise FactNotFound('the storage is empty')
+
+    def get_known_activities(self):
+        with self.cache.batch():
+            self.activities.sync(self._collect_day_paths(),
+                                 load=self.get_cached_day_file)
+        return self.activities.get_activities()
+
+    def find_overlapping_facts(self, since, until):
+        load = self.get_cached_day_file
+        # the files are only listed and stamped if the tree has changed; see
+        # `search()` for the files edited in place
+        with self.cache.batch():
+            self.intervals.sync(self._collect_day_paths(), load=load,
+                                tree_stamp=self._get_tree_stamp())
+            found = self.intervals.find(since, until)
+            while self.intervals.refresh(set(x[0] for x in found), load):
+                found = self.intervals.find(since, until)
+        day_path = day_facts = None
+        for path, position in found:
+            if path != day_path:
+                day_path = path
+                day_facts = self.get_cached_day_file(path)
+            yield day_facts[position]
 
-    def find(self, since=None, until=None, activity=None, description=None, tag=None):
+    def find(self, since=None, until=None, activity=None, description=None,
+             tag=None, readonly=False, fields=None, order='asc', limit=None,
+             offset=0, query=None):
         filters = {}
         if activity:
             filters['activity'] = activity
@@ -316,7 +772,48 @@ class YamlBackend:
             filters['description'] = description
         if tag:
             filters['tags'] = tag
-        return self.collect_facts(since=since, until=until, filters=filters)
+        return self.collect_facts(since=since, until=until, filters=filters,
+                                  readonly=readonly, fields=fields,
+                                  order=order, limit=limit, offset=offset,
+                                  query=query)
+
+    def aggregate(self, since=None, until=None, group_by='activity',
+                  metric='duration'):
+        aggregation.check_arguments(group_by, metric)
+        day_paths = list(self._collect_day_paths(since=since, until=until))
+        load = lambda path: self.get_cached_day_file(path, readonly=True)
+        # a partial range must not make the rollups forget other days
+        with self.cache.batch():
+            self.rollups.sync(day_paths, load=load,
+                              prune=since is None and until is None)
+        return self.rollups.get_totals(day_paths, group_by, metric)
+
+    def search(self, query, limit=20):
+        load = lambda path: self.get_cached_day_file(path, readonly=True)
+        # the files are only listed and stamped if the tree has changed
+        with self.cache.batch():
+            self.search_index.sync(self._collect_day_paths(), load=load,
+                                   tree_stamp=self._get_tree_stamp())
+            # a day file edited in place by another program does not change
+            # the tree stamp, so the files with hits are checked one by one
+            # (and a file that has only now got a match is noticed with the
+            # next change of the tree)
+            hits = self.search_index.search(query, limit=limit)
+            while self.search_index.refresh(set(x.path for x in hits), load):
+                hits = self.search_index.search(query, limit=limit)
+        results = []
+        for hit in hits:
+            try:
+                facts = self.get_cached_day_file(hit.path)
+            except FileNotFoundError:
+                continue
+            if hit.position >= len(facts):
+                # changed since it was checked
+                continue
+            fact = facts[hit.position]
+            snippet = search.make_snippet(fact.get('description'), hit.term)
+            results.append(search.SearchResult(hit.score, fact, snippet))
+        return results
 
 
 class Storage:
@@ -331,25 +828,112 @@ class Storage:
     def get_latest(self):
         return self.backend.get_latest()
 
+    def warm_cache(self, workers=None):
+        """
+        Populates the backend's cache (if any) in parallel.  Returns whatever
+        the backend returned.
+        """
+        return self.backend.warm_cache(workers=workers)
+
+    def compact_cache(self):
+        """
+        Shrinks the backend's cache (if any).  Returns whatever the backend
+        returned.
+        """
+        return self.backend.compact_cache()
+
+    def compact(self):
+        """
+        Merges journalled facts into the canonical storage.  Returns the number
+        of affected files (or whatever the backend returned).
+        """
+        return self.backend.compact()
+
     def find(self, since=None, until=None, activity=None, description=None,
-             tag=None):
+             tag=None, readonly=False, fields=None, order='asc', limit=None,
+             offset=0, query=None):
+        """
+        Returns an iterable of facts matching given criteria.  If `readonly`
+        is `True`, the facts are lightweight
+        :class:`~timetra.diary.models.FactView` objects (for backends that
+        support them) which cannot be modified.
+
+        :param fields:
+            if given, named tuples with only these fields (e.g. `since` and
+            `until`) are returned instead of facts.
+        :param order:
+            ``asc`` (oldest first, default) or ``desc`` (newest first).
+        :param limit:
+            the maximum number of facts to return.
+        :param offset:
+            the number of matching facts to skip.
+        :param query:
+            a query string, e.g. ``tag:work NOT activity:email duration>1h``
+            (see :mod:`timetra.diary.querying` for the syntax).  Raises
+            :class:`~timetra.diary.querying.QuerySyntaxError` if malformed.
+
+        E.g. the latest 20 facts of an activity::
+
+            storage.find(activity='foo', order='desc', limit=20)
+
+        The search stops as soon as enough facts are found.
+        """
+        kwargs = {}
+        if readonly:
+            kwargs.update(readonly=True)
+        if fields is not None:
+            kwargs.update(fields=fields)
+        if order != 'asc':
+            kwargs.update(order=order)
+        if limit is not None:
+            kwargs.update(limit=limit)
+        if offset:
+            kwargs.update(offset=offset)
+        if query is not None:
+            kwargs.update(query=query)
         return self.backend.find(since=since, until=until, activity=activity,
-                                 description=description, tag=tag)
+                                 description=description, tag=tag, **kwargs)
+
+    def aggregate(self, since=None, until=None, group_by='activity',
+                  metric='duration'):
+        """
+        Returns an `OrderedDict` of totals for the facts that :meth:`find`
+        would return for the same `since` and `until`.
+
+        :param group_by:
+            `activity`, `category`, `tag`, `day`, `week` (keyed by Monday) or
+            `month` (keyed by the first day).  Periods are determined by the
+            start of the fact.
+        :param metric:
+            `duration` (a `timedelta`) or `count`.
+        """
+        if hasattr(self.backend, 'aggregate'):
+            return self.backend.aggregate(since=since, until=until,
+                                          group_by=group_by, metric=metric)
+        facts = self.backend.find(since=since, until=until)
+        return aggregation.aggregate_facts(facts, group_by, metric)
+
+    def search(self, query, limit=20):
+        """
+        Returns a list of up to `limit`
+        :class:`~timetra.diary.search.SearchResult` tuples for the facts that
+        mention any of the words in `query` in their activity or description
+        (case-insensitive), most relevant first.
+        """
+        return self.backend.search(query, limit=limit)
 
-    def find_overlapping_facts(self, since, until, days_before=1):
+    def find_overlapping_facts(self, since, until):
         """
         Returns a generator that yields facts overlapping given boundaries.
         This *may* behave as `find()` but it is intended to be more precise
         (down to seconds instead of days).
 
         :param since: date and time when the gap starts
-        :param until: date and time when the gap ends
-        :param days_before: the number of days prior to `since` to look at
+        :param until: date and time when the gap ends (`None` for no end)
 
-        By default the check only spans the `since..until` period and the day
-        before `since`.  Thus, facts spanning more than one day (and beginning
-        before `since - 1 day`) may not be detected.  Tune `days_before` to
-        change this behaviour.
+        Facts of any length are detected if the backend has its own
+        `find_overlapping_facts()`.  Otherwise the facts are looked up with
+        `find()` from the day before `since`, so longer facts may be missed.
         """
         ## Wanna write unit tests?  Here are the rules.
         #
@@ -363,14 +947,14 @@ class Storage:
         #  * starts and ends before the gap;
         #  * starts and ends after the gap.
         #
-        _since = since - datetime.timedelta(days=days_before)
-        facts = self.find(since=_since, until=until)
-        for fact in facts:
-            if fact.since < since and fact.until <= until:
-                continue
-            if fact.since >= since and fact.until > until:
-                continue
-            yield fact
+        if hasattr(self.backend, 'find_overlapping_facts'):
+            return self.backend.find_overlapping_facts(since, until)
+        facts = self.find(since=since - datetime.timedelta(days=1),
+                          until=until)
+        # `None` is an open end, both for the gap and for an ongoing fact
+        return (x for x in facts
+                if (until is None or x.since < until) and
+                (x.until is None or since < x.until))
 
     def add(self, fact):
         """Adds given fact to the database.  Returns whatever the backend
@@ -389,6 +973,15 @@ class Storage:
         #self.backend[fact.since] = fact
         return self.backend.add(fact)
 
+    def add_many(self, facts):
+        """Adds given facts to the database in bulk.  Returns whatever the
+        backend returned.
+        """
+        fields = ('activity', 'since', 'until', 'description', 'tags')
+        facts = list(facts)
+        assert all(x in fact for fact in facts for x in fields)
+        return self.backend.add_many(facts)
+
     def update(self, fact, values):
         assert fact
         assert values
@@ -409,9 +1002,9 @@ class Storage:
         :return: {'category': CATEGORY, 'activity': ACTIVITY}
         """
         seen = {}
-        for fact in self.find():
-            pair = fact.activity, fact.category
-            seen[pair] = seen.get(pair, 0) + 1
+        for item in self.get_known_activities():
+            pair = item['activity'], item['category']
+            seen[pair] = item.get('count', 0)
 
         # look for exact matches
         sorted_seen = [x for x in sorted(seen, key=seen.get, reverse=True)]
@@ -436,6 +1029,12 @@ class Storage:
         return {'activity': activity, 'category': category}
 
     def get_known_activities(self):
+        """
+        Returns a list of dictionaries with keys `activity` and `category`
+        for each distinct pair found in the facts, ordered by category and
+        activity.  Backends may also provide `count` (the number of facts)
+        and `last_seen` (the start of the latest fact).
+        """
         return self.backend.get_known_activities()
 
 
@@ -0,0 +1,166 @@
+# coding: utf-8
+#
+#    Timetra is a time tracking application and library.
+#    Copyright © 2010-2014  Andrey Mikhaylenko
+#
+#    This file is part of Timetra.
+#
+#    Timetra is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Timetra is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with Timetra.  If not, see <http://gnu.org/licenses/>.
+#
+"""
+Validation
+==========
+
+A faster replacement for :func:`monk.validate` for the data structures used
+here.
+
+The structure specification is translated by monk and then compiled into
+a Python function that checks the common cases with plain expressions.  If
+that check fails, the data is validated by monk, so the error is exactly the
+same as before.  Specifications that cannot be compiled are always handed
+over to monk.
+"""
+import monk
+from monk import validators
+
+
+__all__ = ['compile_validator']
+
+
+class _Compiler:
+    def __init__(self):
+        self.namespace = {}
+
+    def constant(self, value):
+        name = '_c{}'.format(len(self.namespace))
+        self.namespace[name] = value
+        return name
+
+    def expr(self, validator, var, depth=0):
+        """
+        Returns a Python expression that is true if the value of given
+        variable is valid, or `None` if the validator is not supported.
+        """
+        if isinstance(validator, validators.IsA):
+            return 'isinstance({}, {})'.format(
+                var, self.constant(validator.expected_type))
+
+        if isinstance(validator, validators.Equals):
+            if validator._expected_value is None:
+                return '{} is None'.format(var)
+            return '{} == {}'.format(var,
+                                     self.constant(validator._expected_value))
+
+        if isinstance(validator, validators.NotExists):
+            # the value is there if we got this far
+            return 'False'
+
+        if isinstance(validator, validators.Any):
+            parts = [self.expr(x, var, depth) for x in validator._specs]
+            if None in parts:
+                return None
+            return '({})'.format(' or '.join(parts))
+
+        if isinstance(validator, validators.ListOf):
+            item = '_x{}'.format(depth)
+            nested = self.expr(validator._nested_validator, item, depth + 1)
+            if nested is None:
+                return None
+            parts = ['isinstance({}, list)'.format(var)]
+            try:
+                validator._nested_validator(validators.MISSING)
+            except monk.ValidationError:
+                # monk does not accept an empty list in this case
+                parts.append('len({}) > 0'.format(var))
+            parts.append('all({} for {} in {})'.format(nested, item, var))
+            return '({})'.format(' and '.join(parts))
+
+        return None
+
+    def key(self, validator):
+        "Returns `(key, required)` or `None` if the key is not supported."
+        if isinstance(validator, validators.Equals):
+            return validator._expected_value, True
+        if isinstance(validator, validators.Any) and len(validator._specs) == 2:
+            equals, not_exists = validator._specs
+            if (isinstance(equals, validators.Equals) and
+                    isinstance(not_exists, validators.NotExists)):
+                return equals._expected_value, False
+        return None
+
+    def compile(self, structure):
+        "Returns a function that checks the data, or `None`."
+        translated = monk.translate(structure)
+        if isinstance(translated, validators.DictOf):
+            clauses = self.dict_clauses(translated)
+        else:
+            # e.g. a model class, which is translated to `IsA`
+            expr = self.expr(translated, 'data')
+            clauses = None if expr is None else [expr]
+        if clauses is None:
+            return None
+
+        source = 'def check(data):\n    return ({})\n'.format(
+            '\n            and '.join(clauses))
+        exec(source, self.namespace)
+        return self.namespace['check']
+
+    def dict_clauses(self, translated):
+        "Returns a list of expressions that check a dictionary, or `None`."
+        clauses = ['isinstance(data, dict)']
+        known = []
+        for key_validator, value_validator in translated._pairs:
+            key = self.key(key_validator)
+            if key is None:
+                return None
+            key, required = key
+            known.append(key)
+            value = 'data[{}]'.format(self.constant(key))
+            expr = self.expr(value_validator, value)
+            if expr is None:
+                return None
+            if required:
+                clauses.append('({} in data and {})'.format(
+                    self.constant(key), expr))
+            else:
+                clauses.append('({} not in data or {})'.format(
+                    self.constant(key), expr))
+        clauses.append('not data.keys() - {}'.format(
+            self.constant(frozenset(known))))
+        return clauses
+
+
+def compile_validator(structure):
+    """
+    Returns a function `validate(data, path=None)` that behaves like
+    `monk.validate(structure, data)`.  If `path` is given, it is prepended to
+    the error message.
+    """
+    try:
+        check = _Compiler().compile(structure)
+    except AttributeError:
+        # the internals of monk have changed
+        check = None
+
+    def validate(data, path=None):
+        if check is not None and check(data):
+            return
+        try:
+            monk.validate(structure, data)
+        except (monk.ValidationError, TypeError) as e:
+            if path is None:
+                raise
+            raise type(e)('{path}: {e}'.format(path=path, e=e))
+
+    return validate
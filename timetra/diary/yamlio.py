@@ -0,0 +1,78 @@
+# coding: utf-8
+#
+#    Timetra is a time tracking application and library.
+#    Copyright © 2010-2014  Andrey Mikhaylenko
+#
+#    This file is part of Timetra.
+#
+#    Timetra is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Timetra is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with Timetra.  If not, see <http://gnu.org/licenses/>.
+#
+"""
+YAML I/O
+========
+
+Loading and dumping of day files.  The LibYAML-based safe loader and dumper
+are used if PyYAML was built with LibYAML; otherwise the pure-Python ones.
+"""
+from collections import OrderedDict
+
+import yaml
+
+
+__all__ = ['Literal', 'configure_yaml', 'load', 'dump', 'Loader', 'Dumper',
+           'HAS_LIBYAML']
+
+
+HAS_LIBYAML = hasattr(yaml, 'CSafeLoader') and hasattr(yaml, 'CSafeDumper')
+
+if HAS_LIBYAML:
+    Loader = yaml.CSafeLoader
+    Dumper = yaml.CSafeDumper
+else:
+    Loader = yaml.SafeLoader
+    Dumper = yaml.SafeDumper
+
+
+# http://stackoverflow.com/questions/8640959/how-can-i-control-what-scalar-form-pyyaml-uses-for-my-data
+class Literal(str):
+    pass
+
+def _represent_literal(dumper, data):
+    # the LibYAML emitter only accepts `str` proper, not subclasses
+    return dumper.represent_scalar('tag:yaml.org,2002:str', str(data),
+                                   style='|')
+
+
+def _represent_dictorder(self, data):
+    return self.represent_mapping('tag:yaml.org,2002:map', data.items())
+
+
+def configure_yaml():
+    # the default dumper is configured as well for code that calls
+    # `yaml.dump()` directly
+    for dumper in (yaml.Dumper, Dumper):
+        yaml.add_representer(Literal, _represent_literal, Dumper=dumper)
+        yaml.add_representer(OrderedDict, _represent_dictorder, Dumper=dumper)
+
+
+configure_yaml()
+
+
+def load(stream):
+    return yaml.load(stream, Loader=Loader)
+
+
+def dump(data, stream=None):
+    return yaml.dump(data, stream, Dumper=Dumper, allow_unicode=True,
+                     default_flow_style=False)